@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+
+from database import connect, DB_PATH
+from schema import migrate, ISO_DATE_FORMAT, ISO_DATETIME_FORMAT
+
+# Завершённые и отменённые записи старше этого срока уходят в архив, дней
+APPOINTMENTS_AFTER_DAYS = 365
+
+# Гости, выехавшие раньше этого срока и без записей в рабочей базе, дней
+GUESTS_AFTER_DAYS = 30
+
+# Сколько строк каждой таблицы переносится одной транзакцией: блокировка записи
+# держится недолго, и между пачками успевают пройти запросы интерфейса
+CHUNK_SIZE = 500
+
+# Как часто приложение (без сервера) и server.py переносят в архив то, что устарело, мс
+ARCHIVE_INTERVAL = 10 * 60 * 1000
+
+ARCHIVED_STATUSES = ('Выполнен', 'Отменен')
+
+GUEST_COLUMNS = '''id, last_name, first_name, middle_name, birth_date, passport, phone,
+                   check_in_date, check_out_date, room, notes, check_in, check_out'''
+APPOINTMENT_COLUMNS = 'id, guest_id, service_id, date, time, status, starts_at'
+
+# Схема архивного файла: те же столбцы, индексы - для выборок по истории
+ARCHIVE_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS archive.guests (
+         id INTEGER PRIMARY KEY, last_name TEXT NOT NULL, first_name TEXT NOT NULL, middle_name TEXT,
+         birth_date TEXT, passport TEXT, phone TEXT, check_in_date TEXT, check_out_date TEXT,
+         room TEXT, notes TEXT, check_in TEXT, check_out TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS archive.appointments (
+         id INTEGER PRIMARY KEY, guest_id INTEGER NOT NULL, service_id INTEGER NOT NULL,
+         date TEXT NOT NULL, time TEXT NOT NULL, status TEXT, starts_at TEXT)''',
+    "CREATE INDEX IF NOT EXISTS archive.idx_appointments_guest ON appointments (guest_id, starts_at)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_appointments_starts_at ON appointments (starts_at)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_guests_last_name ON guests (last_name)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_guests_check_in ON guests (check_in)",
+)
+
+# Рабочие и архивные строки вместе - для режима «с архивом», подставляются в запросы
+# вместо имени таблицы. Подзапрос, а не временное представление: соединения только
+# для чтения (READONLY_PROFILE) создать представление не могут. Условия WHERE
+# SQLite переносит внутрь обеих частей UNION ALL, и каждая идёт по своим индексам
+ALL_GUESTS = f'''(SELECT {GUEST_COLUMNS} FROM main.guests
+                  UNION ALL SELECT {GUEST_COLUMNS} FROM archive.guests)'''
+ALL_APPOINTMENTS = f'''(SELECT {APPOINTMENT_COLUMNS} FROM main.appointments
+                        UNION ALL SELECT {APPOINTMENT_COLUMNS} FROM archive.appointments)'''
+
+ARCHIVED_APPOINTMENTS = '''SELECT id FROM appointments
+                           WHERE status IN (?, ?) AND starts_at < ? ORDER BY starts_at LIMIT ?'''
+ARCHIVED_GUESTS = '''SELECT id FROM guests g
+                     WHERE check_out < ? AND NOT EXISTS (SELECT 1 FROM appointments a WHERE a.guest_id = g.id)
+                     ORDER BY check_out LIMIT ?'''
+
+
+def archive_file(path):
+    # sanatorium.db -> sanatorium_archive.db рядом с рабочей базой
+    root, ext = os.path.splitext(path)
+    return f"{root}_archive{ext or '.db'}"
+
+
+def archive_path(conn):
+    return archive_file(next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == 'main'))
+
+
+def is_attached(conn):
+    return any(row[1] == 'archive' for row in conn.execute("PRAGMA database_list"))
+
+
+def attach_archive(conn, create=True):
+    # Подключает архив под именем archive. Без create отсутствующий файл не создаётся,
+    # и функция возвращает False; схему существующего файла создал первый перенос.
+    # Вызывать вне транзакции
+    if is_attached(conn):
+        return True
+    path = archive_path(conn)
+    if not create and not os.path.exists(path):
+        return False
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    if create:
+        conn.execute("PRAGMA archive.journal_mode = WAL").fetchall()
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+    return True
+
+
+def horizons(appointment_days=APPOINTMENTS_AFTER_DAYS, guest_days=GUESTS_AFTER_DAYS, now=None):
+    now = now or datetime.now()
+    return ((now - timedelta(days=appointment_days)).strftime(ISO_DATETIME_FORMAT),
+            (now - timedelta(days=guest_days)).strftime(ISO_DATE_FORMAT))
+
+
+def move(cursor, table, columns, row_ids):
+    ids = json.dumps(row_ids)
+    # INSERT OR REPLACE: в режиме WAL транзакция над двумя файлами не атомарна между ними,
+    # и после сбоя строка может оказаться в архиве, оставшись в рабочей базе.
+    # Повторный перенос тогда просто перезапишет её
+    cursor.execute(f'''INSERT OR REPLACE INTO archive.{table} ({columns})
+                       SELECT {columns} FROM main.{table} WHERE id IN (SELECT value FROM json_each(?))''', (ids,))
+    cursor.execute(f"DELETE FROM main.{table} WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+
+
+def archive_chunk(cursor, appointments_before, guests_before, chunk_size=CHUNK_SIZE):
+    # Одна пачка; транзакцией управляет вызывающий. Флаг в maintenance не даёт триггерам
+    # сводных таблиц вычесть перенесённые строки из отчётов: история в них остаётся.
+    # Возвращает (id записей, id гостей)
+    cursor.execute("INSERT OR REPLACE INTO maintenance (name) VALUES ('archiving')")
+    cursor.execute(ARCHIVED_APPOINTMENTS, ARCHIVED_STATUSES + (appointments_before, chunk_size))
+    appointment_ids = [row[0] for row in cursor.fetchall()]
+    if appointment_ids:
+        move(cursor, 'appointments', APPOINTMENT_COLUMNS, appointment_ids)
+    cursor.execute(ARCHIVED_GUESTS, (guests_before, chunk_size))
+    guest_ids = [row[0] for row in cursor.fetchall()]
+    if guest_ids:
+        move(cursor, 'guests', GUEST_COLUMNS, guest_ids)
+    cursor.execute("DELETE FROM maintenance WHERE name = 'archiving'")
+    return appointment_ids, guest_ids
+
+
+def archive_counts(conn):
+    attached = attach_archive(conn, create=False)
+    counts = {}
+    for table in ('guests', 'appointments'):
+        live = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+        archived = conn.execute(f"SELECT COUNT(*) FROM archive.{table}").fetchone()[0] if attached else 0
+        counts[table] = (live, archived)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос старых записей и выехавших гостей в архив")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="перенести всё, что старше сроков")
+    run.add_argument('--days', type=int, default=APPOINTMENTS_AFTER_DAYS,
+                     help="возраст завершённых и отменённых записей, дней")
+    run.add_argument('--guest-days', type=int, default=GUESTS_AFTER_DAYS, help="дней после выезда гостя")
+    run.add_argument('--chunk', type=int, default=CHUNK_SIZE)
+    commands.add_parser('status', help="число строк в рабочей базе и в архиве")
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        migrate(conn)
+        if args.command == 'run':
+            attach_archive(conn)
+            appointments_before, guests_before = horizons(args.days, args.guest_days)
+            total_appointments = total_guests = 0
+            while True:
+                with conn:
+                    appointment_ids, guest_ids = archive_chunk(conn.cursor(), appointments_before, guests_before,
+                                                               args.chunk)
+                total_appointments += len(appointment_ids)
+                total_guests += len(guest_ids)
+                if len(appointment_ids) < args.chunk and len(guest_ids) < args.chunk:
+                    break
+            print(f"В архив перенесено записей: {total_appointments}, гостей: {total_guests}")
+        for table, (live, archived) in archive_counts(conn).items():
+            print(f"{table}\tв работе: {live}\tв архиве: {archived}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
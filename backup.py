@@ -0,0 +1,350 @@
+import argparse
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import connect, DB_PATH, READONLY_PROFILE
+from archive import archive_file, attach_archive
+
+# Куда складываются копии: рядом с базой, в подкаталоге
+BACKUP_DIR = 'backups'
+
+# Как часто делать копию, пока работает приложение или сервер, мс
+BACKUP_INTERVAL = 6 * 60 * 60 * 1000
+
+# Копия идёт шагами по BACKUP_PAGES страниц (4 КиБ - 4 МиБ за шаг), между шагами поток
+# спит BACKUP_PAUSE с: диск и процессор достаются и интерфейсу, и серверу
+BACKUP_PAGES = 1024
+BACKUP_PAUSE = 0.01
+
+# Размер блока при сжатии и распаковке, байт
+COPY_CHUNK = 1024 * 1024
+
+# Хранение: последние KEEP_LAST копий, плюс самая новая за каждый из KEEP_DAILY дней
+# и за каждую из KEEP_WEEKLY недель
+KEEP_LAST = 5
+KEEP_DAILY = 14
+KEEP_WEEKLY = 8
+
+STAMP_FORMAT = '%Y%m%d-%H%M%S'
+SUFFIX = '.db.gz'
+PART = '.part'
+
+# Недописанные файлы старше этого срока - остатки прерванных копий, с
+LEFTOVER_AGE = 24 * 60 * 60
+
+logger = logging.getLogger('sanatorium.backup')
+
+
+def backup_dir(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), BACKUP_DIR)
+
+
+def stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def backup_name(path, when):
+    return f"{stem(path)}-{when.strftime(STAMP_FORMAT)}{SUFFIX}"
+
+
+def list_backups(directory, name):
+    # [(время, путь)] копий базы name, от новых к старым
+    backups = []
+    prefix = f"{name}-"
+    for entry in os.listdir(directory) if os.path.isdir(directory) else []:
+        if not entry.startswith(prefix) or not entry.endswith(SUFFIX):
+            continue
+        try:
+            when = datetime.strptime(entry[len(prefix):-len(SUFFIX)], STAMP_FORMAT)
+        except ValueError:
+            continue
+        backups.append((when, os.path.join(directory, entry)))
+    return sorted(backups, reverse=True)
+
+
+def snapshot(path, target, pages=BACKUP_PAGES, pause=BACKUP_PAUSE, source=None, name='main'):
+    # Онлайн-копия базы в файл target через API резервного копирования SQLite.
+    # Источник - отдельное соединение только для чтения, так что рабочий поток приложения
+    # и сервер не ждут копию. Чтение держится одной транзакцией: в режиме WAL она видит
+    # один снимок базы, и копия не начинается заново после каждой чужой записи.
+    # Пока она открыта, checkpoint не может перенести WAL дальше снимка - файл -wal растёт.
+    # source - уже открытое соединение (восстановление копирует базу под своей блокировкой),
+    # name - схема в нём; транзакцию, открытую вызывающим, копия не закрывает
+    own = source is None
+    if own:
+        source = connect(path, READONLY_PROFILE)
+    destination = sqlite3.connect(target)
+    try:
+        begin = not source.in_transaction
+        if begin:
+            source.execute("BEGIN")
+            source.execute(f"SELECT COUNT(*) FROM {name}.sqlite_master").fetchone()
+        source.backup(destination, pages=pages, name=name,
+                      progress=lambda status, remaining, total: time.sleep(pause))
+        if begin:
+            source.rollback()
+        verify(destination)
+        # Копия - самостоятельный файл без -wal
+        destination.execute("PRAGMA journal_mode = DELETE").fetchall()
+    finally:
+        destination.close()
+        if own:
+            source.close()
+
+
+def verify(conn):
+    result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    if result != 'ok':
+        raise sqlite3.DatabaseError(f"Копия повреждена: {result}")
+
+
+def compress(source, target):
+    with open(source, 'rb') as raw, gzip.open(target, 'wb') as packed:
+        shutil.copyfileobj(raw, packed, COPY_CHUNK)
+
+
+def decompress(source, target):
+    with gzip.open(source, 'rb') as packed, open(target, 'wb') as raw:
+        shutil.copyfileobj(packed, raw, COPY_CHUNK)
+
+
+def backup_database(path=DB_PATH, directory=None, when=None, source=None, name='main'):
+    # Сжатая копия базы path -> путь к файлу. Пишется во временный файл и переименовывается
+    # в конце, поэтому в каталоге не бывает недописанных копий
+    directory = directory or backup_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, backup_name(path, when or datetime.now()))
+    raw = f"{target}{PART}.db"
+    packed = f"{target}{PART}"
+    started = time.perf_counter()
+    try:
+        snapshot(path, raw, source=source, name=name)
+        compress(raw, packed)
+        os.replace(packed, target)
+    finally:
+        for leftover in (raw, packed):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    logger.info("Копия %s: %.1f МиБ за %.1f с", target, os.path.getsize(target) / 2 ** 20,
+                time.perf_counter() - started)
+    return target
+
+
+def expired(backups, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY, now=None):
+    # Копии (от новых к старым), которые политика хранения больше не держит
+    now = now or datetime.now()
+    kept = {path for _, path in backups[:keep_last]}
+    days, weeks = set(), set()
+    for when, path in backups:
+        day, week = when.date(), when.isocalendar()[:2]
+        if day not in days and when > now - timedelta(days=keep_daily):
+            days.add(day)
+            kept.add(path)
+        if week not in weeks and when > now - timedelta(weeks=keep_weekly):
+            weeks.add(week)
+            kept.add(path)
+    return [path for _, path in backups if path not in kept]
+
+
+def prune(directory, name, **policy):
+    removed = expired(list_backups(directory, name), **policy)
+    # Копия, прерванная выходом из программы, оставляет недописанные файлы
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if (entry.startswith(f"{name}-") and PART in entry
+                and time.time() - os.path.getmtime(path) > LEFTOVER_AGE):
+            removed.append(path)
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def backup_all(path=DB_PATH, directory=None):
+    # Копии рабочей базы и архива (если он есть) с одной отметкой времени, затем
+    # удаление устаревших. Возвращает пути новых копий. Обе копии снимаются с одного
+    # соединения в одной транзакции чтения: перенос в архив, идущий в это время, не
+    # попадает между ними, и строка не оказывается в обеих копиях или ни в одной
+    if not os.path.exists(path):
+        return []
+    directory = directory or backup_dir(path)
+    when = datetime.now()
+    conn = connect(path, READONLY_PROFILE)
+    try:
+        while True:
+            attached = attach_archive(conn, create=False)
+            conn.execute("BEGIN")
+            conn.execute("SELECT COUNT(*) FROM main.sqlite_master").fetchone()
+            if attached:
+                conn.execute("SELECT COUNT(*) FROM archive.sqlite_master").fetchone()
+                break
+            # Архива нет и после начала снимка - переносов в снимке нет. Появился - снимаем
+            # заново уже вместе с ним
+            if not os.path.exists(archive_file(path)):
+                break
+            conn.rollback()
+        sources = [(path, 'main')]
+        if attached:
+            sources.append((archive_file(path), 'archive'))
+        created = [backup_database(source, directory, when, conn, name) for source, name in sources]
+        conn.rollback()
+    finally:
+        conn.close()
+    for source, _ in sources:
+        prune(directory, stem(source))
+    return created
+
+
+def backup_set(backup, path):
+    # Копия рабочей базы и копия архива с той же отметкой времени (их делает один вызов
+    # backup_all) -> [(копия, база)]. Если копии архива нет, в тот момент архива не было:
+    # (None, архив) - текущий архив будет убран, иначе строки, перенесённые в него
+    # после копии, появились бы в режиме «с архивом» дважды
+    name = os.path.basename(backup)
+    prefix = f"{stem(path)}-"
+    try:
+        when = datetime.strptime(name[len(prefix):-len(SUFFIX)], STAMP_FORMAT)
+    except ValueError:
+        when = None
+    if when is None or not name.startswith(prefix) or not name.endswith(SUFFIX):
+        raise ValueError(f"{backup} - не копия базы {path}")
+    archive = archive_file(path)
+    archive_backup = os.path.join(os.path.dirname(backup), backup_name(archive, when))
+    return [(backup, path), (archive_backup if os.path.exists(archive_backup) else None, archive)]
+
+
+def lock_database(path):
+    # Соединение, единолично держащее базу до закрытия. Из режима WAL база выходит,
+    # только если её не держит открытой ни одно другое соединение, - так и проверяем,
+    # что приложение, сервер и копирование не работают
+    conn = sqlite3.connect(path, timeout=0, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = DELETE").fetchall()
+        conn.execute("PRAGMA locking_mode = EXCLUSIVE").fetchall()
+        conn.execute("BEGIN EXCLUSIVE")
+        conn.execute("COMMIT")
+    except sqlite3.OperationalError as e:
+        conn.close()
+        raise sqlite3.OperationalError(f"База {path} открыта другой программой: закройте приложения "
+                                       f"и сервер и повторите восстановление") from e
+    return conn
+
+
+def restore(backup, path=DB_PATH):
+    # Восстановление рабочей базы и архива одним набором (backup_set). Содержимое переносится
+    # тем же API резервного копирования под единоличной блокировкой, а не копированием файла
+    # поверх - старый -wal не смешается с восстановленными страницами. Базы, открытые другой
+    # программой, не трогаются. Текущее состояние перед этим сохраняется в каталог копий.
+    # Возвращает пути сохранённых копий
+    targets = backup_set(backup, path)
+    raws, locks = {}, {}
+    try:
+        for source, destination in targets:
+            if source is not None:
+                raws[destination] = f"{destination}.restore"
+                decompress(source, raws[destination])
+                restored = sqlite3.connect(raws[destination])
+                try:
+                    verify(restored)
+                finally:
+                    restored.close()
+        for _, destination in targets:
+            if os.path.exists(destination):
+                locks[destination] = lock_database(destination)
+        # Отметка сохраняемого состояния не должна совпасть с восстанавливаемой копией
+        when = datetime.now()
+        while os.path.exists(os.path.join(backup_dir(path), backup_name(path, when))):
+            when += timedelta(seconds=1)
+        saved = [backup_database(destination, when=when, source=conn) for destination, conn in locks.items()]
+        for source, destination in targets:
+            if source is None:
+                # Архива в момент копии не было
+                if destination in locks:
+                    locks.pop(destination).close()
+                    os.remove(destination)
+                continue
+            if destination not in locks:
+                locks[destination] = lock_database(destination)
+            restored = sqlite3.connect(raws[destination])
+            try:
+                restored.backup(locks[destination])
+            finally:
+                restored.close()
+            locks[destination].execute("PRAGMA journal_mode = WAL").fetchall()
+    finally:
+        for conn in locks.values():
+            conn.close()
+        for raw in raws.values():
+            if os.path.exists(raw):
+                os.remove(raw)
+    return saved
+
+
+class BackupScheduler:
+    # Фоновый поток копий для приложения и сервера: раз в BACKUP_INTERVAL, считая от
+    # последней копии в каталоге, так что перезапуск не вызывает лишней копии
+    def __init__(self, path=DB_PATH, interval=BACKUP_INTERVAL):
+        self.path = path
+        self.interval = interval / 1000
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def due_in(self):
+        backups = list_backups(backup_dir(self.path), stem(self.path))
+        if not backups:
+            return 0
+        return max(0, self.interval - (datetime.now() - backups[0][0]).total_seconds())
+
+    def run(self):
+        while not self.stopped.wait(self.due_in()):
+            try:
+                backup_all(self.path)
+            except Exception:
+                logger.exception("Ошибка резервного копирования")
+                # Не повторяем сразу: следующая попытка через интервал
+                if self.stopped.wait(self.interval):
+                    return
+
+    def stop(self):
+        self.stopped.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резервные копии базы без остановки работы")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('run', help="сделать копию сейчас и удалить устаревшие")
+    commands.add_parser('list', help="показать копии")
+    restore_parser = commands.add_parser('restore', help="восстановить базу из копии")
+    restore_parser.add_argument('backup', nargs='?', help="файл копии; по умолчанию - последняя")
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    backups = list_backups(backup_dir(args.db), stem(args.db))
+    if args.command == 'run':
+        for created in backup_all(args.db):
+            print(created)
+    elif args.command == 'list':
+        for when, path in backups:
+            print(f"{when:%d.%m.%Y %H:%M:%S}\t{os.path.getsize(path) / 2 ** 20:.1f} МиБ\t{path}")
+    else:
+        if not args.backup and not backups:
+            parser.error("копий нет")
+        source = args.backup or backups[0][1]
+        saved = restore(source, args.db)
+        print(f"База {args.db} вместе с архивом восстановлена из {source}")
+        for path in saved:
+            print(f"Прежнее состояние сохранено в {path}")
+
+
+if __name__ == '__main__':
+    main()
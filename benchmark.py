@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from records import GUEST_INSERT, SERVICE_INSERT
+from repository import open_repository, PAGE_SIZE
+from schema import DATE_FORMAT, TIME_FORMAT, ISO_DATE_FORMAT, ISO_DATETIME_FORMAT
+from scheduling import ScheduleConflict
+
+# Размеры наборов по умолчанию: столько гостей и столько же записей
+SIZES = (10000, 100000, 1000000)
+SERVICES = 50
+
+# Сколько раз повторяется каждый замер
+REPEAT = 50
+
+# Во сколько раз замер может быть медленнее базового прогона, прежде чем считаться регрессией
+THRESHOLD = 1.25
+
+BATCH_SIZE = 10000
+
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+              'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров')
+FIRST_NAMES = ('Александр', 'Мария', 'Сергей', 'Елена', 'Дмитрий', 'Ольга', 'Андрей', 'Татьяна',
+               'Алексей', 'Наталья', 'Иван', 'Анна', 'Михаил', 'Ирина', 'Николай', 'Светлана')
+MIDDLE_NAMES = ('Иванович', 'Петрович', 'Сергеевич', 'Андреевна', 'Николаевна', 'Владимировна', '')
+SERVICE_NAMES = ('Массаж', 'Грязелечение', 'Жемчужная ванна', 'ЛФК', 'Ингаляция', 'Соляная пещера',
+                 'Физиотерапия', 'Бассейн', 'Душ Шарко', 'Кислородный коктейль')
+STATUSES = ('Запланирован',) * 6 + ('Выполнен',) * 3 + ('Отменен',)
+
+# Синтетическая история: проживания и записи за три года до этой даты
+HISTORY_END = datetime(2025, 1, 1)
+HISTORY_DAYS = 3 * 365
+
+
+def remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def fake_guests(count, rnd):
+    for i in range(count):
+        check_in = HISTORY_END - timedelta(days=rnd.randrange(HISTORY_DAYS))
+        check_out = check_in + timedelta(days=rnd.randint(3, 21))
+        birth = datetime(1940, 1, 1) + timedelta(days=rnd.randrange(60 * 365))
+        yield (rnd.choice(LAST_NAMES), rnd.choice(FIRST_NAMES), rnd.choice(MIDDLE_NAMES),
+               birth.strftime(DATE_FORMAT), f"{rnd.randint(1000, 9999)} {rnd.randint(100000, 999999)}",
+               f"+7 9{rnd.randint(10, 99)} {rnd.randint(100, 999)}-{rnd.randint(10, 99)}-{rnd.randint(10, 99)}",
+               check_in.strftime(DATE_FORMAT), check_out.strftime(DATE_FORMAT), str(rnd.randint(100, 399)), '',
+               check_in.strftime(ISO_DATE_FORMAT), check_out.strftime(ISO_DATE_FORMAT))
+
+
+def fake_appointments(count, guests, rnd):
+    for i in range(count):
+        starts = HISTORY_END - timedelta(days=rnd.randrange(HISTORY_DAYS), minutes=rnd.randrange(8 * 60, 20 * 60))
+        starts = starts.replace(minute=starts.minute // 15 * 15)
+        yield (rnd.randint(1, guests), rnd.randint(1, SERVICES),
+               starts.strftime(DATE_FORMAT), starts.strftime(TIME_FORMAT), rnd.choice(STATUSES),
+               starts.strftime(ISO_DATETIME_FORMAT))
+
+
+def insert_batches(conn, query, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            with conn:
+                conn.executemany(query, batch)
+            batch.clear()
+    if batch:
+        with conn:
+            conn.executemany(query, batch)
+
+
+def generate(path, guests, appointments, seed=0):
+    # Наполняет пустую базу; возвращает скорость вставки, строк/с.
+    # Вставка идёт через те же триггеры (FTS, сводные таблицы), что и в работе
+    rnd = random.Random(seed)
+    remove_database(path)
+    repo = open_repository(path)
+    conn = repo.conn
+    result = {}
+    try:
+        insert_batches(conn, SERVICE_INSERT,
+                       ((f"{SERVICE_NAMES[i % len(SERVICE_NAMES)]} {i + 1}", '', rnd.randint(5, 50) * 100,
+                         rnd.choice((20, 30, 45, 60))) for i in range(SERVICES)))
+        started = time.perf_counter()
+        insert_batches(conn, GUEST_INSERT, fake_guests(guests, rnd))
+        elapsed = time.perf_counter() - started
+        result['guests_per_s'] = round(guests / elapsed)
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO rooms (number) SELECT DISTINCT room FROM guests")
+        started = time.perf_counter()
+        insert_batches(conn, '''INSERT INTO appointments (guest_id, service_id, date, time, status, starts_at)
+                                VALUES (?, ?, ?, ?, ?, ?)''', fake_appointments(appointments, guests, rnd))
+        elapsed = time.perf_counter() - started
+        result['appointments_per_s'] = round(appointments / elapsed)
+        conn.execute("ANALYZE")
+        repo.checkpoint('TRUNCATE')
+    finally:
+        repo.close()
+    return result
+
+
+def measure(func, repeat=REPEAT):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {'min_ms': round(timings[0], 3),
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            'runs': repeat}
+
+
+def bench_paths(path, guests, appointments, repeat=REPEAT, seed=0):
+    # Пути данных, которые стоят за действиями в интерфейсе, без окна
+    rnd = random.Random(seed)
+    results = {}
+
+    def cold_start():
+        # Миграции и кэш имён услуг - всё, что делает open_database; расписание читается позже
+        repo = open_repository(path)
+        repo.service_labels()
+        repo.close()
+
+    results['cold_start'] = measure(cold_start, max(1, repeat // 10))
+
+    repo = open_repository(path)
+    try:
+        middle = appointments // 2
+        day = (HISTORY_END - timedelta(days=HISTORY_DAYS // 2)).date()
+        paths = {
+            # update_*_tree: первая страница и страница из середины списка
+            'refresh_guests': lambda: repo.list_guests(limit=PAGE_SIZE * 2),
+            'refresh_appointments': lambda: repo.list_appointments(limit=PAGE_SIZE * 2),
+            'scroll_appointments': lambda: repo.list_appointments(after=middle),
+            # Сортировка по заголовку и фильтры списка записей
+            'sort_guests': lambda: repo.list_guests(after=rnd.randint(1, guests), order='last_name'),
+            'filter_appointments_day': lambda: repo.list_appointments(
+                filters={'status': 'Запланирован', 'date_from': day.strftime('%d.%m.%Y'),
+                         'date_to': day.strftime('%d.%m.%Y')}),
+            'calendar_day': lambda: repo.appointments_between(day, day + timedelta(days=1)),
+            'calendar_week': lambda: repo.appointments_between(day, day + timedelta(days=7)),
+            # on_*_select
+            'select_appointment': lambda: repo.get_appointment(rnd.randint(1, appointments)),
+            'select_guest': lambda: repo.get_guest(rnd.randint(1, guests)),
+            # update_comboboxes и поиск по мере ввода
+            'guest_choices_latest': lambda: repo.guest_choices(''),
+            'guest_choices_search': lambda: repo.guest_choices(rnd.choice(LAST_NAMES)[:2]),
+            'service_labels': lambda: repo.service_labels(),
+            # Проверки перед удалением
+            'delete_guard_guest': lambda: repo.count_guest_appointments(rnd.randint(1, guests)),
+            'delete_guard_service': lambda: repo.count_service_appointments(rnd.randint(1, SERVICES)),
+            'report_revenue_by_day': lambda: repo.report('revenue_by_day', '01.01.2024', '31.12.2024'),
+            'report_occupancy': lambda: repo.report('occupancy', '01.01.2024', '31.12.2024'),
+            # Подбор номера на две недели и накладки за месяц; индекс занятости строится при первом вызове
+            'free_rooms': lambda: repo.free_rooms(day.strftime('%d.%m.%Y'),
+                                                  (day + timedelta(days=14)).strftime('%d.%m.%Y')),
+            'overbooked_rooms': lambda: repo.overbooked_rooms(day.strftime('%d.%m.%Y'),
+                                                              (day + timedelta(days=30)).strftime('%d.%m.%Y')),
+        }
+        for name, func in paths.items():
+            results[name] = measure(func, repeat)
+
+        # Запись по одной, каждая в своей транзакции, как из формы. Разные гости и
+        # часовые слоты каждой услуги в будущем, чтобы проверка пересечений пропускала
+        start = datetime(2100, 1, 1)
+        booked = 0
+        started = time.perf_counter()
+        for i in range(repeat * 10):
+            slot = start + timedelta(hours=i // SERVICES)
+            try:
+                repo.book(i % guests + 1, i % SERVICES + 1, slot.strftime(ISO_DATETIME_FORMAT))
+                booked += 1
+            except ScheduleConflict:
+                pass
+        results['book_per_s'] = round(booked / (time.perf_counter() - started))
+    finally:
+        repo.close()
+    return results
+
+
+def ensure_display():
+    # Возвращает процесс Xvfb, если его пришлось запустить, или None
+    if os.environ.get('DISPLAY') or not shutil.which('Xvfb'):
+        return None
+    display = ':97'
+    process = subprocess.Popen(['Xvfb', display, '-screen', '0', '1280x800x24'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1)
+    os.environ['DISPLAY'] = display
+    return process
+
+
+def bench_gui(directory, repeat=REPEAT):
+    # Время до появления строк в окне; база берётся из directory/sanatorium.db
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        return {'skipped': str(e)}
+    from source import SanatoriumApp
+
+    def wait(condition, timeout=30):
+        deadline = time.perf_counter() + timeout
+        while not condition():
+            if time.perf_counter() > deadline:
+                raise TimeoutError("окно не дождалось данных")
+            root.update()
+
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        results = {}
+        started = time.perf_counter()
+        # Без фонового переноса в архив и резервных копий: они исказили бы замеры
+        app = SanatoriumApp(root, maintenance=False)
+        # Вкладки строятся при первом показе: открываем записи, как это сделал бы пользователь
+        app.notebook.select(app.appointments_frame)
+        app.on_tab_changed()
+        wait(lambda: app.appointments_tree.get_children() and app.db.pending == 0)
+        results['cold_start'] = {'ms': round((time.perf_counter() - started) * 1000, 3)}
+
+        def refresh():
+            app.update_appointments_tree()
+            wait(lambda: app.appointments_tree.get_children() and app.db.pending == 0)
+
+        def select():
+            item = random.choice(app.appointments_tree.get_children())
+            app.appointments_tree.selection_set(item)
+            app.on_appointment_select(None)
+            root.update()
+
+        def comboboxes():
+            app.update_comboboxes()
+            wait(lambda: app.db.pending == 0)
+
+        results['refresh_appointments'] = measure(refresh, max(1, repeat // 5))
+        results['select_appointment'] = measure(select, repeat)
+        results['update_comboboxes'] = measure(comboboxes, max(1, repeat // 5))
+        app.db.close()
+        return results
+    finally:
+        os.chdir(cwd)
+        root.destroy()
+
+
+def environment():
+    return {'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform()}
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    # Замеры, медиана которых выросла больше чем в threshold раз: (размер, путь, было, стало)
+    previous = {run['guests']: run for run in baseline.get('runs', [])}
+    regressions = []
+    for run in results['runs']:
+        old = previous.get(run['guests'])
+        if not old:
+            continue
+        for name, value in run['paths'].items():
+            before = old['paths'].get(name)
+            if isinstance(value, dict) and isinstance(before, dict) and before['median_ms'] > 0:
+                if value['median_ms'] > before['median_ms'] * threshold:
+                    regressions.append((run['guests'], name, before['median_ms'], value['median_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры скорости работы с базой на синтетических данных")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="число гостей и записей")
+    parser.add_argument('--dir', default='bench', help="каталог для рабочей базы sanatorium.db")
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--gui', action='store_true', help="замерить и окно (нужен дисплей или Xvfb)")
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', help="JSON прошлого прогона для поиска регрессий")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    path = os.path.join(args.dir, 'sanatorium.db')
+    xvfb = ensure_display() if args.gui else None
+    results = dict(environment(), runs=[])
+    try:
+        for size in args.sizes:
+            print(f"Набор {size}: генерация...", flush=True)
+            run = {'guests': size, 'appointments': size}
+            run['generate'] = generate(path, size, size, args.seed)
+            print(f"Набор {size}: замеры...", flush=True)
+            run['paths'] = bench_paths(path, size, size, args.repeat, args.seed)
+            if args.gui:
+                run['gui'] = bench_gui(args.dir, args.repeat)
+            results['runs'].append(run)
+            for name, value in run['paths'].items():
+                print(f"  {name}: {value['median_ms'] if isinstance(value, dict) else value}")
+    finally:
+        if xvfb:
+            xvfb.terminate()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for size, name, before, after in regressions:
+            print(f"Регрессия {size} {name}: {before} -> {after} мс")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+GUEST_NAMES_SELECT = "SELECT id, last_name || ' ' || first_name || ' ' || COALESCE(middle_name, '') FROM guests"
+SERVICE_NAMES_SELECT = "SELECT id, name FROM services"
+
+
+class LookupCache:
+    # Отображаемые имена гостей и услуг по id. Загружаются один раз при первом
+    # обращении, дальше поддерживаются точечной инвалидацией по одной строке
+    def __init__(self, conn):
+        self.conn = conn
+        self.guests = None
+        self.services = None
+
+    def load(self):
+        self.guests = dict(self.conn.execute(GUEST_NAMES_SELECT).fetchall())
+        self.services = dict(self.conn.execute(SERVICE_NAMES_SELECT).fetchall())
+
+    def clear(self):
+        # После массовых изменений проще перечитать всё при следующем обращении
+        self.guests = None
+        self.services = None
+
+    def ensure_loaded(self):
+        if self.guests is None or self.services is None:
+            self.load()
+
+    def guest_name(self, guest_id):
+        self.ensure_loaded()
+        return self.guests.get(guest_id, '')
+
+    def service_name(self, service_id):
+        self.ensure_loaded()
+        return self.services.get(service_id, '')
+
+    def service_labels(self):
+        self.ensure_loaded()
+        return [f"{service_id}: {name}" for service_id, name in self.services.items()]
+
+    def invalidate_guest(self, guest_id):
+        if self.guests is not None:
+            self.reload_row(self.guests, GUEST_NAMES_SELECT, guest_id)
+
+    def invalidate_service(self, service_id):
+        if self.services is not None:
+            self.reload_row(self.services, SERVICE_NAMES_SELECT, service_id)
+
+    def reload_row(self, names, select, row_id):
+        row = self.conn.execute(f"{select} WHERE id = ?", (row_id,)).fetchone()
+        if row is None:
+            names.pop(row_id, None)
+        else:
+            names[row_id] = row[1]
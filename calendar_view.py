@@ -0,0 +1,264 @@
+import tkinter as tk
+from tkinter import ttk, messagebox
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from events import DELETE
+from scheduling import CANCELLED, WORKDAY_START, WORKDAY_END, from_minutes
+
+# Сколько окон (дней или недель) держим в кэше
+CACHE_WINDOWS = 9
+
+# Геометрия сетки, пикселей
+HOUR_HEIGHT = 48
+HEADER_HEIGHT = 24
+GUTTER_WIDTH = 50
+MIN_COLUMN_WIDTH = 120
+
+MODES = {'День': 1, 'Неделя': 7}
+ALL_SERVICES = 'Все услуги'
+WEEKDAYS = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+
+# Поля строки записи календаря, по которым ищутся записи гостя или услуги
+ENTRY_COLUMNS = ('id', 'guest', 'service_id', 'service', 'start', 'end', 'status', 'guest_id')
+
+# Цвет блока записи по статусу
+STATUS_COLORS = {'Запланирован': '#cfe2ff', 'Выполнен': '#d1e7dd', CANCELLED: '#e9ecef'}
+
+
+class CalendarView:
+    # Расписание на день (столбцы - услуги) или неделю (столбцы - дни), нарисованное на Canvas.
+    # Из базы читается только показанное окно дат; соседние окна подгружаются заранее
+    # и вместе с уже просмотренными хранятся в кэше, поэтому листание мгновенное.
+    # fetch(start, end, callback, errback) и fetch_row(appointment_id, callback, errback)
+    # асинхронны и отдают строки (id, гость, service_id, услуга, начало, конец, статус, guest_id),
+    # где начало и конец - минуты от EPOCH
+    def __init__(self, parent, fetch, fetch_row, on_select=None):
+        self.fetch = fetch
+        self.fetch_row = fetch_row
+        self.on_select = on_select
+        self.day = date.today()
+        self.mode = 'День'
+        self.service_id = None
+        self.selected = None
+        self.cache = OrderedDict()
+        self.loading = set()
+        # Ответы на запросы, отправленные до reload, отбрасываются
+        self.generation = 0
+
+        toolbar = ttk.Frame(parent)
+        toolbar.pack(fill='x', pady=2)
+        ttk.Button(toolbar, text="◀", width=3, command=lambda: self.move(-1)).pack(side='left')
+        ttk.Button(toolbar, text="Сегодня", command=self.today).pack(side='left', padx=2)
+        ttk.Button(toolbar, text="▶", width=3, command=lambda: self.move(1)).pack(side='left')
+        self.title_var = tk.StringVar()
+        ttk.Label(toolbar, textvariable=self.title_var).pack(side='left', padx=10)
+        self.service_combobox = ttk.Combobox(toolbar, state='readonly', values=[ALL_SERVICES], width=25)
+        self.service_combobox.set(ALL_SERVICES)
+        self.service_combobox.pack(side='right', padx=2)
+        self.service_combobox.bind('<<ComboboxSelected>>', self.on_service_filter)
+        self.mode_combobox = ttk.Combobox(toolbar, state='readonly', values=list(MODES), width=8)
+        self.mode_combobox.set(self.mode)
+        self.mode_combobox.pack(side='right', padx=2)
+        self.mode_combobox.bind('<<ComboboxSelected>>', self.on_mode)
+
+        frame = ttk.Frame(parent)
+        frame.pack(fill='both', expand=True)
+        self.canvas = tk.Canvas(frame, background='white', highlightthickness=0)
+        yscroll = ttk.Scrollbar(frame, orient='vertical', command=self.canvas.yview)
+        xscroll = ttk.Scrollbar(frame, orient='horizontal', command=self.canvas.xview)
+        self.canvas.configure(yscrollcommand=yscroll.set, xscrollcommand=xscroll.set)
+        yscroll.pack(side='right', fill='y')
+        xscroll.pack(side='bottom', fill='x')
+        self.canvas.pack(side='left', fill='both', expand=True)
+        self.canvas.bind('<Configure>', lambda event: self.draw())
+
+    # Окна: (режим, первый день); день end в окно не входит
+    def window(self, offset=0):
+        days = MODES[self.mode]
+        start = self.day - timedelta(days=self.day.weekday()) if days == 7 else self.day
+        return self.mode, start + timedelta(days=days * offset)
+
+    def bounds(self, key):
+        mode, start = key
+        return start, start + timedelta(days=MODES[mode])
+
+    def show(self):
+        key = self.window()
+        start, end = self.bounds(key)
+        last = end - timedelta(days=1)
+        self.title_var.set(start.strftime('%d.%m.%Y') if start == last
+                           else f"{start.strftime('%d.%m.%Y')} - {last.strftime('%d.%m.%Y')}")
+        self.draw()
+        self.load(key)
+        # Соседние окна - заранее, чтобы листание не ждало базы
+        self.load(self.window(-1))
+        self.load(self.window(1))
+
+    def load(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return
+        if key in self.loading:
+            return
+        self.loading.add(key)
+        generation = self.generation
+
+        def callback(rows):
+            if generation != self.generation:
+                return
+            self.loading.discard(key)
+            self.cache[key] = rows
+            while len(self.cache) > CACHE_WINDOWS:
+                self.cache.popitem(last=False)
+            if key == self.window():
+                self.draw()
+
+        def errback(error):
+            if generation == self.generation:
+                self.loading.discard(key)
+            messagebox.showerror("Ошибка", f"Ошибка при загрузке расписания: {str(error)}")
+
+        self.fetch(*self.bounds(key), callback, errback)
+
+    def reload(self):
+        # Сбрасывает кэш; нужно, когда изменились имена или длительности услуг
+        self.generation += 1
+        self.cache.clear()
+        self.loading.clear()
+        self.show()
+
+    def patch(self, kind, appointment_id):
+        # Точечное обновление одной записи во всех закэшированных окнах
+        if kind == DELETE:
+            self.place(appointment_id, None)
+            return
+        generation = self.generation
+
+        def apply(row):
+            if generation == self.generation:
+                self.place(appointment_id, row)
+
+        self.fetch_row(appointment_id, apply,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при загрузке расписания: {str(e)}"))
+
+    def entries_of(self, column, row_id):
+        # id закэшированных записей гостя (column='guest_id') или услуги ('service_id')
+        index = ENTRY_COLUMNS.index(column)
+        return sorted({row[0] for rows in self.cache.values() for row in rows if row[index] == row_id})
+
+    def place(self, appointment_id, row):
+        self.place_rows({appointment_id: row})
+
+    def place_rows(self, rows_by_id):
+        # {id записи: строка или None для удалённой}; после массовой операции - одна перерисовка
+        for key, rows in self.cache.items():
+            rows[:] = [r for r in rows if r[0] not in rows_by_id]
+            start, end = self.bounds(key)
+            rows += [row for row in rows_by_id.values()
+                     if row is not None and row[4] is not None and start <= from_minutes(row[4]).date() < end]
+            rows.sort(key=lambda r: (r[4], r[0]))
+        self.draw()
+
+    # Навигация
+    def move(self, step):
+        self.day += timedelta(days=MODES[self.mode] * step)
+        self.show()
+
+    def today(self):
+        self.day = date.today()
+        self.show()
+
+    def open_day(self, day):
+        self.day = day
+        self.mode = 'День'
+        self.mode_combobox.set(self.mode)
+        self.show()
+
+    def on_mode(self, event=None):
+        self.mode = self.mode_combobox.get()
+        self.show()
+
+    def set_services(self, labels):
+        self.service_combobox['values'] = [ALL_SERVICES] + list(labels)
+
+    def on_service_filter(self, event=None):
+        # Фильтр по услуге применяется к уже загруженному окну, без запроса
+        label = self.service_combobox.get()
+        self.service_id = None if label == ALL_SERVICES else int(label.partition(':')[0])
+        self.draw()
+
+    def select(self, appointment_id):
+        self.selected = appointment_id
+        self.draw()
+        if self.on_select:
+            self.on_select(appointment_id)
+
+    # Отрисовка
+    def columns(self, key, rows):
+        # Список (заголовок, ключ столбца) и функция, относящая запись к столбцу
+        mode, start = key
+        if MODES[mode] == 7:
+            days = [start + timedelta(days=i) for i in range(7)]
+            return ([(f"{WEEKDAYS[d.weekday()]} {d.strftime('%d.%m')}", d) for d in days],
+                    lambda row: from_minutes(row[4]).date())
+        services = sorted({(row[3], row[2]) for row in rows})
+        return [(name, service_id) for name, service_id in services], lambda row: row[2]
+
+    def draw(self):
+        canvas = self.canvas
+        canvas.delete('all')
+        key = self.window()
+        rows = self.cache.get(key)
+        if rows is None:
+            canvas.create_text(10, 10, anchor='nw', text="Загрузка...", fill='gray')
+            return
+        if self.service_id is not None:
+            rows = [row for row in rows if row[2] == self.service_id]
+        columns, column_of = self.columns(key, rows)
+        if not columns:
+            canvas.create_text(10, 10, anchor='nw', text="Нет записей", fill='gray')
+            canvas.configure(scrollregion=(0, 0, 0, 0))
+            return
+
+        # Сетка по часам рабочего дня, расширенная, если записи выходят за его пределы
+        first = min([WORKDAY_START] + [row[4] % 1440 for row in rows]) // 60
+        last = -(-max([WORKDAY_END] + [row[4] % 1440 + row[5] - row[4] for row in rows]) // 60)
+        last = min(last, 24)
+        width = max(MIN_COLUMN_WIDTH, (canvas.winfo_width() - GUTTER_WIDTH) // len(columns))
+        height = HEADER_HEIGHT + (last - first) * HOUR_HEIGHT
+        right = GUTTER_WIDTH + width * len(columns)
+
+        for hour in range(first, last + 1):
+            y = HEADER_HEIGHT + (hour - first) * HOUR_HEIGHT
+            canvas.create_line(GUTTER_WIDTH, y, right, y, fill='#dee2e6')
+            if hour < last:
+                canvas.create_text(GUTTER_WIDTH - 5, y + 2, anchor='ne', text=f"{hour:02d}:00", fill='gray')
+        index = {}
+        for i, (title, column) in enumerate(columns):
+            x = GUTTER_WIDTH + i * width
+            index[column] = i
+            canvas.create_line(x, 0, x, height, fill='#dee2e6')
+            header = canvas.create_text(x + width / 2, HEADER_HEIGHT / 2, text=title, width=width - 4)
+            if isinstance(column, date):
+                canvas.tag_bind(header, '<Button-1>', lambda event, day=column: self.open_day(day))
+
+        for row in rows:
+            appointment_id, guest, _, service, start, end, status, _ = row
+            i = index.get(column_of(row))
+            if i is None:
+                continue
+            x = GUTTER_WIDTH + i * width
+            y1 = HEADER_HEIGHT + (start % 1440 - first * 60) * HOUR_HEIGHT / 60
+            y2 = max(y1 + 14, y1 + (end - start) * HOUR_HEIGHT / 60)
+            tag = f"a{appointment_id}"
+            label = f"{from_minutes(start).strftime('%H:%M')} {guest}"
+            if MODES[self.mode] == 7 and self.service_id is None:
+                label += f"\n{service}"
+            canvas.create_rectangle(x + 2, y1 + 1, x + width - 2, y2 - 1, tags=(tag,),
+                                    fill=STATUS_COLORS.get(status, '#fff3cd'),
+                                    outline='black' if appointment_id == self.selected else '#6c757d',
+                                    width=2 if appointment_id == self.selected else 1)
+            canvas.create_text(x + 5, y1 + 2, anchor='nw', text=label, width=width - 10, tags=(tag,))
+            canvas.tag_bind(tag, '<Button-1>', lambda event, a=appointment_id: self.select(a))
+        canvas.configure(scrollregion=(0, 0, right, height))
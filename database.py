@@ -0,0 +1,49 @@
+import sqlite3
+
+DB_PATH = 'sanatorium.db'
+
+# Профиль соединения: PRAGMA, которые применяются при каждом подключении.
+# WAL позволяет читать базу из другого процесса (отчёты) во время записи, а
+# synchronous=NORMAL в режиме WAL делает fsync только при checkpoint, а не на каждый commit
+DEFAULT_PROFILE = {
+    'busy_timeout': 5000,       # мс ожидания блокировки вместо немедленной ошибки
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'cache_size': -32000,       # отрицательное значение - размер в КиБ
+    'mmap_size': 268435456,     # 256 МиБ
+    'temp_store': 'MEMORY',
+}
+
+# Для отчётов, выгрузок и копий из отдельного соединения: без права записи и без PRAGMA,
+# которые касаются только записи. journal_mode к тому же сам пишет в файл базы: на файле
+# только для чтения или занятом другой программой он ждёт блокировку или падает. Режим
+# WAL хранится в файле, и читатель работает в нём и так
+WRITE_PRAGMAS = ('journal_mode', 'synchronous', 'foreign_keys')
+READONLY_PROFILE = dict({name: value for name, value in DEFAULT_PROFILE.items() if name not in WRITE_PRAGMAS},
+                        query_only='ON')
+
+# Сколько подготовленных выражений sqlite3 держит на соединение. Все запросы
+# приложения - постоянные строки, поэтому при повторе компиляция не нужна
+STATEMENT_CACHE_SIZE = 256
+
+# Как часто сбрасывать WAL в основной файл во время работы, мс
+CHECKPOINT_INTERVAL = 5 * 60 * 1000
+
+
+def connect(path=DB_PATH, profile=DEFAULT_PROFILE, **kwargs):
+    kwargs.setdefault('cached_statements', STATEMENT_CACHE_SIZE)
+    conn = sqlite3.connect(path, timeout=profile.get('busy_timeout', 5000) / 1000, **kwargs)
+    apply_profile(conn, profile)
+    return conn
+
+
+def apply_profile(conn, profile):
+    for name, value in profile.items():
+        # journal_mode возвращает строку с результатом, её нужно выбрать
+        conn.execute(f"PRAGMA {name} = {value}").fetchall()
+
+
+def checkpoint(conn, mode='PASSIVE'):
+    # PASSIVE не ждёт читателей; TRUNCATE при выходе ещё и обнуляет файл -wal
+    return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
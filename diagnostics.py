@@ -0,0 +1,205 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Порог, после которого запрос попадает в журнал медленных, мс
+SLOW_QUERY_MS = 100
+
+# Верхние границы корзин гистограммы времени выполнения, мс; последняя корзина - всё, что дольше
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+# Сколько последних медленных запросов держим в памяти
+SLOW_LOG_SIZE = 100
+
+logger = logging.getLogger('sanatorium.sql')
+
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+
+class StatementStats:
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+
+    def add_call(self, ms, rows):
+        self.calls += 1
+        self.rows += rows
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        bucket = 0
+        while bucket < len(BUCKETS_MS) and ms > BUCKETS_MS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def add_fetch(self, ms, rows):
+        # Чтение строк после execute: время и строки идут в итог, вызовом не считается
+        self.rows += rows
+        self.total_ms += ms
+
+
+class QueryStats:
+    # Статистика по тексту запроса: число вызовов, строк, суммарное и максимальное время
+    # и гистограмма времени execute(). Медленные запросы сохраняются вместе с планом
+    def __init__(self, threshold_ms=SLOW_QUERY_MS):
+        self.threshold_ms = threshold_ms
+        self.statements = {}
+        self.slow = deque(maxlen=SLOW_LOG_SIZE)
+        self.lock = threading.Lock()
+
+    def statement(self, sql):
+        stats = self.statements.get(sql)
+        if stats is None:
+            stats = self.statements[sql] = StatementStats()
+        return stats
+
+    def record(self, sql, ms, rows):
+        with self.lock:
+            self.statement(sql).add_call(ms, rows)
+
+    def record_fetch(self, sql, ms, rows):
+        with self.lock:
+            self.statement(sql).add_fetch(ms, rows)
+
+    def record_slow(self, sql, ms, parameters, plan):
+        entry = {'time': datetime.now().isoformat(timespec='seconds'), 'ms': round(ms, 3),
+                 'sql': sql, 'parameters': repr(parameters), 'plan': plan}
+        with self.lock:
+            self.slow.append(entry)
+        logger.warning("Медленный запрос (%.1f мс): %s\n  план: %s", ms, sql, '; '.join(plan) or '-')
+
+    def reset(self):
+        with self.lock:
+            self.statements.clear()
+            self.slow.clear()
+
+    def snapshot(self):
+        # Копия статистики, самые дорогие по суммарному времени - первыми
+        with self.lock:
+            statements = [{'sql': sql, 'calls': s.calls, 'rows': s.rows, 'total_ms': round(s.total_ms, 3),
+                           'avg_ms': round(s.total_ms / s.calls, 3) if s.calls else 0.0,
+                           'max_ms': round(s.max_ms, 3), 'histogram': list(s.histogram)}
+                          for sql, s in self.statements.items()]
+            slow = list(self.slow)
+        statements.sort(key=lambda s: s['total_ms'], reverse=True)
+        return {'threshold_ms': self.threshold_ms, 'buckets_ms': list(BUCKETS_MS),
+                'statements': statements, 'slow': slow}
+
+
+def dump(snapshot, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False, indent=2)
+
+
+def format_histogram(histogram):
+    # «≤1:20 ≤5:3 >1000:1» - только непустые корзины
+    labels = [f"≤{bound:g}" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]:g}"]
+    return ' '.join(f"{label}:{count}" for label, count in zip(labels, histogram) if count)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Засекает execute() и последующее чтение строк. Время одного выполнения копится
+    # до следующего execute, и если оно перешло порог, запрос один раз пишется в журнал
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.begin(sql, parameters, (time.perf_counter() - started) * 1000)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # Плана для пачки не строим: параметры уже израсходованы итератором
+            self.begin(sql, None, (time.perf_counter() - started) * 1000)
+
+    def begin(self, sql, parameters, ms):
+        self.sql = normalize(sql)
+        self.parameters = parameters
+        self.elapsed_ms = ms
+        self.logged = False
+        self.connection.stats.record(self.sql, ms, max(self.rowcount, 0))
+        self.check_slow()
+
+    def fetched(self, started, rows):
+        if getattr(self, 'sql', None) is None:
+            return
+        ms = (time.perf_counter() - started) * 1000
+        self.elapsed_ms += ms
+        self.connection.stats.record_fetch(self.sql, ms, rows)
+        self.check_slow()
+
+    def check_slow(self):
+        stats = self.connection.stats
+        if self.logged or self.elapsed_ms < stats.threshold_ms:
+            return
+        self.logged = True
+        stats.record_slow(self.sql, self.elapsed_ms, self.parameters, self.connection.query_plan(self.sql, self.parameters))
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self.fetched(started, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self.fetched(started, len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        row = super().__next__()
+        self.fetched(started, 1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Соединение, все запросы которого идут через InstrumentedCursor.
+    # Подключается как factory: connect(path, factory=InstrumentedConnection)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = QueryStats()
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute в C не вызывает cursor(), поэтому переопределяем и его
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        # Время commit - это в основном запись WAL на диск
+        started = time.perf_counter()
+        super().commit()
+        self.stats.record('COMMIT', (time.perf_counter() - started) * 1000, 0)
+
+    def query_plan(self, sql, parameters):
+        if parameters is None:
+            return []
+        try:
+            # Обычный курсор: сам план в статистику не попадает
+            cursor = sqlite3.Cursor(self)
+            return [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+        except sqlite3.Error:
+            return []
@@ -0,0 +1,24 @@
+from collections import namedtuple
+
+# Виды изменений строки
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+# Событие изменения одной строки таблицы
+Change = namedtuple('Change', ['table', 'kind', 'row_id'])
+
+
+class ChangeBus:
+    # Раздаёт события изменений подписанным представлениям, чтобы после
+    # каждой операции обновлялась только затронутая строка, а не вся таблица
+    def __init__(self):
+        self.handlers = {}
+
+    def subscribe(self, table, handler):
+        self.handlers.setdefault(table, []).append(handler)
+
+    def emit(self, table, kind, row_id):
+        change = Change(table, kind, row_id)
+        for handler in self.handlers.get(table, []):
+            handler(change)
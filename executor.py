@@ -0,0 +1,127 @@
+import queue
+import threading
+
+# Как часто главный поток забирает готовые результаты, мс
+POLL_INTERVAL = 20
+
+
+class DbExecutor:
+    # Рабочий поток, единолично владеющий соединением с БД. Главный поток Tk только
+    # ставит задания в очередь, а результаты получает через root.after, поэтому
+    # медленный запрос или fsync при commit() не останавливают перерисовку окна.
+    # connect() возвращает соединение или репозиторий - объект с rollback() и close()
+    def __init__(self, root, connect, disconnect=None, on_busy=None, on_error=None):
+        self.root = root
+        self.disconnect = disconnect
+        self.on_busy = on_busy
+        self.on_error = on_error
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, args=(connect,), daemon=True)
+        self.thread.start()
+        self.poll()
+
+    def submit(self, job, callback=None, errback=None, background=False, edit=False):
+        # job(conn) выполняется в рабочем потоке, callback(result) или errback(error) - в главном.
+        # Фоновые задания (опрос изменений) индикатор занятости не включают.
+        # edit - задание только вносит правки: такие задания подряд сохраняются одним commit
+        if not background:
+            self.pending += 1
+            if self.pending == 1 and self.on_busy:
+                self.on_busy(True)
+        self.requests.put((job, callback, errback, background, edit))
+
+    def run(self, connect):
+        try:
+            conn = connect()
+            error = None
+        except Exception as e:
+            conn = None
+            error = e
+        # Результаты правок в открытой группе: в главный поток они уходят только после
+        # commit группы, так что успех правки значит, что она сохранена. Группа сохраняется,
+        # как только очередь опустела, подошёл срок или следующее задание - не правка:
+        # чтение, выгрузка или отчёт не держат блокировку записи открытой транзакции,
+        # а рабочий поток никогда не ждёт новых заданий с несохранённой группой
+        held = []
+        while True:
+            if held and (self.requests.empty() or conn.group_due()):
+                self.release(conn, held)
+            request = self.requests.get()
+            if request is None:
+                break
+            job, callback, errback, background, edit = request
+            if held and not edit:
+                self.release(conn, held)
+            if conn is None:
+                self.results.put((errback, None, error, background))
+                continue
+            try:
+                outcome = (callback, errback, job(conn), None, background)
+            except Exception as e:
+                conn.rollback()
+                outcome = (callback, errback, None, e, background)
+            group = getattr(conn, 'group', None)
+            if group is not None or held:
+                held.append((group, outcome))
+            else:
+                self.deliver(None, outcome)
+        if conn is not None:
+            if held:
+                self.release(conn, held)
+            if self.disconnect:
+                try:
+                    self.disconnect(conn)
+                except Exception:
+                    pass
+            conn.close()
+
+    def release(self, conn, held):
+        try:
+            conn.commit_group()
+        except Exception:
+            # Ошибка записана в группе и достанется каждой её правке
+            pass
+        for group, outcome in held:
+            self.deliver(group, outcome)
+        held.clear()
+
+    def deliver(self, group, outcome):
+        callback, errback, result, error, background = outcome
+        if error is None and group is not None and group.error is not None:
+            error = group.error
+        if error is not None:
+            self.results.put((errback, None, error, background))
+        else:
+            self.results.put((callback, result, None, background))
+
+    def poll(self):
+        if self.closed:
+            return
+        # Следующий опрос планируем сразу: колбэк может открыть модальное окно
+        self.root.after(POLL_INTERVAL, self.poll)
+        while True:
+            try:
+                handler, result, error, background = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if not background:
+                self.pending -= 1
+                if self.pending == 0 and self.on_busy:
+                    self.on_busy(False)
+            if error is not None:
+                if handler:
+                    handler(error)
+                elif self.on_error:
+                    self.on_error(error)
+            elif handler:
+                handler(result)
+
+    def close(self, timeout=5):
+        if self.closed:
+            return
+        self.closed = True
+        self.requests.put(None)
+        self.thread.join(timeout)
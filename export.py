@@ -0,0 +1,151 @@
+import argparse
+import csv
+import json
+import os
+
+from database import connect, DB_PATH, READONLY_PROFILE
+from schema import to_iso_date
+from archive import attach_archive, ALL_APPOINTMENTS, ALL_GUESTS
+
+# Сколько строк читается из курсора и пишется на диск за раз
+CHUNK_SIZE = 1000
+
+# Выгрузки: заголовки столбцов и запрос. Фильтр по датам идёт по индексу starts_at.
+# {appointments} и {guests} - рабочие таблицы или, для выгрузки с архивом, ALL_APPOINTMENTS и ALL_GUESTS
+REPORTS = {
+    # Записи с ценами услуг - для бухгалтерии
+    'appointments': (
+        ('id', 'date', 'time', 'guest_id', 'guest', 'service_id', 'service', 'price', 'duration', 'status'),
+        '''SELECT a.id, a.date, a.time, a.guest_id,
+                  g.last_name || ' ' || g.first_name || ' ' || COALESCE(g.middle_name, ''),
+                  a.service_id, s.name, s.price, s.duration, a.status
+           FROM {appointments} a
+           JOIN {guests} g ON a.guest_id = g.id
+           JOIN services s ON a.service_id = s.id
+           WHERE a.starts_at >= ? AND a.starts_at < ?
+           ORDER BY a.starts_at, a.id'''),
+    # Лицевые счета гостей: начисления по каждому гостю в хронологическом порядке
+    'ledger': (
+        ('guest_id', 'guest', 'room', 'date', 'time', 'service', 'price', 'status'),
+        '''SELECT a.guest_id,
+                  g.last_name || ' ' || g.first_name || ' ' || COALESCE(g.middle_name, ''),
+                  g.room, a.date, a.time, s.name, s.price, a.status
+           FROM {appointments} a
+           JOIN {guests} g ON a.guest_id = g.id
+           JOIN services s ON a.service_id = s.id
+           WHERE a.starts_at >= ? AND a.starts_at < ?
+           ORDER BY a.guest_id, a.starts_at'''),
+}
+
+FORMATS = ('csv', 'json', 'parquet')
+
+
+def date_bounds(date_from=None, date_to=None):
+    # Границы dd.mm.YYYY включительно -> полуинтервал по ISO-строкам starts_at
+    start = to_iso_date(date_from) if date_from else ''
+    end = to_iso_date(date_to) if date_to else None
+    if (date_from and start is None) or (date_to and end is None):
+        raise ValueError("Даты периода должны быть в формате ДД.ММ.ГГГГ")
+    # '~' больше любого символа времени в starts_at, поэтому день date_to входит целиком
+    return start, f"{end}~" if end else '~'
+
+
+def read_chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def write_csv(path, columns, chunks):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+
+
+def write_json(path, columns, chunks):
+    # Массив объектов пишется по мере чтения, без сборки всего списка в памяти
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        separator = '\n'
+        for rows in chunks:
+            for row in rows:
+                f.write(separator + json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                separator = ',\n'
+        f.write('\n]\n')
+
+
+def write_parquet(path, columns, chunks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Для выгрузки в Parquet установите пакет pyarrow")
+    writer = None
+    try:
+        for rows in chunks:
+            # Каждая порция - отдельная row group, столбцы пишутся колонками
+            table = pa.Table.from_pydict({name: list(values) for name, values in zip(columns, zip(*rows))})
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.table({name: [] for name in columns}), path)
+
+
+WRITERS = {'csv': write_csv, 'json': write_json, 'parquet': write_parquet}
+
+
+def export(conn, report, path, fmt=None, date_from=None, date_to=None, chunk_size=CHUNK_SIZE, archive=False):
+    # Возвращает число выгруженных строк; archive - вместе с перенесёнными в архив, если он есть
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in WRITERS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    columns, query = REPORTS[report]
+    if archive and attach_archive(conn, create=False):
+        query = query.format(appointments=ALL_APPOINTMENTS, guests=ALL_GUESTS)
+    else:
+        query = query.format(appointments='appointments', guests='guests')
+    cursor = conn.cursor()
+    cursor.execute(query, date_bounds(date_from, date_to))
+    count = 0
+
+    def counted(chunks):
+        nonlocal count
+        for rows in chunks:
+            count += len(rows)
+            yield rows
+
+    WRITERS[fmt](path, columns, counted(read_chunks(cursor, chunk_size)))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка записей и лицевых счетов гостей")
+    parser.add_argument('report', choices=sorted(REPORTS))
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS, help="по умолчанию - по расширению файла")
+    parser.add_argument('--from', dest='date_from', help="ДД.ММ.ГГГГ, включительно")
+    parser.add_argument('--to', dest='date_to', help="ДД.ММ.ГГГГ, включительно")
+    parser.add_argument('--archive', action='store_true', help="вместе с записями из архива")
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    # Только чтение: выгрузку можно запускать, пока приложение работает
+    conn = connect(args.db, READONLY_PROFILE)
+    try:
+        count = export(conn, args.report, args.path, args.format, args.date_from, args.date_to,
+                       archive=args.archive)
+    finally:
+        conn.close()
+    print(f"Выгружено строк: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import csv
+import os
+from collections import namedtuple
+from datetime import date, datetime
+
+from database import connect, DB_PATH
+from schema import migrate, DATE_FORMAT
+from records import (GUEST_FIELDS, SERVICE_FIELDS, GUEST_INSERT, SERVICE_INSERT, ROOM_REGISTER,
+                     guest_values, service_values)
+from rooms import RoomIndex, RoomConflict
+
+# Сколько строк вставляется одной транзакцией
+BATCH_SIZE = 1000
+
+# Сколько сообщений об ошибках сохраняем; остальные только считаются
+MAX_REPORTED_ERRORS = 200
+
+ImportResult = namedtuple('ImportResult', ['imported', 'failed', 'errors'])
+
+# Что и как импортируется: заголовки файла сопоставляются и с подписями полей
+# формы, и с именами столбцов таблицы
+TARGETS = {
+    'guests': (GUEST_FIELDS, guest_values, GUEST_INSERT),
+    'services': (SERVICE_FIELDS, service_values, SERVICE_INSERT),
+}
+
+
+def header_map(header, fields):
+    columns = set(fields.values())
+    mapping = {}
+    for i, title in enumerate(header):
+        key = str(title or '').strip().rstrip(':').lower()
+        if key in fields:
+            mapping[i] = fields[key]
+        elif key in columns:
+            mapping[i] = key
+    return mapping
+
+
+def cell_text(value):
+    # Ячейки XLSX приходят типизированными, приводим их к тексту как из формы
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def read_xlsx(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportError("Для импорта из XLSX установите пакет openpyxl")
+    # read_only читает лист потоково, не загружая весь файл в память
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield [cell_text(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def read_rows(path):
+    if os.path.splitext(path)[1].lower() in ('.xlsx', '.xlsm'):
+        return read_xlsx(path)
+    return read_csv(path)
+
+
+def import_file(conn, target, path, batch_size=BATCH_SIZE, rooms=None):
+    # Построчно читает файл, проверяет строки теми же правилами, что и формы,
+    # и вставляет пачками по batch_size в отдельных транзакциях. Гости проверяются
+    # и на места в номере (rooms - занятость номеров, по умолчанию читается из БД):
+    # строки файла занимают номер сразу, так что следующие видят и их
+    fields, validate, insert = TARGETS[target]
+    if target != 'guests':
+        rooms = None
+    elif rooms is None:
+        rooms = RoomIndex()
+        rooms.load(conn)
+    rows = read_rows(path)
+    header = next(rows, None)
+    if header is None:
+        return ImportResult(0, 0, [])
+    mapping = header_map(header, fields)
+    if not mapping:
+        raise ValueError("В первой строке файла не найдено ни одного известного заголовка")
+
+    imported = failed = 0
+    errors = []
+    batch = []
+    # Номера вставленных гостей попадают в номерной фонд, как при сохранении формы;
+    # регистрируются только они и только новые, без просмотра всей таблицы
+    room_numbers = set()
+
+    def fail(line, message):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append((line, message))
+
+    def flush():
+        nonlocal imported
+        try:
+            with conn:
+                conn.executemany(insert, [values for _, values in batch])
+            imported += len(batch)
+            if rooms is not None:
+                room_numbers.update(values[8] for _, values in batch)
+        except Exception:
+            # Пачка не прошла целиком - вставляем по одной, чтобы найти виноватые строки
+            for line, values in batch:
+                try:
+                    with conn:
+                        conn.execute(insert, values)
+                    imported += 1
+                    if rooms is not None:
+                        room_numbers.add(values[8])
+                except Exception as e:
+                    fail(line, str(e))
+                    if rooms is not None:
+                        rooms.remove(('import', line))
+        batch.clear()
+
+    for line, row in enumerate(rows, start=2):
+        if not any(str(cell).strip() for cell in row):
+            continue
+        record = {column: row[i] for i, column in mapping.items() if i < len(row)}
+        try:
+            values = validate(record)
+            if rooms is not None:
+                rooms.check(None, values[8], values[10], values[11])
+                rooms.place(('import', line), values[8], values[10], values[11])
+        except (ValueError, RoomConflict) as e:
+            fail(line, str(e))
+            continue
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    new_rooms = sorted(number for number in room_numbers if number and number not in rooms.capacities)
+    if new_rooms:
+        with conn:
+            conn.executemany(ROOM_REGISTER, [(number,) for number in new_rooms])
+    return ImportResult(imported, failed, errors)
+
+
+def format_result(result):
+    lines = [f"Импортировано строк: {result.imported}, с ошибками: {result.failed}"]
+    lines += [f"Строка {line}: {message}" for line, message in result.errors]
+    if result.failed > len(result.errors):
+        lines.append(f"... и ещё {result.failed - len(result.errors)}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт отдыхающих и услуг из CSV/XLSX")
+    parser.add_argument('target', choices=sorted(TARGETS))
+    parser.add_argument('path')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        migrate(conn)
+        print(format_result(import_file(conn, args.target, args.path, args.batch_size)))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import json
+from datetime import date, datetime
+
+from events import INSERT, UPDATE, DELETE
+from scheduling import ScheduleConflict
+from rooms import RoomConflict
+
+# Общие для сервера (server.py) и клиента (remote.py) соглашения HTTP/JSON API
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+
+# Заголовок с идентификатором клиента: свои изменения клиент в ленте пропускает
+CLIENT_HEADER = 'X-Sanatorium-Client'
+
+# Сколько секунд сервер держит запрос /changes, если изменений нет
+LONG_POLL_TIMEOUT = 25
+
+# Методы SanatoriumRepository, доступные через API: чтение ...
+READ_METHODS = frozenset([
+    'list_guests', 'get_guest', 'search_guests', 'guest_choices', 'count_guest_appointments',
+    'list_services', 'get_service', 'service_labels', 'count_service_appointments',
+    'list_appointments', 'get_appointment', 'appointments_between', 'calendar_entry', 'next_free_slot',
+    'get_appointments', 'get_calendar_entries',
+    'list_rooms', 'count_room_guests', 'room_availability', 'free_rooms', 'overbooked_rooms',
+    'export', 'report', 'diagnostics', 'archive_counts',
+])
+
+# ... и изменения: метод -> (таблица, вид изменения, номер аргумента с id или None, если id - результат)
+WRITE_METHODS = {
+    'create_guest': ('guests', INSERT, None),
+    'update_guest': ('guests', UPDATE, 0),
+    'delete_guest': ('guests', DELETE, 0),
+    'create_service': ('services', INSERT, None),
+    'update_service': ('services', UPDATE, 0),
+    'delete_service': ('services', DELETE, 0),
+    'book': ('appointments', INSERT, None),
+    'update_appointment': ('appointments', UPDATE, 0),
+    'delete_appointment': ('appointments', DELETE, 0),
+    'create_room': ('rooms', INSERT, None),
+    'update_room': ('rooms', UPDATE, 0),
+    'delete_room': ('rooms', DELETE, 0),
+}
+
+# Массовые операции над записями: метод -> (таблица, вид изменения); результат - список id
+BULK_METHODS = {
+    'set_appointments_status': ('appointments', UPDATE),
+    'reschedule_appointments': ('appointments', UPDATE),
+    'delete_appointments': ('appointments', DELETE),
+    'cancel_guest_appointments': ('appointments', UPDATE),
+}
+
+# Перенос в архив: результат - (id записей, id гостей), для клиентов это удаление строк
+ARCHIVE_METHODS = frozenset(['archive_step'])
+
+# Массовые операции: клиенты после них перечитывают списки целиком
+RELOAD_METHODS = frozenset(['import_file'])
+
+# Служебные методы без изменения списков
+SERVICE_METHODS = frozenset(['rebuild_summaries', 'reset_diagnostics', 'set_slow_query_threshold'])
+
+# Методы с путём к файлу на сервере: метод -> номер аргумента с путём. Сервер
+# принимает только файлы внутри своего каталога обмена
+FILE_METHODS = {'export': 1, 'import_file': 1}
+
+METHODS = (READ_METHODS | set(WRITE_METHODS) | set(BULK_METHODS) | ARCHIVE_METHODS | RELOAD_METHODS
+           | SERVICE_METHODS)
+
+# Ошибки, которые передаются клиенту по имени и поднимаются у него тем же классом
+ERRORS = {'ValueError': ValueError, 'ScheduleConflict': ScheduleConflict, 'RoomConflict': RoomConflict}
+
+
+class RemoteError(Exception):
+    # Прочие ошибки сервера и недоступность сервера
+    pass
+
+
+def to_json(value):
+    # date и datetime в JSON не входят: передаём как {"$date": ISO}
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def from_json(value):
+    if len(value) == 1 and '$date' in value:
+        return date.fromisoformat(value['$date'])
+    if len(value) == 1 and '$datetime' in value:
+        return datetime.fromisoformat(value['$datetime'])
+    return value
+
+
+def encode(payload):
+    return json.dumps(payload, ensure_ascii=False, default=to_json).encode('utf-8')
+
+
+def decode(body):
+    return json.loads(body.decode('utf-8'), object_hook=from_json) if body else {}
+
+
+def error_payload(error):
+    name = type(error).__name__
+    return {'error': {'type': name if name in ERRORS else 'RemoteError', 'message': str(error)}}
+
+
+def raise_error(payload):
+    error = payload['error']
+    raise ERRORS.get(error['type'], RemoteError)(error['message'])
@@ -0,0 +1,73 @@
+from schema import to_iso_date
+
+# Поля форм в порядке столбцов таблиц; ключи словарей - подписи полей формы
+GUEST_FIELDS = {
+    'фамилия': 'last_name',
+    'имя': 'first_name',
+    'отчество': 'middle_name',
+    'дата рождения': 'birth_date',
+    'паспорт': 'passport',
+    'телефон': 'phone',
+    'дата заезда': 'check_in_date',
+    'дата выезда': 'check_out_date',
+    'номер комнаты': 'room',
+    'примечания': 'notes',
+}
+
+SERVICE_FIELDS = {
+    'название': 'name',
+    'описание': 'description',
+    'цена': 'price',
+    'длительность (мин)': 'duration',
+}
+
+GUEST_INSERT = '''INSERT INTO guests
+                  (last_name, first_name, middle_name, birth_date, passport, phone,
+                   check_in_date, check_out_date, room, notes, check_in, check_out)
+                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+# Номер, впервые указанный у гостя, попадает в номерной фонд с одним местом
+ROOM_REGISTER = "INSERT OR IGNORE INTO rooms (number) VALUES (?)"
+
+SERVICE_INSERT = '''INSERT INTO services
+                    (name, description, price, duration)
+                    VALUES (?, ?, ?, ?)'''
+
+
+def text_value(value):
+    # Значения приходят не только из формы: ячейки XLSX и JSON сервера бывают числами
+    return '' if value is None else str(value).strip()
+
+
+def date_value(text, title):
+    # Пустая дата допустима, нераспознанная - ошибка, а не NULL в ISO-столбце: без него
+    # проживание не участвует ни в проверке мест, ни в занятости
+    if not text:
+        return None
+    value = to_iso_date(text)
+    if value is None:
+        raise ValueError(f"{title}: ожидается дата в формате ДД.ММ.ГГГГ, получено «{text}»")
+    return value
+
+
+def guest_values(record):
+    # record: {столбец: текст}. Возвращает параметры GUEST_INSERT или бросает ValueError
+    values = tuple(text_value(record.get(column)) for column in GUEST_FIELDS.values())
+    if not values[0] or not values[1]:
+        raise ValueError("Фамилия и имя обязательны")
+    check_in_date, check_out_date = values[6], values[7]
+    return values + (date_value(check_in_date, "Дата заезда"), date_value(check_out_date, "Дата выезда"))
+
+
+def service_values(record):
+    name = text_value(record.get('name'))
+    if not name:
+        raise ValueError("Название услуги обязательно")
+    try:
+        price = float(text_value(record.get('price')).replace(',', '.'))
+        duration = int(text_value(record.get('duration')))
+    except ValueError:
+        raise ValueError("Цена и длительность должны быть числами")
+    if not price > 0 or duration <= 0:
+        raise ValueError("Цена и длительность должны быть больше нуля")
+    return (name, text_value(record.get('description')), price, duration)
@@ -0,0 +1,153 @@
+import http.client
+import queue
+import threading
+import time
+import uuid
+from functools import partial
+from urllib.parse import urlparse, urlencode
+
+from events import Change
+from executor import POLL_INTERVAL
+from protocol import (DEFAULT_URL, CLIENT_HEADER, LONG_POLL_TIMEOUT, METHODS, RemoteError,
+                      encode, decode, raise_error)
+
+# Ожидание ответа на обычный вызов, с
+REQUEST_TIMEOUT = 30
+
+# Пауза перед повторным подключением к недоступному серверу, с
+RETRY_DELAY = 2
+
+
+def new_client_id():
+    return uuid.uuid4().hex
+
+
+# Так выглядит соединение, закрытое сервером между запросами: запрос до сервера не дошёл.
+# Тайм-аут чтения сюда не входит - сервер мог уже выполнить вызов
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class HttpSession:
+    # Одно постоянное HTTP-соединение. Если сервер закрыл его между запросами,
+    # запрос повторяется по новому соединению. Прочие ошибки, в том числе тайм-аут,
+    # не повторяются: запись (book, create_guest) не должна выполниться дважды
+    def __init__(self, url, client_id, timeout):
+        address = urlparse(url)
+        self.host = address.hostname
+        self.port = address.port
+        self.client_id = client_id
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, payload=None):
+        body = encode(payload) if payload is not None else None
+        headers = {CLIENT_HEADER: self.client_id, 'Content-Type': 'application/json'}
+        while True:
+            reused = self.conn is not None
+            if not reused:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body, headers)
+                data = decode(self.conn.getresponse().read())
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                if not reused or not isinstance(e, STALE_CONNECTION_ERRORS):
+                    raise RemoteError(f"Сервер недоступен: {e}")
+        if 'error' in data:
+            raise_error(data)
+        return data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class RemoteRepository:
+    # Тот же интерфейс, что у SanatoriumRepository, но вызовы уходят на server.py.
+    # Используется из рабочего потока DbExecutor вместо локального репозитория
+    def __init__(self, url=DEFAULT_URL, client_id=None, timeout=REQUEST_TIMEOUT):
+        self.url = url
+        self.client_id = client_id or new_client_id()
+        self.session = HttpSession(url, self.client_id, timeout)
+
+    def call(self, method, *args, **kwargs):
+        return self.session.request('POST', '/call', {'method': method, 'args': args, 'kwargs': kwargs})['result']
+
+    def batch(self, calls):
+        # calls: [(метод, args, kwargs)]; выполняются на сервере в одной транзакции
+        calls = [{'method': method, 'args': args, 'kwargs': kwargs} for method, args, kwargs in calls]
+        return self.session.request('POST', '/batch', {'calls': calls})['results']
+
+    def __getattr__(self, name):
+        if name in METHODS:
+            return partial(self.call, name)
+        raise AttributeError(name)
+
+    # Транзакциями, WAL и журналом изменений управляет сервер
+    def rollback(self):
+        pass
+
+    def prune_changelog(self):
+        pass
+
+    def checkpoint(self, mode='PASSIVE'):
+        pass
+
+    def close(self):
+        self.session.close()
+
+
+class ChangeListener:
+    # Фоновый поток, который держит long-poll запрос /changes и передаёт изменения,
+    # сделанные другими клиентами, в главный поток Tk: on_change(Change) для строки,
+    # on_reset() - когда нужно перечитать всё (массовая операция, перезапуск сервера,
+    # слишком долгий обрыв связи)
+    def __init__(self, root, url, client_id, on_change, on_reset):
+        self.root = root
+        self.client_id = client_id
+        self.on_change = on_change
+        self.on_reset = on_reset
+        self.session = HttpSession(url, client_id, LONG_POLL_TIMEOUT + REQUEST_TIMEOUT)
+        self.events = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.poll()
+
+    def run(self):
+        epoch = seq = None
+        while not self.closed:
+            query = {'timeout': LONG_POLL_TIMEOUT}
+            if seq is not None:
+                query.update(epoch=epoch, since=seq)
+            try:
+                feed = self.session.request('GET', f"/changes?{urlencode(query)}")
+            except (RemoteError, ValueError):
+                time.sleep(RETRY_DELAY)
+                continue
+            if feed['reset'] or (epoch is not None and feed['epoch'] != epoch):
+                self.events.put(None)
+            for table, kind, row_id, client in feed['changes']:
+                if client != self.client_id:
+                    self.events.put(Change(table, kind, row_id))
+            epoch, seq = feed['epoch'], feed['seq']
+
+    def poll(self):
+        if self.closed:
+            return
+        self.root.after(POLL_INTERVAL, self.poll)
+        while True:
+            try:
+                change = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if change is None:
+                self.on_reset()
+            else:
+                self.on_change(change)
+
+    def close(self):
+        # Поток сам завершится после ответа на текущий long-poll
+        self.closed = True
@@ -0,0 +1,86 @@
+import argparse
+
+from database import connect, DB_PATH, READONLY_PROFILE
+from export import date_bounds
+from schema import migrate, rebuild_summaries
+from archive import attach_archive, ALL_APPOINTMENTS, ALL_GUESTS
+
+# Отчёты читают только сводные таблицы, которые триггеры из migration_4_summaries
+# обновляют при каждом изменении записей, услуг и гостей. Поэтому время построения
+# отчёта зависит от длины периода, а не от объёма накопленной истории.
+# Заголовки столбцов и запрос; у отчётов за период два параметра - границы дней.
+# {guests} - откуда брать имена: guests или ALL_GUESTS, если подключён архив
+REPORTS = {
+    'revenue_by_day': (
+        ('Дата', 'Записей', 'Выручка'),
+        '''SELECT day, SUM(appointments), SUM(revenue) FROM daily_service_revenue
+           WHERE day >= ? AND day < ?
+           GROUP BY day ORDER BY day'''),
+    'revenue_by_service': (
+        ('Услуга', 'Записей', 'Выручка'),
+        '''SELECT COALESCE(s.name, r.service_id), SUM(r.appointments), SUM(r.revenue)
+           FROM daily_service_revenue r LEFT JOIN services s ON s.id = r.service_id
+           WHERE r.day >= ? AND r.day < ?
+           GROUP BY r.service_id ORDER BY 3 DESC'''),
+    # Итоги по гостю хранятся за всё время, без разбивки по дням
+    'revenue_by_guest': (
+        ('Отдыхающий', 'Записей', 'Выручка'),
+        '''SELECT COALESCE(g.last_name || ' ' || g.first_name, r.guest_id), SUM(r.appointments), SUM(r.revenue)
+           FROM guest_service_revenue r LEFT JOIN {guests} g ON g.id = r.guest_id
+           GROUP BY r.guest_id ORDER BY 3 DESC'''),
+    'occupancy': (
+        ('Дата', 'Занято номеров', 'Проживает'),
+        '''SELECT day, SUM(room <> ''), SUM(guests) FROM daily_occupancy
+           WHERE day >= ? AND day < ?
+           GROUP BY day ORDER BY day'''),
+}
+
+
+def run_report(cursor, report, date_from=None, date_to=None, guests='guests'):
+    columns, query = REPORTS[report]
+    query = query.format(guests=guests)
+    if query.count('?'):
+        cursor.execute(query, date_bounds(date_from, date_to))
+    else:
+        cursor.execute(query)
+    return cursor.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сводные отчёты по выручке и заполняемости")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help="пересчитать сводные таблицы с нуля")
+    show = commands.add_parser('show', help="вывести отчёт")
+    show.add_argument('report', choices=sorted(REPORTS))
+    show.add_argument('--from', dest='date_from', help="ДД.ММ.ГГГГ, включительно")
+    show.add_argument('--to', dest='date_to', help="ДД.ММ.ГГГГ, включительно")
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        conn = connect(args.db)
+        try:
+            migrate(conn)
+            with conn:
+                if attach_archive(conn, create=False):
+                    rebuild_summaries(conn.cursor(), ALL_APPOINTMENTS, ALL_GUESTS)
+                else:
+                    rebuild_summaries(conn.cursor())
+        finally:
+            conn.close()
+        print("Сводные таблицы пересчитаны")
+        return
+
+    conn = connect(args.db, READONLY_PROFILE)
+    try:
+        guests = ALL_GUESTS if attach_archive(conn, create=False) else 'guests'
+        columns, _ = REPORTS[args.report]
+        print('\t'.join(columns))
+        for row in run_report(conn.cursor(), args.report, args.date_from, args.date_to, guests):
+            print('\t'.join('' if value is None else str(value) for value in row))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
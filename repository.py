@@ -0,0 +1,880 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from database import connect, checkpoint, DB_PATH, DEFAULT_PROFILE
+from schema import migrate, rebuild_summaries, from_iso_datetime, to_iso_date, ISO_DATETIME_FORMAT
+from records import GUEST_INSERT, SERVICE_INSERT, ROOM_REGISTER, guest_values, service_values
+from cache import LookupCache, GUEST_NAMES_SELECT
+from search import SEARCH_LIMIT, fts_query, search_guests, latest_guests
+from scheduling import Scheduler, ScheduleConflict, CANCELLED, from_minutes, to_minutes
+from rooms import RoomIndex, ROOMS_SELECT, to_day, room_key
+from events import Change, INSERT, DELETE
+from importer import import_file
+from export import export, date_bounds
+from reports import run_report
+from archive import (APPOINTMENTS_AFTER_DAYS, GUESTS_AFTER_DAYS, CHUNK_SIZE, ALL_GUESTS, ALL_APPOINTMENTS,
+                     attach_archive, archive_chunk, archive_counts, horizons, is_attached)
+
+# Групповой commit: правки, пришедшие подряд, сохраняются одной транзакцией. Правка
+# ждёт commit не дольше GROUP_COMMIT_WINDOW мс, в группе не больше GROUP_COMMIT_SIZE правок
+GROUP_COMMIT_WINDOW = 50
+GROUP_COMMIT_SIZE = 200
+
+# Размер страницы по умолчанию для постраничных выборок
+PAGE_SIZE = 100
+
+PLANNED = 'Запланирован'
+# Всё, кроме отмены, занимает время в расписании - посторонний статус занял бы его молча
+STATUSES = (PLANNED, 'Выполнен', CANCELLED)
+
+GUEST_LIST_COLUMNS = '''id, last_name, first_name, middle_name, birth_date, passport, phone,
+                        check_in_date, check_out_date, room, notes'''
+GUESTS_SELECT = f"SELECT {GUEST_LIST_COLUMNS} FROM guests"
+SERVICES_SELECT = "SELECT id, name, description, price, duration FROM services"
+APPOINTMENT_LIST_COLUMNS = "id, guest_id, service_id, date, time, status"
+APPOINTMENTS_SELECT = f"SELECT {APPOINTMENT_LIST_COLUMNS} FROM appointments"
+CALENDAR_SELECT = "SELECT id, guest_id, service_id, starts_at, status FROM appointments"
+STAY_SELECT = "SELECT id, room, check_in, check_out FROM guests"
+
+GUEST_UPDATE = '''UPDATE guests SET
+                  last_name = ?, first_name = ?, middle_name = ?, birth_date = ?,
+                  passport = ?, phone = ?, check_in_date = ?, check_out_date = ?,
+                  room = ?, notes = ?, check_in = ?, check_out = ? WHERE id = ?'''
+SERVICE_UPDATE = '''UPDATE services SET
+                    name = ?, description = ?, price = ?, duration = ?
+                    WHERE id = ?'''
+ROOM_INSERT = "INSERT INTO rooms (number, capacity, notes) VALUES (?, ?, ?)"
+ROOM_UPDATE = "UPDATE rooms SET number = ?, capacity = ?, notes = ? WHERE id = ?"
+APPOINTMENT_INSERT = '''INSERT INTO appointments
+                        (guest_id, service_id, date, time, status, starts_at)
+                        VALUES (?, ?, ?, ?, ?, ?)'''
+APPOINTMENT_UPDATE = '''UPDATE appointments SET
+                        guest_id = ?, service_id = ?, date = ?, time = ?, status = ?, starts_at = ?
+                        WHERE id = ?'''
+
+# Сортировка списков: столбец Treeview -> столбец таблицы. Остальные столбцы
+# (имена из кэша, даты в виде ДД.ММ.ГГГГ) сортировать по индексу нельзя
+GUEST_SORTS = {'id': 'id', 'last_name': 'last_name', 'check_in_date': 'check_in',
+               'check_out_date': 'check_out', 'room': 'room'}
+SERVICE_SORTS = {'id': 'id', 'name': 'name', 'price': 'price', 'duration': 'duration'}
+APPOINTMENT_SORTS = {'id': 'id', 'date': 'starts_at', 'time': 'starts_at', 'status': 'status'}
+
+# Сообщения о строке, которой нет в рабочей базе: таблица -> (что, «не найден»)
+GUEST_APPOINTMENT_EXISTS = "SELECT 1 FROM {schema}.appointments WHERE guest_id = ? LIMIT 1"
+
+MISSING_ROWS = {'guests': ("Отдыхающий", "не найден"), 'appointments': ("Запись", "не найдена")}
+
+# Фильтры списков: имя -> условие. Даты задаются как ДД.ММ.ГГГГ включительно
+GUEST_FILTERS = {'room': 'room = ?', 'date_from': 'check_in >= ?', 'date_to': 'check_in < ?'}
+SERVICE_FILTERS = {}
+APPOINTMENT_FILTERS = {'status': 'status = ?', 'service_id': 'service_id = ?',
+                       'date_from': 'starts_at >= ?', 'date_to': 'starts_at < ?'}
+
+# Журнал изменений (migration_6_changelog): сколько записей хранить и сколько читать
+# за один опрос. Больше за раз - дешевле перечитать списки целиком
+CHANGELOG_KEEP = 10000
+CHANGELOG_BATCH = 500
+
+# Списки в режиме «с архивом»: рабочие и архивные строки вместе
+ALL_GUESTS_SELECT = f"SELECT {GUEST_LIST_COLUMNS} FROM {ALL_GUESTS}"
+ALL_APPOINTMENTS_SELECT = f"SELECT {APPOINTMENT_LIST_COLUMNS} FROM {ALL_APPOINTMENTS}"
+ARCHIVED_GUEST_NAMES_SELECT = '''SELECT id, last_name || ' ' || first_name || ' ' || COALESCE(middle_name, '')
+                                 FROM archive.guests WHERE id IN (SELECT value FROM json_each(?))'''
+
+# Выборка окна календаря идёт по индексу idx_appointments_starts_at
+WINDOW_SELECT = f"{CALENDAR_SELECT} WHERE starts_at >= ? AND starts_at < ? ORDER BY starts_at, id"
+
+
+def where_clause(conditions):
+    return f" WHERE {' AND '.join(conditions)}" if conditions else ''
+
+
+def fetch_page(cursor, select, key, after=None, before=None, limit=PAGE_SIZE,
+               conditions=(), params=(), descending=False):
+    # Keyset-пагинация: вместо OFFSET идём от последнего/первого загруженного ключа,
+    # поэтому стоимость запроса не зависит от того, насколько далеко пролистан список.
+    # Страница перед before - это страница после него в обратном порядке
+    backward = before is not None
+    op, direction = ('<', 'DESC') if descending != backward else ('>', 'ASC')
+    anchor = before if backward else after
+    conditions, params = list(conditions), tuple(params)
+    if anchor is not None:
+        conditions.append(f"{key} {op} ?")
+        params += (anchor,)
+    cursor.execute(f"{select}{where_clause(conditions)} ORDER BY {key} {direction} LIMIT ?", params + (limit,))
+    rows = cursor.fetchall()
+    return rows[::-1] if backward else rows
+
+
+def keyset_segments(order, key, descending, anchor):
+    # Порядок (order, key): при ASC строки с NULL в order идут первыми, при DESC - последними.
+    # Строки со значением и с NULL читаются отдельными запросами, чтобы каждый шёл
+    # диапазоном по индексу, а не перебором всего индекса из-за OR.
+    # anchor = (значение order, key) последней загруженной строки или None с начала списка.
+    # Возвращает части списка после anchor по порядку: (условия, параметры, ORDER BY)
+    op, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+    values = [f"{order} IS NOT NULL"], ()
+    nulls = [f"{order} IS NULL"], ()
+    if anchor is not None:
+        value, row_id = anchor
+        if value is None:
+            nulls = [f"{order} IS NULL", f"{key} {op} ?"], (row_id,)
+        else:
+            values = [f"{order} {op}= ?", f"({order} {op} ? OR {key} {op} ?)"], (value, value, row_id)
+    values += (f"{order} {direction}, {key} {direction}",)
+    nulls += (f"{key} {direction}",)
+    if descending:
+        return [values, nulls] if anchor is None or anchor[0] is not None else [nulls]
+    return [nulls, values] if anchor is None or anchor[0] is None else [values]
+
+
+def fetch_sorted_page(cursor, table, select, key, order, descending=False, after=None, before=None,
+                      limit=PAGE_SIZE, conditions=(), params=()):
+    # Keyset-пагинация по (order, key). Клиент, как и для fetch_page, передаёт только key
+    # крайней строки, её значение order читается по первичному ключу
+    if order == key:
+        return fetch_page(cursor, select, key, after, before, limit, conditions, params, descending)
+    backward = before is not None
+    anchor = before if backward else after
+    if anchor is not None:
+        row = cursor.execute(f"SELECT {order} FROM {table} WHERE {key} = ?", (anchor,)).fetchone()
+        anchor = (row[0] if row else None, anchor)
+    rows = []
+    for where, values, order_by in keyset_segments(order, key, descending != backward, anchor):
+        if len(rows) >= limit:
+            break
+        cursor.execute(f"{select}{where_clause(list(conditions) + where)} ORDER BY {order_by} LIMIT ?",
+                       tuple(params) + values + (limit - len(rows),))
+        rows += cursor.fetchall()
+    return rows[::-1] if backward else rows
+
+
+def list_filters(spec, filters):
+    # {имя: значение} -> условия и параметры; пустые значения не фильтруют
+    filters = {name: value for name, value in (filters or {}).items() if value not in (None, '')}
+    unknown = set(filters) - set(spec)
+    if unknown:
+        raise ValueError(f"Неизвестный фильтр: {', '.join(sorted(unknown))}")
+    if 'date_from' in filters or 'date_to' in filters:
+        start, end = date_bounds(filters.get('date_from'), filters.get('date_to'))
+        if 'date_from' in filters:
+            filters['date_from'] = start
+        if 'date_to' in filters:
+            filters['date_to'] = end
+    return [spec[name] for name in filters], tuple(filters.values())
+
+
+def fetch_row(cursor, select, key, row_id):
+    cursor.execute(f"{select} WHERE {key} = ?", (row_id,))
+    return cursor.fetchone()
+
+
+def fetch_rows(cursor, select, key, row_ids):
+    # Строки по списку ключей. Список передаётся одним JSON-параметром, поэтому текст
+    # запроса один при любом числе id и берётся из кэша подготовленных выражений
+    cursor.execute(f"{select} WHERE {key} IN (SELECT value FROM json_each(?)) ORDER BY {key}",
+                   (json.dumps(list(row_ids)),))
+    return cursor.fetchall()
+
+
+def collapse_changes(changes):
+    # Одна строка - одно событие, в порядке последнего изменения. Вставка с последующими
+    # правками остаётся вставкой, чтобы строка появилась в списке; удаление побеждает всё
+    first, last = {}, {}
+    for change in changes:
+        key = (change.table, change.row_id)
+        first.setdefault(key, change.kind)
+        last.pop(key, None)
+        last[key] = change.kind
+    collapsed = []
+    for (table, row_id), kind in last.items():
+        if kind != DELETE and first[(table, row_id)] == INSERT:
+            kind = INSERT
+        collapsed.append(Change(table, kind, row_id))
+    return collapsed
+
+
+def check_status(status):
+    if status not in STATUSES:
+        raise ValueError(f"Неизвестный статус записи «{status}»: допустимы {', '.join(STATUSES)}")
+
+
+def register_room(cursor, number):
+    if number:
+        cursor.execute(ROOM_REGISTER, (number,))
+
+
+def room_values(number, capacity, notes):
+    number = str(number).strip()
+    if not number:
+        raise ValueError("Номер комнаты обязателен")
+    try:
+        capacity = int(capacity)
+    except (TypeError, ValueError):
+        raise ValueError("Число мест - целое число")
+    if capacity < 1:
+        raise ValueError("В номере должно быть хотя бы одно место")
+    return number, capacity, (notes or '').strip()
+
+
+def stay_days(date_from, date_to):
+    # ДД.ММ.ГГГГ заезда и выезда -> [первый день, день выезда) в днях
+    check_in, check_out = to_iso_date(date_from), to_iso_date(date_to)
+    if check_in is None or check_out is None:
+        raise ValueError("Даты заезда и выезда должны быть в формате ДД.ММ.ГГГГ")
+    start, end = to_day(check_in), to_day(check_out)
+    if end <= start:
+        raise ValueError("Дата выезда должна быть позже даты заезда")
+    return start, end
+
+
+class CommitGroup:
+    # Правки в общей транзакции. Каждая - под своей точкой сохранения: её ошибка откатывает
+    # только её. Ответ об успехе правка получает после done, и только если error пуст
+    def __init__(self):
+        self.started = time.monotonic()
+        self.size = 0
+        self.done = threading.Event()
+        self.error = None
+
+
+def open_repository(path=DB_PATH, profile=DEFAULT_PROFILE, **kwargs):
+    # kwargs передаются в sqlite3.connect, например factory=InstrumentedConnection
+    conn = connect(path, profile, **kwargs)
+    migrate(conn)
+    return SanatoriumRepository(conn)
+
+
+class SanatoriumRepository:
+    # Вся работа с данными без интерфейса: методы принимают и возвращают обычные значения,
+    # поэтому их можно вызывать из скриптов, замеров и других клиентов. Объект не
+    # потокобезопасен - в приложении им единолично владеет рабочий поток DbExecutor.
+    # Тексты запросов - константы, так что sqlite3 берёт уже подготовленные выражения
+    # из кэша соединения (cached_statements) и не компилирует их заново.
+    # Изменения идут в явных транзакциях; кэш имён и расписание обновляются после commit
+    def __init__(self, conn):
+        self.conn = conn
+        self.lookups = LookupCache(conn)
+        # Расписание читается при первой проверке или отрисовке календаря, а не при открытии:
+        # запуск приложения не зависит от числа записей
+        self.scheduler = Scheduler()
+        # Занятость номеров - так же, при первом подборе номера
+        self.rooms = RoomIndex()
+        self.nested = False
+        self.editing = False
+        # Групповой commit включает владелец соединения (рабочий поток приложения, сервер),
+        # когда сам отвечает за commit_group(); скрипты получают commit в каждом методе
+        self.group_commit = False
+        self.group = None
+        self.data_version = None
+        # Журнал изменений до этого номера записан только этим соединением
+        self.own_seq = 0
+
+    def schedule(self):
+        if not self.scheduler.loaded:
+            self.scheduler.load(self.conn)
+        return self.scheduler
+
+    def room_index(self):
+        if not self.rooms.loaded:
+            self.rooms.load(self.conn)
+        return self.rooms
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE сразу берёт блокировку записи, поэтому конкурент с другого
+        # соединения ждёт busy_timeout в начале, а не получает SQLITE_BUSY посреди транзакции.
+        # Вложенный вызов выполняется в рамках уже открытой транзакции.
+        # При групповом commit правка - точка сохранения в транзакции группы
+        if self.editing or (self.conn.in_transaction and self.group is None):
+            self.nested = True
+            yield self.conn.cursor()
+            return
+        self.nested = False
+        grouped = self.group_commit
+        if grouped:
+            self.begin_edit()
+        else:
+            self.conn.execute("BEGIN IMMEDIATE")
+        self.editing = True
+        try:
+            yield self.conn.cursor()
+        except BaseException:
+            self.editing = False
+            if not grouped:
+                self.conn.rollback()
+            elif self.conn.in_transaction:
+                self.conn.execute("ROLLBACK TO edit")
+                self.conn.execute("RELEASE edit")
+            # Вложенные операции уже обновили кэш имён, расписание и занятость номеров,
+            # а их изменения откачены - перечитаем всё при следующем обращении
+            if self.nested:
+                self.clear_caches()
+            raise
+        self.editing = False
+        if grouped:
+            self.conn.execute("RELEASE edit")
+            self.group.size += 1
+        else:
+            self.conn.commit()
+            self.committed()
+
+    def begin_edit(self):
+        if self.group is None:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.group = CommitGroup()
+        elif not self.conn.in_transaction:
+            # SQLite сам откатил транзакцию группы (нехватка места, ошибка ввода-вывода):
+            # новые правки не должны попасть в отдельную транзакцию мимо ошибки
+            raise sqlite3.OperationalError("Транзакция группы прервана, изменения не сохранены")
+        self.conn.execute("SAVEPOINT edit")
+
+    def group_due(self, window=GROUP_COMMIT_WINDOW, size=GROUP_COMMIT_SIZE):
+        # Группу пора сохранять: ждёт дольше окна, набрала size правок или уже прервана
+        group = self.group
+        return group is not None and (group.size >= size or not self.conn.in_transaction
+                                      or (time.monotonic() - group.started) * 1000 >= window)
+
+    def commit_group(self):
+        # Сохраняет открытую группу правок. При ошибке откатывается вся группа, кэши
+        # перечитываются, а ошибка достаётся всем её правкам через group.error.
+        # Вызывается перед тем, что в транзакции невозможно (ATTACH, checkpoint, импорт)
+        group = self.group
+        if group is None:
+            return
+        if self.editing:
+            # Посреди правки (пакет вызовов сервера) транзакцию завершать нельзя
+            raise ValueError("Эта операция невозможна внутри транзакции")
+        self.group = None
+        try:
+            if not self.conn.in_transaction:
+                raise sqlite3.OperationalError("Транзакция группы прервана, изменения не сохранены")
+            self.conn.commit()
+            self.committed()
+        except BaseException as e:
+            group.error = e
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            self.clear_caches()
+            raise
+        finally:
+            group.done.set()
+
+    def committed(self):
+        # Свой commit не меняет PRAGMA data_version. Если с прошлого опроса чужих commit
+        # не было, всё, что сейчас есть в журнале, - наше, и опрос это пропустит. Номер
+        # читается до проверки: чужой commit после неё получит номер больше
+        if self.data_version is None:
+            return
+        last = self.conn.execute("SELECT MAX(seq) FROM changelog").fetchone()[0]
+        if self.conn.execute("PRAGMA data_version").fetchone()[0] == self.data_version:
+            self.own_seq = last or 0
+
+    def clear_caches(self):
+        self.lookups.clear()
+        self.scheduler.clear()
+        self.rooms.clear()
+
+    @contextmanager
+    def bulk_transaction(self):
+        # Массовая операция проверяет и меняет расписание запись за записью; если пачка
+        # откатилась, расписание проще перечитать, чем восстанавливать
+        try:
+            with self.transaction() as cursor:
+                yield cursor
+        except BaseException:
+            self.scheduler.clear()
+            raise
+
+    def rollback(self):
+        # Открытую группу не трогаем: неудачная правка уже откатила свою точку сохранения
+        if self.conn.in_transaction and self.group is None:
+            self.conn.rollback()
+
+    def checkpoint(self, mode='PASSIVE'):
+        self.commit_group()
+        return checkpoint(self.conn, mode)
+
+    def close(self):
+        try:
+            self.commit_group()
+        finally:
+            self.conn.close()
+
+    # Изменения из других соединений с той же базой
+    def poll_changes(self, seq):
+        # -> (последний номер журнала, [Change], нужно ли перечитать всё). Пока другие
+        # соединения ничего не записали, PRAGMA data_version не меняется и журнал не читается.
+        # Свои изменения, записанные без чужих между ними (own_seq), пропускаются; остальные
+        # свои читаются вместе с чужими - повторное применение строки безвредно
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if seq is not None:
+            seq = max(seq, self.own_seq)
+            if version == self.data_version:
+                return seq, [], False
+        self.data_version = version
+        if seq is None:
+            last = self.conn.execute("SELECT MAX(seq) FROM changelog").fetchone()[0]
+            return last or 0, [], False
+        oldest = self.conn.execute("SELECT MIN(seq) FROM changelog").fetchone()[0]
+        rows = self.conn.execute("SELECT seq, tbl, kind, row_id FROM changelog WHERE seq > ? ORDER BY seq LIMIT ?",
+                                 (seq, CHANGELOG_BATCH)).fetchall()
+        if (oldest is not None and oldest > seq + 1) or len(rows) == CHANGELOG_BATCH:
+            # Пропущенная часть журнала уже удалена или изменений слишком много
+            self.clear_caches()
+            last = self.conn.execute("SELECT MAX(seq) FROM changelog").fetchone()[0]
+            return last or seq, [], True
+        changes = collapse_changes(Change(table, kind, row_id) for _, table, kind, row_id in rows)
+        for change in changes:
+            self.refresh_caches(change)
+        return (rows[-1][0] if rows else seq), changes, False
+
+    def refresh_caches(self, change):
+        # Кэш имён, расписание и занятость номеров должны отражать чужие изменения
+        # до того, как их увидит интерфейс
+        if change.table == 'guests':
+            self.lookups.invalidate_guest(change.row_id)
+            if self.rooms.loaded:
+                row = fetch_row(self.conn.cursor(), STAY_SELECT, 'id', change.row_id)
+                if row:
+                    self.rooms.place(*row)
+                else:
+                    self.rooms.remove(change.row_id)
+        elif change.table == 'rooms' and self.rooms.loaded:
+            row = fetch_row(self.conn.cursor(), ROOMS_SELECT, 'id', change.row_id)
+            if row:
+                self.rooms.set_room(*row)
+            else:
+                self.rooms.drop_room(change.row_id)
+        elif change.table == 'services':
+            self.lookups.invalidate_service(change.row_id)
+            if self.scheduler.loaded:
+                row = self.conn.execute("SELECT duration FROM services WHERE id = ?", (change.row_id,)).fetchone()
+                if row:
+                    self.scheduler.set_duration(change.row_id, row[0])
+        elif change.table == 'appointments' and self.scheduler.loaded:
+            row = fetch_row(self.conn.cursor(), CALENDAR_SELECT, 'id', change.row_id)
+            if row:
+                self.scheduler.place(*row)
+            else:
+                self.scheduler.remove(change.row_id)
+
+    def prune_changelog(self, keep=CHANGELOG_KEEP):
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM changelog WHERE seq <= (SELECT MAX(seq) FROM changelog) - ?", (keep,))
+
+    # Диагностика: доступна, если соединение открыто с factory=InstrumentedConnection
+    def diagnostics(self):
+        stats = getattr(self.conn, 'stats', None)
+        return stats.snapshot() if stats else None
+
+    def reset_diagnostics(self):
+        if hasattr(self.conn, 'stats'):
+            self.conn.stats.reset()
+
+    def set_slow_query_threshold(self, threshold_ms):
+        if hasattr(self.conn, 'stats'):
+            self.conn.stats.threshold_ms = threshold_ms
+
+    def list_page(self, table, select, sorts, spec, after, before, limit, order, descending, filters):
+        # Страница списка: order - столбец Treeview из sorts, filters - {имя: значение} из spec.
+        # Всё переводится в WHERE/ORDER BY с параметрами, поэтому на клиент приходит только страница
+        if order not in sorts:
+            raise ValueError(f"Сортировка по столбцу {order} не поддерживается")
+        conditions, params = list_filters(spec, filters)
+        return fetch_sorted_page(self.conn.cursor(), table, select, 'id', sorts[order], descending,
+                                 after, before, limit, conditions, params)
+
+    # Отдыхающие
+    def list_guests(self, after=None, before=None, limit=PAGE_SIZE, order='id', descending=False, filters=None,
+                    archive=False):
+        # archive - вместе с перенесёнными в архив; пока архива нет, список тот же
+        if archive and self.attach_archive(create=False):
+            return self.list_page(ALL_GUESTS, ALL_GUESTS_SELECT, GUEST_SORTS, GUEST_FILTERS,
+                                  after, before, limit, order, descending, filters)
+        return self.list_page('guests', GUESTS_SELECT, GUEST_SORTS, GUEST_FILTERS,
+                              after, before, limit, order, descending, filters)
+
+    def get_guest(self, guest_id):
+        return fetch_row(self.conn.cursor(), GUESTS_SELECT, 'id', guest_id)
+
+    def search_guests(self, text, limit=SEARCH_LIMIT):
+        return search_guests(self.conn.cursor(), GUESTS_SELECT, text, limit)
+
+    def guest_choices(self, text='', limit=SEARCH_LIMIT):
+        # (id, имя) для выбора гостя: совпадения по тексту или последние заселившиеся
+        if fts_query(text):
+            return search_guests(self.conn.cursor(), GUEST_NAMES_SELECT, text, limit)
+        return latest_guests(self.conn.cursor(), GUEST_NAMES_SELECT, limit)
+
+    def create_guest(self, record):
+        # record: {столбец: текст}, как из формы или файла импорта. Занятый номер -
+        # RoomConflict с перечнем свободных на те же даты
+        values = guest_values(record)
+        self.check_stay(None, values)
+        with self.transaction() as cursor:
+            cursor.execute(GUEST_INSERT, values)
+            guest_id = cursor.lastrowid
+            register_room(cursor, values[8])
+        self.lookups.invalidate_guest(guest_id)
+        self.remember_stay(guest_id, values)
+        return guest_id
+
+    def update_guest(self, guest_id, record):
+        values = guest_values(record)
+        self.check_stay(guest_id, values)
+        with self.transaction() as cursor:
+            cursor.execute(GUEST_UPDATE, values + (guest_id,))
+            self.require_row(cursor, 'guests', guest_id)
+            register_room(cursor, values[8])
+        self.lookups.invalidate_guest(guest_id)
+        self.remember_stay(guest_id, values)
+
+    def require_row(self, cursor, table, row_id):
+        # Изменение не нашло строку. Строки архива видны в режиме «с архивом», но меняется
+        # только рабочая база - об этом и говорим, а не сообщаем об успехе
+        if cursor.rowcount:
+            return
+        label, missing = MISSING_ROWS[table]
+        if is_attached(self.conn) and self.conn.execute(f"SELECT 1 FROM archive.{table} WHERE id = ?",
+                                                        (row_id,)).fetchone():
+            raise ValueError(f"{label} №{row_id} в архиве: изменить или удалить нельзя")
+        raise ValueError(f"{label} №{row_id} {missing}")
+
+    def check_stay(self, guest_id, values):
+        # Гость без номера или без дат номер не занимает - занятость ради него не читаем
+        if values[8] and values[10] and values[11]:
+            self.room_index().check(guest_id, values[8], values[10], values[11])
+
+    def remember_stay(self, guest_id, values):
+        # После commit: проживание гостя и номер, если он только что попал в фонд.
+        # Незагруженную занятость обновлять незачем - она прочитается из БД целиком
+        if not self.rooms.loaded:
+            return
+        room = values[8]
+        if room and room not in self.rooms.capacities:
+            row = self.conn.execute(f"{ROOMS_SELECT} WHERE number = ?", (room,)).fetchone()
+            if row:
+                self.rooms.set_room(*row)
+        self.rooms.place(guest_id, room, values[10], values[11])
+
+    def count_guest_appointments(self, guest_id):
+        # Вместе с архивными: запись в архиве тоже ссылается на гостя
+        appointments = ALL_APPOINTMENTS if self.attach_archive(create=False) else 'appointments'
+        return self.conn.execute(f"SELECT COUNT(*) FROM {appointments} WHERE guest_id = ?",
+                                 (guest_id,)).fetchone()[0]
+
+    def delete_guest(self, guest_id):
+        # Архив подключается до транзакции: ATTACH внутри неё невозможен
+        archived = self.attach_archive(create=False)
+        with self.transaction() as cursor:
+            if cursor.execute(GUEST_APPOINTMENT_EXISTS.format(schema='main'), (guest_id,)).fetchone():
+                raise ValueError("Нельзя удалить отдыхающего с активными записями")
+            cursor.execute("DELETE FROM guests WHERE id = ?", (guest_id,))
+            self.require_row(cursor, 'guests', guest_id)
+            # Записи, ушедшие в архив, остались бы без гостя - удаление откатывается
+            if archived and cursor.execute(GUEST_APPOINTMENT_EXISTS.format(schema='archive'), (guest_id,)).fetchone():
+                raise ValueError("Нельзя удалить отдыхающего: на него ссылаются записи в архиве")
+        self.lookups.invalidate_guest(guest_id)
+        self.rooms.remove(guest_id)
+
+    # Номерной фонд и подбор номера. Даты - ДД.ММ.ГГГГ: день заезда и день выезда,
+    # номер свободен, если в каждую ночь между ними в нём есть место
+    def list_rooms(self):
+        return sorted(self.conn.execute(ROOMS_SELECT).fetchall(), key=lambda row: room_key(row[1]))
+
+    def create_room(self, number, capacity=1, notes=''):
+        values = room_values(number, capacity, notes)
+        with self.transaction() as cursor:
+            cursor.execute(ROOM_INSERT, values)
+            room_id = cursor.lastrowid
+        self.rooms.set_room(room_id, *values)
+        return room_id
+
+    def update_room(self, room_id, number, capacity=1, notes=''):
+        values = room_values(number, capacity, notes)
+        with self.transaction() as cursor:
+            old = cursor.execute("SELECT number FROM rooms WHERE id = ?", (room_id,)).fetchone()
+            if old and old[0] != values[0] and self.count_room_guests(old[0]):
+                raise ValueError(f"В номере {old[0]} есть отдыхающие, переименовать его нельзя")
+            cursor.execute(ROOM_UPDATE, values + (room_id,))
+        self.rooms.set_room(room_id, *values)
+
+    def count_room_guests(self, number):
+        return self.conn.execute("SELECT COUNT(*) FROM guests WHERE room = ?", (number,)).fetchone()[0]
+
+    def delete_room(self, room_id):
+        with self.transaction() as cursor:
+            row = cursor.execute("SELECT number FROM rooms WHERE id = ?", (room_id,)).fetchone()
+            if row and self.count_room_guests(row[0]):
+                raise ValueError(f"В номере {row[0]} есть отдыхающие, удалить его нельзя")
+            cursor.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
+        self.rooms.drop_room(room_id)
+
+    def room_availability(self, date_from, date_to, guest_id=None):
+        # (id номера, номер, мест, примечание, занято в пиковую ночь) по всем номерам;
+        # guest_id - не считать проживание этого гостя (он сам подбирает себе номер)
+        start, end = stay_days(date_from, date_to)
+        return self.room_index().availability(start, end, guest_id)
+
+    def free_rooms(self, date_from, date_to, guest_id=None, places=1):
+        start, end = stay_days(date_from, date_to)
+        return self.room_index().free_rooms(start, end, guest_id, places)
+
+    def overbooked_rooms(self, date_from, date_to):
+        start, end = stay_days(date_from, date_to)
+        return self.room_index().overbooked(start, end)
+
+    # Услуги
+    def list_services(self, after=None, before=None, limit=PAGE_SIZE, order='id', descending=False, filters=None):
+        return self.list_page('services', SERVICES_SELECT, SERVICE_SORTS, SERVICE_FILTERS,
+                              after, before, limit, order, descending, filters)
+
+    def get_service(self, service_id):
+        return fetch_row(self.conn.cursor(), SERVICES_SELECT, 'id', service_id)
+
+    def service_labels(self):
+        # Строится из кэша, без обращения к базе
+        return self.lookups.service_labels()
+
+    def create_service(self, record):
+        values = service_values(record)
+        with self.transaction() as cursor:
+            cursor.execute(SERVICE_INSERT, values)
+            service_id = cursor.lastrowid
+        self.lookups.invalidate_service(service_id)
+        self.scheduler.set_duration(service_id, values[3])
+        return service_id
+
+    def update_service(self, service_id, record):
+        values = service_values(record)
+        with self.transaction() as cursor:
+            cursor.execute(SERVICE_UPDATE, values + (service_id,))
+        self.lookups.invalidate_service(service_id)
+        self.scheduler.set_duration(service_id, values[3])
+
+    def count_service_appointments(self, service_id):
+        return self.conn.execute("SELECT COUNT(*) FROM appointments WHERE service_id = ?",
+                                 (service_id,)).fetchone()[0]
+
+    def delete_service(self, service_id):
+        with self.transaction() as cursor:
+            if self.count_service_appointments(service_id):
+                raise ValueError("Нельзя удалить услугу с активными записями")
+            cursor.execute("DELETE FROM services WHERE id = ?", (service_id,))
+        self.lookups.invalidate_service(service_id)
+
+    # Записи
+    def describe_appointments(self, rows):
+        # Строки APPOINTMENTS_SELECT -> (id, гость, услуга, дата, время, статус, guest_id, service_id);
+        # имена берутся из кэша, без JOIN
+        return [(appointment_id, self.lookups.guest_name(guest_id), self.lookups.service_name(service_id),
+                 date, time, status, guest_id, service_id)
+                for appointment_id, guest_id, service_id, date, time, status in rows]
+
+    def list_appointments(self, after=None, before=None, limit=PAGE_SIZE, order='id', descending=False,
+                          filters=None, archive=False):
+        if archive and self.attach_archive(create=False):
+            rows = self.list_page(ALL_APPOINTMENTS, ALL_APPOINTMENTS_SELECT, APPOINTMENT_SORTS,
+                                  APPOINTMENT_FILTERS, after, before, limit, order, descending, filters)
+            self.load_archived_names(row[1] for row in rows)
+            return self.describe_appointments(rows)
+        return self.describe_appointments(self.list_page('appointments', APPOINTMENTS_SELECT, APPOINTMENT_SORTS,
+                                                         APPOINTMENT_FILTERS, after, before, limit, order,
+                                                         descending, filters))
+
+    def get_appointment(self, appointment_id):
+        row = fetch_row(self.conn.cursor(), APPOINTMENTS_SELECT, 'id', appointment_id)
+        return self.describe_appointments([row])[0] if row else None
+
+    def calendar_entries(self, rows):
+        # Строки CALENDAR_SELECT -> (id, гость, service_id, услуга, начало, конец, статус, guest_id),
+        # начало и конец - минуты от EPOCH с учётом длительности услуги
+        entries = []
+        for appointment_id, guest_id, service_id, starts_at, status in rows:
+            start, end = self.schedule().interval(service_id, starts_at)
+            entries.append((appointment_id, self.lookups.guest_name(guest_id), service_id,
+                            self.lookups.service_name(service_id), start, end, status, guest_id))
+        return entries
+
+    def appointments_between(self, start, end):
+        # start, end - даты; день end в выборку не входит
+        cursor = self.conn.execute(WINDOW_SELECT, (start.isoformat(), end.isoformat()))
+        return self.calendar_entries(cursor.fetchall())
+
+    def calendar_entry(self, appointment_id):
+        row = fetch_row(self.conn.cursor(), CALENDAR_SELECT, 'id', appointment_id)
+        return self.calendar_entries([row])[0] if row and row[3] else None
+
+    def book(self, guest_id, service_id, starts_at, status=PLANNED):
+        # starts_at - 'YYYY-MM-DD HH:MM'. Пересечения проверяются по расписанию в памяти,
+        # ScheduleConflict сообщает причину и ближайшее свободное время
+        check_status(status)
+        self.schedule().check(guest_id, service_id, starts_at, status)
+        date, time = from_iso_datetime(starts_at)
+        with self.transaction() as cursor:
+            cursor.execute(APPOINTMENT_INSERT, (guest_id, service_id, date, time, status, starts_at))
+            appointment_id = cursor.lastrowid
+        self.scheduler.place(appointment_id, guest_id, service_id, starts_at, status)
+        return appointment_id
+
+    def update_appointment(self, appointment_id, guest_id, service_id, starts_at, status):
+        check_status(status)
+        self.schedule().check(guest_id, service_id, starts_at, status, ignore=appointment_id)
+        date, time = from_iso_datetime(starts_at)
+        with self.transaction() as cursor:
+            cursor.execute(APPOINTMENT_UPDATE, (guest_id, service_id, date, time, status, starts_at, appointment_id))
+            self.require_row(cursor, 'appointments', appointment_id)
+        self.scheduler.place(appointment_id, guest_id, service_id, starts_at, status)
+
+    def delete_appointment(self, appointment_id):
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM appointments WHERE id = ?", (appointment_id,))
+            self.require_row(cursor, 'appointments', appointment_id)
+        self.scheduler.remove(appointment_id)
+
+    # Массовые операции над записями: вся пачка - одна транзакция, результат - id изменённых записей
+    def get_appointments(self, appointment_ids):
+        return self.describe_appointments(fetch_rows(self.conn.cursor(), APPOINTMENTS_SELECT, 'id', appointment_ids))
+
+    def get_calendar_entries(self, appointment_ids):
+        rows = fetch_rows(self.conn.cursor(), CALENDAR_SELECT, 'id', appointment_ids)
+        return self.calendar_entries([row for row in rows if row[3]])
+
+    def set_appointments_status(self, appointment_ids, status):
+        check_status(status)
+        rows = fetch_rows(self.conn.cursor(), CALENDAR_SELECT, 'id', appointment_ids)
+        schedule = self.schedule()
+        with self.bulk_transaction() as cursor:
+            for appointment_id, guest_id, service_id, starts_at, _ in rows:
+                # Вернуть отменённую запись можно, только если её время ещё свободно
+                try:
+                    schedule.check(guest_id, service_id, starts_at, status, ignore=appointment_id)
+                except ScheduleConflict as e:
+                    raise ScheduleConflict(f"Запись №{appointment_id}: {e}")
+                schedule.place(appointment_id, guest_id, service_id, starts_at, status)
+            cursor.executemany("UPDATE appointments SET status = ? WHERE id = ?", [(status, row[0]) for row in rows])
+        return [row[0] for row in rows]
+
+    def reschedule_appointments(self, appointment_ids, minutes):
+        # Сдвиг на minutes минут (можно отрицательный). Сначала все записи пачки убираются
+        # из расписания, чтобы при сдвиге они не мешали сами себе
+        rows = [row for row in fetch_rows(self.conn.cursor(), CALENDAR_SELECT, 'id', appointment_ids) if row[3]]
+        schedule = self.schedule()
+        moved = []
+        with self.bulk_transaction() as cursor:
+            for row in rows:
+                schedule.remove(row[0])
+            for appointment_id, guest_id, service_id, starts_at, status in rows:
+                starts_at = from_minutes(to_minutes(starts_at) + minutes).strftime(ISO_DATETIME_FORMAT)
+                try:
+                    schedule.check(guest_id, service_id, starts_at, status, ignore=appointment_id)
+                except ScheduleConflict as e:
+                    raise ScheduleConflict(f"Запись №{appointment_id}: {e}")
+                schedule.place(appointment_id, guest_id, service_id, starts_at, status)
+                moved.append(from_iso_datetime(starts_at) + (starts_at, appointment_id))
+            cursor.executemany("UPDATE appointments SET date = ?, time = ?, starts_at = ? WHERE id = ?", moved)
+        return [row[-1] for row in moved]
+
+    def delete_appointments(self, appointment_ids):
+        # Записи из архива (режим «с архивом») не удаляются и в результат не входят
+        appointment_ids = [row[0] for row in fetch_rows(self.conn.cursor(), CALENDAR_SELECT, 'id', appointment_ids)]
+        with self.transaction() as cursor:
+            cursor.executemany("DELETE FROM appointments WHERE id = ?", [(i,) for i in appointment_ids])
+        for appointment_id in appointment_ids:
+            self.scheduler.remove(appointment_id)
+        return appointment_ids
+
+    def cancel_guest_appointments(self, guest_id, since=None):
+        # Отмена всех записей гостя начиная с since ('YYYY-MM-DD HH:MM', по умолчанию - сейчас)
+        since = since or datetime.now().strftime(ISO_DATETIME_FORMAT)
+        with self.transaction() as cursor:
+            cursor.execute('''SELECT id FROM appointments
+                              WHERE guest_id = ? AND starts_at >= ? AND status IS NOT ?''',
+                           (guest_id, since, CANCELLED))
+            appointment_ids = [row[0] for row in cursor.fetchall()]
+            cursor.executemany("UPDATE appointments SET status = ? WHERE id = ?",
+                               [(CANCELLED, i) for i in appointment_ids])
+        for appointment_id in appointment_ids:
+            self.scheduler.remove(appointment_id)
+        return appointment_ids
+
+    def next_free_slot(self, guest_id, service_id, starts_at, ignore=None):
+        # None, если свободного времени для услуги нет
+        start = self.schedule().next_free_slot(guest_id, service_id, to_minutes(starts_at), ignore)
+        return None if start is None else from_minutes(start).strftime(ISO_DATETIME_FORMAT)
+
+    # Архив: завершённые и отменённые записи старше срока и давно выехавшие гости
+    # переносятся в отдельный файл (archive.py), рабочие таблицы и индексы остаются небольшими
+    def attach_archive(self, create=True):
+        # ATTACH внутри транзакции невозможен
+        if not is_attached(self.conn):
+            self.commit_group()
+        return attach_archive(self.conn, create)
+
+    def archive_step(self, appointment_days=APPOINTMENTS_AFTER_DAYS, guest_days=GUESTS_AFTER_DAYS,
+                     chunk_size=CHUNK_SIZE):
+        # Одна пачка переноса -> (id записей, id гостей). Вызывающий повторяет, пока
+        # хотя бы одна часть равна chunk_size; между пачками база свободна для других запросов
+        self.attach_archive()
+        appointments_before, guests_before = horizons(appointment_days, guest_days)
+        with self.transaction() as cursor:
+            appointment_ids, guest_ids = archive_chunk(cursor, appointments_before, guests_before, chunk_size)
+        for appointment_id in appointment_ids:
+            self.scheduler.remove(appointment_id)
+        for guest_id in guest_ids:
+            self.lookups.invalidate_guest(guest_id)
+            self.rooms.remove(guest_id)
+        return appointment_ids, guest_ids
+
+    def archive_counts(self):
+        # {таблица: (строк в рабочей базе, строк в архиве)}
+        self.attach_archive(create=False)
+        return archive_counts(self.conn)
+
+    def load_archived_names(self, guest_ids):
+        # Имена архивных гостей для записей из архива; в кэше их нет, пока не понадобятся
+        self.lookups.ensure_loaded()
+        missing = {guest_id for guest_id in guest_ids if guest_id not in self.lookups.guests}
+        if missing:
+            rows = self.conn.execute(ARCHIVED_GUEST_NAMES_SELECT, (json.dumps(list(missing)),)).fetchall()
+            self.lookups.guests.update(rows)
+
+    # Импорт, выгрузка, отчёты
+    def import_file(self, target, path):
+        # Импорт сам делает commit каждой пачки
+        self.commit_group()
+        try:
+            result = import_file(self.conn, target, path, rooms=self.room_index() if target == 'guests' else None)
+        finally:
+            # После массовой вставки проще перечитать кэши целиком; в занятости номеров
+            # строки файла записаны под временными ключами
+            self.lookups.clear()
+            if target == 'services':
+                self.scheduler.clear()
+            if target == 'guests':
+                self.rooms.clear()
+            self.committed()
+        return result
+
+    def export(self, report, path, fmt=None, date_from=None, date_to=None, archive=False):
+        if archive:
+            self.attach_archive(create=False)
+        return export(self.conn, report, path, fmt, date_from, date_to, archive=archive)
+
+    def report(self, report, date_from=None, date_to=None):
+        # Итоги по гостям хранятся и для ушедших в архив - их имена берутся оттуда
+        guests = ALL_GUESTS if self.attach_archive(create=False) else 'guests'
+        return run_report(self.conn.cursor(), report, date_from, date_to, guests)
+
+    def rebuild_summaries(self):
+        archived = self.attach_archive(create=False)
+        with self.transaction() as cursor:
+            if archived:
+                rebuild_summaries(cursor, ALL_APPOINTMENTS, ALL_GUESTS)
+            else:
+                rebuild_summaries(cursor)
@@ -0,0 +1,139 @@
+import re
+from collections import defaultdict
+from datetime import date
+
+from schema import DATE_FORMAT
+from scheduling import IntervalIndex
+
+# Мест в номере, которого нет в номерном фонде
+DEFAULT_CAPACITY = 1
+
+ROOMS_SELECT = "SELECT id, number, capacity, notes FROM rooms"
+STAYS_SELECT = '''SELECT id, room, check_in, check_out FROM guests
+                  WHERE room <> '' AND check_in IS NOT NULL AND check_out > check_in'''
+
+
+class RoomConflict(Exception):
+    pass
+
+
+def to_day(iso_date):
+    return date.fromisoformat(iso_date).toordinal()
+
+
+def format_day(day):
+    return date.fromordinal(day).strftime(DATE_FORMAT)
+
+
+def room_key(number):
+    # Номера сортируются как числа: 9 < 10 < 10а
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', number)]
+
+
+def peak(items, start, end):
+    # Наибольшее число одновременных проживаний из items внутри [start, end).
+    # Выезд и заезд в один день не пересекаются: конец обрабатывается раньше начала
+    events = sorted([(max(item[0], start), 1) for item in items] + [(min(item[1], end), -1) for item in items])
+    current = highest = 0
+    for _, delta in events:
+        current += delta
+        highest = max(highest, current)
+    return highest
+
+
+class RoomIndex:
+    # Занятость номеров в памяти: по каждому номеру - интервалы проживаний [заезд, выезд)
+    # в днях, упорядоченные по заезду. Строится из БД при первом обращении и обновляется
+    # каждой операцией с гостями, так что подбор номера не разбирает даты всех гостей.
+    # Учитываются проживания с обеими датами - по тем же правилам, что и daily_occupancy
+    def __init__(self):
+        self.rooms = {}
+        self.capacities = {}
+        self.index = defaultdict(IntervalIndex)
+        self.stays = {}
+        self.loaded = False
+
+    def clear(self):
+        self.rooms = {}
+        self.capacities = {}
+        self.index.clear()
+        self.stays.clear()
+        self.loaded = False
+
+    def load(self, conn):
+        self.clear()
+        for room_id, number, capacity, notes in conn.execute(ROOMS_SELECT):
+            self.set_room(room_id, number, capacity, notes)
+        for guest_id, room, check_in, check_out in conn.execute(STAYS_SELECT):
+            self.place(guest_id, room, check_in, check_out)
+        self.loaded = True
+
+    def set_room(self, room_id, number, capacity, notes=None):
+        self.drop_room(room_id)
+        self.rooms[room_id] = (number, capacity, notes)
+        self.capacities[number] = capacity
+
+    def drop_room(self, room_id):
+        entry = self.rooms.pop(room_id, None)
+        if entry is not None:
+            self.capacities.pop(entry[0], None)
+
+    def capacity(self, number):
+        return self.capacities.get(number, DEFAULT_CAPACITY)
+
+    def place(self, guest_id, room, check_in, check_out):
+        # Добавляет или переносит проживание гостя; без номера или дат оно номер не занимает
+        self.remove(guest_id)
+        room = (room or '').strip()
+        if room and check_in and check_out and check_out > check_in:
+            start, end = to_day(check_in), to_day(check_out)
+            self.stays[guest_id] = (room, start, end)
+            self.index[room].add(start, end, guest_id)
+
+    def remove(self, guest_id):
+        entry = self.stays.pop(guest_id, None)
+        if entry is None:
+            return
+        room, start, end = entry
+        self.index[room].remove(start, end, guest_id)
+
+    def guests(self, room, start, end, ignore=None):
+        index = self.index.get(room)
+        if index is None:
+            return []
+        return [item for item in index.overlapping(start, end) if item[2] != ignore]
+
+    def occupied(self, room, start, end, ignore=None):
+        return peak(self.guests(room, start, end, ignore), start, end)
+
+    def availability(self, start, end, ignore=None):
+        # Все номера фонда и номера без учёта в фонде, где кто-то живёт в [start, end):
+        # (id номера или None, номер, мест, примечание, занято в пиковый день)
+        rows = [(room_id, number, capacity, notes, self.occupied(number, start, end, ignore))
+                for room_id, (number, capacity, notes) in self.rooms.items()]
+        for number in self.index:
+            if number not in self.capacities:
+                occupied = self.occupied(number, start, end, ignore)
+                if occupied:
+                    rows.append((None, number, DEFAULT_CAPACITY, None, occupied))
+        return sorted(rows, key=lambda row: room_key(row[1]))
+
+    def free_rooms(self, start, end, ignore=None, places=1):
+        return [row for row in self.availability(start, end, ignore)
+                if row[0] is not None and row[4] + places <= row[2]]
+
+    def overbooked(self, start, end):
+        return [row for row in self.availability(start, end) if row[4] > row[2]]
+
+    def check(self, guest_id, room, check_in, check_out):
+        room = (room or '').strip()
+        if not room or not check_in or not check_out or check_out <= check_in:
+            return
+        start, end = to_day(check_in), to_day(check_out)
+        others = self.guests(room, start, end, ignore=guest_id)
+        if peak(others, start, end) < self.capacity(room):
+            return
+        _, _, other_id = others[0]
+        free = ', '.join(row[1] for row in self.free_rooms(start, end, guest_id)) or 'нет'
+        raise RoomConflict(f"В номере {room} нет мест с {format_day(start)} по {format_day(end)} "
+                           f"(проживает отдыхающий №{other_id}). Свободные номера: {free}")
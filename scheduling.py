@@ -0,0 +1,183 @@
+import bisect
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from schema import ISO_DATETIME_FORMAT, DATE_FORMAT, TIME_FORMAT
+
+# Отменённые записи время не занимают
+CANCELLED = 'Отменен'
+
+# Длительность, если у услуги она не указана, мин
+DEFAULT_DURATION = 30
+
+# Рабочий день, в пределах которого ищется свободное время, мин от полуночи
+WORKDAY_START = 8 * 60
+WORKDAY_END = 20 * 60
+
+# Сколько дней вперёд ищется свободное время
+SEARCH_DAYS = 366
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class ScheduleConflict(Exception):
+    pass
+
+
+def to_minutes(starts_at):
+    return int((datetime.strptime(starts_at, ISO_DATETIME_FORMAT) - EPOCH).total_seconds()) // 60
+
+
+def from_minutes(minutes):
+    return EPOCH + timedelta(minutes=minutes)
+
+
+def format_minutes(minutes):
+    value = from_minutes(minutes)
+    return value.strftime(DATE_FORMAT), value.strftime(TIME_FORMAT)
+
+
+class IntervalIndex:
+    # Интервалы [start, end) одного гостя, одной услуги или одного номера. Хранятся по
+    # длине: в каждой корзине - список (start, end, id), упорядоченный по началу. Интервал
+    # длины length пересекает [start, end), только если начался в (start - length, end),
+    # поэтому в каждой корзине поиск - два двоичных поиска, и просматриваются только
+    # пересекающиеся интервалы; длинный интервал не расширяет поиск среди коротких.
+    # Длин немного (длительности услуг, сроки проживания). Вставка в список - сдвиг
+    # памяти, O(n), но на тысячах интервалов это микросекунды
+    def __init__(self):
+        self.buckets = {}
+
+    def __iter__(self):
+        for bucket in self.buckets.values():
+            yield from bucket
+
+    def add(self, start, end, appointment_id):
+        bisect.insort(self.buckets.setdefault(end - start, []), (start, end, appointment_id))
+
+    def remove(self, start, end, appointment_id):
+        bucket = self.buckets.get(end - start)
+        if bucket is None:
+            return
+        item = (start, end, appointment_id)
+        i = bisect.bisect_left(bucket, item)
+        if i < len(bucket) and bucket[i] == item:
+            del bucket[i]
+            if not bucket:
+                del self.buckets[end - start]
+
+    def overlapping(self, start, end):
+        found = []
+        for length, bucket in self.buckets.items():
+            lo = bisect.bisect_right(bucket, (start - length, float('inf')))
+            hi = bisect.bisect_left(bucket, (end,))
+            found += bucket[lo:hi]
+        # По началу: первый мешающий интервал попадает в сообщение о конфликте
+        return sorted(found) if len(self.buckets) > 1 else found
+
+
+class Scheduler:
+    # Занятость гостей и услуг в памяти. Строится из БД при первом обращении и обновляется
+    # каждой операцией с записями, так что проверка пересечений не требует запросов
+    def __init__(self):
+        self.guests = defaultdict(IntervalIndex)
+        self.services = defaultdict(IntervalIndex)
+        self.appointments = {}
+        self.durations = {}
+        self.loaded = False
+
+    def clear(self):
+        # Расписание будет перечитано из БД при следующем обращении
+        self.guests.clear()
+        self.services.clear()
+        self.appointments.clear()
+        self.durations = {}
+        self.loaded = False
+
+    def load(self, conn):
+        self.clear()
+        self.durations = dict(conn.execute("SELECT id, duration FROM services"))
+        cursor = conn.execute('''SELECT id, guest_id, service_id, starts_at, status FROM appointments
+                                 WHERE starts_at IS NOT NULL AND status IS NOT ?''', (CANCELLED,))
+        for appointment_id, guest_id, service_id, starts_at, status in cursor:
+            self.place(appointment_id, guest_id, service_id, starts_at, status)
+        self.loaded = True
+
+    def length(self, service_id):
+        return self.durations.get(service_id) or DEFAULT_DURATION
+
+    def interval(self, service_id, starts_at):
+        start = to_minutes(starts_at)
+        return start, start + self.length(service_id)
+
+    def place(self, appointment_id, guest_id, service_id, starts_at, status):
+        # Добавляет или переносит запись; отменённая запись из расписания убирается
+        self.remove(appointment_id)
+        if starts_at and status != CANCELLED:
+            self.add(appointment_id, guest_id, service_id, to_minutes(starts_at))
+
+    def add(self, appointment_id, guest_id, service_id, start):
+        end = start + self.length(service_id)
+        self.appointments[appointment_id] = (guest_id, service_id, start, end)
+        self.guests[guest_id].add(start, end, appointment_id)
+        self.services[service_id].add(start, end, appointment_id)
+
+    def remove(self, appointment_id):
+        entry = self.appointments.pop(appointment_id, None)
+        if entry is None:
+            return
+        guest_id, service_id, start, end = entry
+        self.guests[guest_id].remove(start, end, appointment_id)
+        self.services[service_id].remove(start, end, appointment_id)
+
+    def set_duration(self, service_id, duration):
+        # Новая длительность услуги меняет концы всех её интервалов
+        if self.durations.get(service_id) == duration:
+            return
+        self.durations[service_id] = duration
+        for start, end, appointment_id in list(self.services[service_id]):
+            guest_id = self.appointments[appointment_id][0]
+            self.remove(appointment_id)
+            self.add(appointment_id, guest_id, service_id, start)
+
+    def conflicts(self, guest_id, service_id, start, end, ignore=None):
+        found = [('guest', item) for item in self.guests[guest_id].overlapping(start, end)]
+        found += [('service', item) for item in self.services[service_id].overlapping(start, end)]
+        return [(kind, item) for kind, item in found if item[2] != ignore]
+
+    def check(self, guest_id, service_id, starts_at, status, ignore=None):
+        if not starts_at or status == CANCELLED:
+            return
+        start, end = self.interval(service_id, starts_at)
+        found = self.conflicts(guest_id, service_id, start, end, ignore)
+        if not found:
+            return
+        kind, (_, _, appointment_id) = found[0]
+        reason = ("Отдыхающий уже записан на это время" if kind == 'guest'
+                  else "Услуга уже занята в это время")
+        free = self.next_free_slot(guest_id, service_id, start, ignore)
+        if free is None:
+            raise ScheduleConflict(f"{reason} (запись №{appointment_id}). "
+                                   f"Свободного времени в ближайшие {SEARCH_DAYS} дней нет")
+        date, time = format_minutes(free)
+        raise ScheduleConflict(f"{reason} (запись №{appointment_id}). Ближайшее свободное время: {date} {time}")
+
+    def next_free_slot(self, guest_id, service_id, start, ignore=None):
+        # Сдвигаем начало на конец мешающих интервалов, пока окно не освободится.
+        # None - услуга длиннее рабочего дня или свободного окна нет в ближайшие SEARCH_DAYS дней
+        length = self.length(service_id)
+        if length > WORKDAY_END - WORKDAY_START:
+            return None
+        limit = start - start % (24 * 60) + SEARCH_DAYS * 24 * 60
+        while start < limit:
+            day = start - start % (24 * 60)
+            if start < day + WORKDAY_START:
+                start = day + WORKDAY_START
+            elif start + length > day + WORKDAY_END:
+                start = day + 24 * 60 + WORKDAY_START
+                continue
+            found = self.conflicts(guest_id, service_id, start, start + length, ignore)
+            if not found:
+                return start
+            start = max(item[1] for _, item in found)
+        return None
@@ -0,0 +1,347 @@
+from datetime import datetime
+
+from events import INSERT, UPDATE, DELETE
+
+# Форматы, в которых даты вводятся и показываются в интерфейсе
+DATE_FORMAT = '%d.%m.%Y'
+TIME_FORMAT = '%H:%M'
+
+# Форматы для хранения: ISO-8601 сортируется как строка, поэтому по нему работают индексы
+ISO_DATE_FORMAT = '%Y-%m-%d'
+ISO_DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def to_iso_date(text):
+    # dd.mm.YYYY -> YYYY-MM-DD, для пустых и нераспознанных значений None
+    try:
+        return datetime.strptime(text.strip(), DATE_FORMAT).strftime(ISO_DATE_FORMAT)
+    except (AttributeError, ValueError):
+        return None
+
+
+def to_iso_datetime(date, time):
+    try:
+        value = datetime.strptime(f"{date.strip()} {time.strip()}", f"{DATE_FORMAT} {TIME_FORMAT}")
+        return value.strftime(ISO_DATETIME_FORMAT)
+    except (AttributeError, ValueError):
+        return None
+
+
+def from_iso_datetime(value):
+    # 'YYYY-MM-DD HH:MM' -> (dd.mm.YYYY, HH:MM) для показа
+    value = datetime.strptime(value, ISO_DATETIME_FORMAT)
+    return value.strftime(DATE_FORMAT), value.strftime(TIME_FORMAT)
+
+
+def migration_1_base_schema(cursor):
+    # Таблица отдыхающих
+    cursor.execute('''CREATE TABLE IF NOT EXISTS guests (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        last_name TEXT NOT NULL,
+                        first_name TEXT NOT NULL,
+                        middle_name TEXT,
+                        birth_date TEXT,
+                        passport TEXT,
+                        phone TEXT,
+                        check_in_date TEXT,
+                        check_out_date TEXT,
+                        room TEXT,
+                        notes TEXT)''')
+
+    # Таблица услуг
+    cursor.execute('''CREATE TABLE IF NOT EXISTS services (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT NOT NULL,
+                        description TEXT,
+                        price REAL NOT NULL,
+                        duration INTEGER)''')
+
+    # Таблица записей
+    cursor.execute('''CREATE TABLE IF NOT EXISTS appointments (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        guest_id INTEGER NOT NULL,
+                        service_id INTEGER NOT NULL,
+                        date TEXT NOT NULL,
+                        time TEXT NOT NULL,
+                        status TEXT DEFAULT 'Запланирован',
+                        FOREIGN KEY (guest_id) REFERENCES guests (id),
+                        FOREIGN KEY (service_id) REFERENCES services (id))''')
+
+
+def migration_2_iso_dates_and_indexes(cursor):
+    # Сортируемые копии дат в ISO-8601 рядом с исходными текстовыми полями
+    cursor.execute("ALTER TABLE appointments ADD COLUMN starts_at TEXT")
+    cursor.execute("ALTER TABLE guests ADD COLUMN check_in TEXT")
+    cursor.execute("ALTER TABLE guests ADD COLUMN check_out TEXT")
+    cursor.execute("UPDATE appointments SET starts_at = to_iso_datetime(date, time)")
+    cursor.execute('''UPDATE guests SET check_in = to_iso_date(check_in_date),
+                                        check_out = to_iso_date(check_out_date)''')
+
+    # Проверки COUNT(*) при удалении гостя/услуги и выборки по гостю/услуге
+    # читают только индекс, без обращения к таблице
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_guest ON appointments (guest_id, starts_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_service ON appointments (service_id, starts_at)")
+    # Диапазоны дат и хронологическая сортировка
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_starts_at ON appointments (starts_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_guests_stay ON guests (check_in, check_out)")
+
+
+def migration_3_guests_fts(cursor):
+    # Полнотекстовый индекс по гостям для поиска по мере ввода. Таблица хранит только
+    # индекс (external content), сами данные берутся из guests
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS guests_fts USING fts5 (
+                        last_name, first_name, middle_name, passport, phone, room,
+                        content='guests', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')''')
+
+    # Триггеры держат индекс в синхронизации с таблицей
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS guests_fts_insert AFTER INSERT ON guests BEGIN
+                        INSERT INTO guests_fts (rowid, last_name, first_name, middle_name, passport, phone, room)
+                        VALUES (new.id, new.last_name, new.first_name, new.middle_name, new.passport, new.phone, new.room);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS guests_fts_delete AFTER DELETE ON guests BEGIN
+                        INSERT INTO guests_fts (guests_fts, rowid, last_name, first_name, middle_name, passport, phone, room)
+                        VALUES ('delete', old.id, old.last_name, old.first_name, old.middle_name, old.passport, old.phone, old.room);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS guests_fts_update AFTER UPDATE ON guests BEGIN
+                        INSERT INTO guests_fts (guests_fts, rowid, last_name, first_name, middle_name, passport, phone, room)
+                        VALUES ('delete', old.id, old.last_name, old.first_name, old.middle_name, old.passport, old.phone, old.room);
+                        INSERT INTO guests_fts (rowid, last_name, first_name, middle_name, passport, phone, room)
+                        VALUES (new.id, new.last_name, new.first_name, new.middle_name, new.passport, new.phone, new.room);
+                      END''')
+    cursor.execute("INSERT INTO guests_fts (guests_fts) VALUES ('rebuild')")
+
+
+# Сколько дней проживания одного гостя учитывается в daily_occupancy (триггеры
+# не поддерживают рекурсивные WITH, поэтому дни перебираются по таблице-счётчику)
+MAX_STAY_DAYS = 3660
+
+# Пересчёт сводных таблиц с нуля по тем же правилам, что и в триггерах migration_4_summaries:
+# отменённые записи и записи без даты не учитываются, выручка = число записей * текущая цена.
+# {appointments} и {guests} - источники строк: при подключённом архиве это ALL_APPOINTMENTS
+# и ALL_GUESTS из archive.py, чтобы перенесённая история не выпала из отчётов
+SUMMARY_REBUILD = (
+    "DELETE FROM daily_service_revenue",
+    "DELETE FROM guest_service_revenue",
+    "DELETE FROM daily_occupancy",
+    '''INSERT INTO daily_service_revenue (day, service_id, appointments, revenue)
+       SELECT substr(a.starts_at, 1, 10), a.service_id, COUNT(*), COUNT(*) * COALESCE(s.price, 0)
+       FROM {appointments} a LEFT JOIN services s ON s.id = a.service_id
+       WHERE a.starts_at IS NOT NULL AND a.status IS NOT 'Отменен'
+       GROUP BY 1, 2''',
+    '''INSERT INTO guest_service_revenue (guest_id, service_id, appointments, revenue)
+       SELECT a.guest_id, a.service_id, COUNT(*), COUNT(*) * COALESCE(s.price, 0)
+       FROM {appointments} a LEFT JOIN services s ON s.id = a.service_id
+       WHERE a.starts_at IS NOT NULL AND a.status IS NOT 'Отменен'
+       GROUP BY 1, 2''',
+    '''INSERT INTO daily_occupancy (day, room, guests)
+       SELECT date(g.check_in, '+' || d.n || ' days'), COALESCE(g.room, ''), COUNT(*)
+       FROM {guests} g JOIN report_days d ON d.n < julianday(g.check_out) - julianday(g.check_in)
+       WHERE g.check_in IS NOT NULL AND g.check_out > g.check_in
+       GROUP BY 1, 2''',
+)
+
+
+def rebuild_summaries(cursor, appointments='appointments', guests='guests'):
+    # Транзакцией управляет вызывающий
+    for statement in SUMMARY_REBUILD:
+        cursor.execute(statement.format(appointments=appointments, guests=guests))
+
+
+# Тела триггеров: добавить или убрать запись из сводок. {row} - new или old.
+# Выручка пересчитывается как число записей * цена, поэтому ошибки округления не копятся
+APPOINTMENT_SUMMARY_ADD = '''
+    INSERT INTO daily_service_revenue (day, service_id, appointments, revenue)
+    VALUES (substr({row}.starts_at, 1, 10), {row}.service_id, 1,
+            COALESCE((SELECT price FROM services WHERE id = {row}.service_id), 0))
+    ON CONFLICT (day, service_id) DO UPDATE
+    SET appointments = appointments + 1, revenue = (appointments + 1) * excluded.revenue;
+    INSERT INTO guest_service_revenue (guest_id, service_id, appointments, revenue)
+    VALUES ({row}.guest_id, {row}.service_id, 1,
+            COALESCE((SELECT price FROM services WHERE id = {row}.service_id), 0))
+    ON CONFLICT (guest_id, service_id) DO UPDATE
+    SET appointments = appointments + 1, revenue = (appointments + 1) * excluded.revenue;'''
+
+APPOINTMENT_SUMMARY_REMOVE = '''
+    UPDATE daily_service_revenue
+    SET appointments = appointments - 1,
+        revenue = (appointments - 1) * COALESCE((SELECT price FROM services WHERE id = {row}.service_id), 0)
+    WHERE day = substr({row}.starts_at, 1, 10) AND service_id = {row}.service_id;
+    DELETE FROM daily_service_revenue
+    WHERE day = substr({row}.starts_at, 1, 10) AND service_id = {row}.service_id AND appointments <= 0;
+    UPDATE guest_service_revenue
+    SET appointments = appointments - 1,
+        revenue = (appointments - 1) * COALESCE((SELECT price FROM services WHERE id = {row}.service_id), 0)
+    WHERE guest_id = {row}.guest_id AND service_id = {row}.service_id;
+    DELETE FROM guest_service_revenue
+    WHERE guest_id = {row}.guest_id AND service_id = {row}.service_id AND appointments <= 0;'''
+
+APPOINTMENT_COUNTED = "{row}.starts_at IS NOT NULL AND {row}.status IS NOT 'Отменен'"
+
+STAY_ADD = '''
+    INSERT INTO daily_occupancy (day, room, guests)
+    SELECT date({row}.check_in, '+' || n || ' days'), COALESCE({row}.room, ''), 1 FROM report_days
+    WHERE n < julianday({row}.check_out) - julianday({row}.check_in)
+    ON CONFLICT (day, room) DO UPDATE SET guests = guests + 1;'''
+
+STAY_REMOVE = '''
+    UPDATE daily_occupancy SET guests = guests - 1
+    WHERE room = COALESCE({row}.room, '') AND day >= {row}.check_in AND day < {row}.check_out;
+    DELETE FROM daily_occupancy
+    WHERE room = COALESCE({row}.room, '') AND day >= {row}.check_in AND day < {row}.check_out AND guests <= 0;'''
+
+STAY_COUNTED = "{row}.check_in IS NOT NULL AND {row}.check_out > {row}.check_in"
+
+
+def migration_4_summaries(cursor):
+    # Сводные таблицы для отчётов: выручка по дням и услугам, по гостям и заполняемость номеров.
+    # Поддерживаются триггерами при каждом изменении, так что отчёт не пересчитывает историю
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_service_revenue (
+                        day TEXT NOT NULL,
+                        service_id INTEGER NOT NULL,
+                        appointments INTEGER NOT NULL,
+                        revenue REAL NOT NULL,
+                        PRIMARY KEY (day, service_id)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS guest_service_revenue (
+                        guest_id INTEGER NOT NULL,
+                        service_id INTEGER NOT NULL,
+                        appointments INTEGER NOT NULL,
+                        revenue REAL NOT NULL,
+                        PRIMARY KEY (guest_id, service_id)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_occupancy (
+                        day TEXT NOT NULL,
+                        room TEXT NOT NULL,
+                        guests INTEGER NOT NULL,
+                        PRIMARY KEY (day, room)) WITHOUT ROWID''')
+    # Для пересчёта выручки при смене цены услуги
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_service_revenue_service ON daily_service_revenue (service_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_guest_service_revenue_service ON guest_service_revenue (service_id)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS report_days (n INTEGER PRIMARY KEY)")
+    cursor.executemany("INSERT OR IGNORE INTO report_days (n) VALUES (?)", ((n,) for n in range(MAX_STAY_DAYS)))
+
+    triggers = [
+        ('appointments_summary_insert', 'AFTER INSERT ON appointments',
+         APPOINTMENT_COUNTED.format(row='new'), APPOINTMENT_SUMMARY_ADD.format(row='new')),
+        ('appointments_summary_delete', 'AFTER DELETE ON appointments',
+         APPOINTMENT_COUNTED.format(row='old'), APPOINTMENT_SUMMARY_REMOVE.format(row='old')),
+        # Изменение записи - это снятие старой версии и добавление новой
+        ('appointments_summary_update_old', 'AFTER UPDATE OF guest_id, service_id, starts_at, status ON appointments',
+         APPOINTMENT_COUNTED.format(row='old'), APPOINTMENT_SUMMARY_REMOVE.format(row='old')),
+        ('appointments_summary_update_new', 'AFTER UPDATE OF guest_id, service_id, starts_at, status ON appointments',
+         APPOINTMENT_COUNTED.format(row='new'), APPOINTMENT_SUMMARY_ADD.format(row='new')),
+        ('services_summary_price', 'AFTER UPDATE OF price ON services', 'new.price IS NOT old.price', '''
+            UPDATE daily_service_revenue SET revenue = appointments * new.price WHERE service_id = new.id;
+            UPDATE guest_service_revenue SET revenue = appointments * new.price WHERE service_id = new.id;'''),
+        ('guests_occupancy_insert', 'AFTER INSERT ON guests',
+         STAY_COUNTED.format(row='new'), STAY_ADD.format(row='new')),
+        ('guests_occupancy_delete', 'AFTER DELETE ON guests',
+         STAY_COUNTED.format(row='old'), STAY_REMOVE.format(row='old')),
+        ('guests_occupancy_update_old', 'AFTER UPDATE OF check_in, check_out, room ON guests',
+         STAY_COUNTED.format(row='old'), STAY_REMOVE.format(row='old')),
+        ('guests_occupancy_update_new', 'AFTER UPDATE OF check_in, check_out, room ON guests',
+         STAY_COUNTED.format(row='new'), STAY_ADD.format(row='new')),
+    ]
+    for name, event, condition, body in triggers:
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} WHEN {condition} BEGIN {body}\n END")
+
+    rebuild_summaries(cursor)
+
+
+def migration_5_list_indexes(cursor):
+    # Сортировка списков по столбцу и фильтры идут диапазоном по индексу. rowid входит
+    # в каждый индекс, поэтому порядок (столбец, id) для keyset-пагинации даёт сам индекс.
+    # Услуг немного, их сортировка индексов не требует
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_guests_last_name ON guests (last_name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_guests_check_out ON guests (check_out)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_guests_room ON guests (room, check_in)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_status ON appointments (status, starts_at)")
+
+
+# Таблицы, изменения строк которых видят другие процессы, открывшие ту же базу
+CHANGELOG_TABLES = ('guests', 'services', 'appointments')
+
+
+def migration_6_changelog(cursor):
+    # Журнал изменений строк, который заполняют триггеры. AUTOINCREMENT гарантирует,
+    # что номер только растёт и не переиспользуется после очистки старых записей
+    cursor.execute('''CREATE TABLE IF NOT EXISTS changelog (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        tbl TEXT NOT NULL,
+                        kind TEXT NOT NULL,
+                        row_id INTEGER NOT NULL)''')
+    for table in CHANGELOG_TABLES:
+        create_changelog_triggers(cursor, table)
+
+
+def create_changelog_triggers(cursor, table):
+    for event, kind, row in (('INSERT', INSERT, 'NEW'), ('UPDATE', UPDATE, 'NEW'), ('DELETE', DELETE, 'OLD')):
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_changelog_{kind} AFTER {event} ON {table} BEGIN
+                             INSERT INTO changelog (tbl, kind, row_id) VALUES ('{table}', '{kind}', {row}.id);
+                           END''')
+
+
+# Пока идёт перенос в архив, удаление строк не вычитается из сводок
+NOT_ARCHIVING = "NOT EXISTS (SELECT 1 FROM maintenance WHERE name = 'archiving')"
+
+
+def migration_7_archive(cursor):
+    # Флаги служебных операций, которые видят триггеры. Перенос в архив (archive.py) -
+    # это DELETE из рабочих таблиц, но выручка и заполняемость за прошлые дни остаются
+    cursor.execute("CREATE TABLE IF NOT EXISTS maintenance (name TEXT PRIMARY KEY)")
+    triggers = [
+        ('appointments_summary_delete', 'AFTER DELETE ON appointments',
+         APPOINTMENT_COUNTED.format(row='old'), APPOINTMENT_SUMMARY_REMOVE.format(row='old')),
+        ('guests_occupancy_delete', 'AFTER DELETE ON guests',
+         STAY_COUNTED.format(row='old'), STAY_REMOVE.format(row='old')),
+    ]
+    for name, event, condition, body in triggers:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"CREATE TRIGGER {name} {event} WHEN {condition} AND {NOT_ARCHIVING} BEGIN {body}\n END")
+
+
+def migration_8_rooms(cursor):
+    # Номерной фонд: номер и число мест. Заполняется номерами, которые уже встречаются
+    # у гостей; мест - сколько гостей когда-либо жило в номере одновременно, но не меньше одного.
+    # Одновременность считается на дни заезда - в один из них и достигается пик
+    cursor.execute('''CREATE TABLE IF NOT EXISTS rooms (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        number TEXT NOT NULL UNIQUE,
+                        capacity INTEGER NOT NULL DEFAULT 1 CHECK (capacity > 0),
+                        notes TEXT)''')
+    cursor.execute('''INSERT OR IGNORE INTO rooms (number, capacity)
+                      SELECT room, MAX(1, MAX((SELECT COUNT(*) FROM guests o
+                                               WHERE o.room = g.room AND o.check_in <= g.check_in
+                                                 AND o.check_out > g.check_in)))
+                      FROM guests g WHERE room <> '' GROUP BY room''')
+    create_changelog_triggers(cursor, 'rooms')
+
+
+# Порядок менять нельзя: номер миграции = её позиция в списке, он же PRAGMA user_version
+MIGRATIONS = [
+    migration_1_base_schema,
+    migration_2_iso_dates_and_indexes,
+    migration_3_guests_fts,
+    migration_4_summaries,
+    migration_5_list_indexes,
+    migration_6_changelog,
+    migration_7_archive,
+    migration_8_rooms,
+]
+
+
+def migrate(conn):
+    # Доводим схему до последней версии; уже применённые миграции пропускаются,
+    # поэтому вызывать можно при каждом запуске
+    conn.create_function('to_iso_date', 1, to_iso_date)
+    conn.create_function('to_iso_datetime', 2, to_iso_datetime)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
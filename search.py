@@ -0,0 +1,26 @@
+import re
+
+# Сколько совпадений показываем при поиске по мере ввода
+SEARCH_LIMIT = 20
+
+
+def fts_query(text):
+    # Каждое слово ищется как префикс: «ив пет» найдёт «Иванов Пётр»
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+def search_guests(cursor, select, text, limit=SEARCH_LIMIT):
+    # Лучшие limit совпадений по индексу guests_fts; select - выборка из guests
+    query = fts_query(text)
+    if not query:
+        return []
+    cursor.execute(f'''{select} JOIN (SELECT rowid AS hit, rank AS score FROM guests_fts
+                                      WHERE guests_fts MATCH ? ORDER BY rank LIMIT ?) ON hit = id
+                       ORDER BY score''', (query, limit))
+    return cursor.fetchall()
+
+
+def latest_guests(cursor, select, limit=SEARCH_LIMIT):
+    # Пока ничего не введено, предлагаем последних заселившихся
+    cursor.execute(f"{select} ORDER BY id DESC LIMIT ?", (limit,))
+    return cursor.fetchall()
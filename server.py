@@ -0,0 +1,327 @@
+import argparse
+import inspect
+import logging
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from database import DB_PATH, CHECKPOINT_INTERVAL
+from diagnostics import InstrumentedConnection
+from events import DELETE
+from protocol import (DEFAULT_HOST, DEFAULT_PORT, CLIENT_HEADER, LONG_POLL_TIMEOUT, METHODS, READ_METHODS,
+                      WRITE_METHODS, FILE_METHODS, BULK_METHODS, ARCHIVE_METHODS, RELOAD_METHODS, ERRORS, encode,
+                      decode, error_payload)
+from repository import open_repository
+from archive import CHUNK_SIZE, ARCHIVE_INTERVAL
+from backup import BackupScheduler
+
+# Сколько последних изменений сервер помнит для клиентов, отставших в опросе
+CHANGE_LOG_SIZE = 10000
+
+# Каталог обмена рядом с базой: только здесь сервер читает файлы импорта и пишет выгрузки
+FILES_DIR = 'exchange'
+
+logger = logging.getLogger('sanatorium.server')
+
+
+class ChangeLog:
+    # Лента изменений строк с возрастающим номером. Клиент спрашивает всё после
+    # последнего полученного номера и ждёт, пока появится новое (long-poll).
+    # epoch меняется после массовых операций и перезапуска сервера: клиент с другим
+    # epoch или отставший дальше хранимой истории перечитывает списки целиком
+    def __init__(self, size=CHANGE_LOG_SIZE):
+        self.entries = deque(maxlen=size)
+        self.seq = 0
+        # Свой epoch у каждого запуска сервера
+        self.epoch = time.time_ns() // 1000000
+        self.condition = threading.Condition()
+
+    def publish(self, changes, client):
+        if not changes:
+            return
+        with self.condition:
+            for table, kind, row_id in changes:
+                self.seq += 1
+                self.entries.append((self.seq, table, kind, row_id, client))
+            self.condition.notify_all()
+
+    def reset(self):
+        with self.condition:
+            self.epoch += 1
+            self.entries.clear()
+            self.condition.notify_all()
+
+    def since(self, epoch, seq, timeout):
+        with self.condition:
+            if seq is None:
+                # Первое подключение: только текущая позиция ленты
+                return {'epoch': self.epoch, 'seq': self.seq, 'changes': [], 'reset': False}
+            self.condition.wait_for(lambda: epoch != self.epoch or self.seq > seq, timeout)
+            first = self.entries[0][0] if self.entries else self.seq + 1
+            if epoch != self.epoch or seq > self.seq or seq + 1 < first:
+                return {'epoch': self.epoch, 'seq': self.seq, 'changes': [], 'reset': True}
+            changes = [entry[1:] for entry in self.entries if entry[0] > seq]
+            return {'epoch': self.epoch, 'seq': self.seq, 'changes': changes, 'reset': False}
+
+
+class SanatoriumService:
+    # Единственный владелец соединения с базой. Вызовы от всех клиентов выполняются
+    # по одному под блокировкой, поэтому записи не спорят за файл и не получают
+    # «database is locked». Пакет вызовов выполняется в одной транзакции.
+    # Правки сохраняются группами: если за блокировкой ждут другие правки, commit
+    # откладывается до последней из них (но не дольше GROUP_COMMIT_WINDOW), и ответ
+    # каждый клиент получает после общего commit
+    def __init__(self, repo, files_dir=FILES_DIR):
+        self.repo = repo
+        self.files_dir = os.path.realpath(files_dir)
+        self.repo.group_commit = True
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.waiting_lock = threading.Lock()
+        self.changes = ChangeLog()
+
+    def execute(self, request):
+        method = request.get('method')
+        if method not in METHODS:
+            raise ValueError(f"Неизвестный метод: {method}")
+        args = list(request.get('args', []))
+        kwargs = dict(request.get('kwargs', {}))
+        if method in FILE_METHODS:
+            position = FILE_METHODS[method]
+            if position < len(args):
+                args[position] = self.file_path(args[position])
+            else:
+                kwargs['path'] = self.file_path(kwargs.get('path', ''))
+        result = getattr(self.repo, method)(*args, **kwargs)
+        if method in BULK_METHODS:
+            table, kind = BULK_METHODS[method]
+            return result, [(table, kind, row_id) for row_id in result]
+        if method in ARCHIVE_METHODS:
+            return result, archived_changes(*result)
+        if method not in WRITE_METHODS:
+            return result, []
+        table, kind, index = WRITE_METHODS[method]
+        return result, [(table, kind, result if index is None else argument(getattr(self.repo, method), args,
+                                                                            kwargs, index))]
+
+    def file_path(self, path):
+        # Клиент указывает файл относительно каталога обмена; выйти за его пределы нельзя
+        target = os.path.realpath(os.path.join(self.files_dir, str(path)))
+        if target == self.files_dir or os.path.commonpath([self.files_dir, target]) != self.files_dir:
+            raise ValueError(f"Файл должен лежать в каталоге обмена сервера: {path}")
+        os.makedirs(self.files_dir, exist_ok=True)
+        return target
+
+    def call(self, request, client):
+        write = request.get('method') not in READ_METHODS
+        result, changes = self.run(write, lambda: self.execute(request))
+        self.notify(request.get('method') in RELOAD_METHODS, changes, client)
+        return result
+
+    def batch(self, requests, client):
+        # Всё или ничего: при ошибке любого вызова откатывается весь пакет. Импорт и перенос
+        # в архив сами управляют транзакциями, в пакет они не входят
+        for request in requests:
+            if request.get('method') in RELOAD_METHODS | ARCHIVE_METHODS:
+                raise ValueError(f"Метод {request.get('method')} нельзя вызывать в пакете")
+        def execute():
+            results, changes = [], []
+            with self.repo.transaction():
+                for request in requests:
+                    result, changed = self.execute(request)
+                    results.append(result)
+                    changes += changed
+            return results, changes
+
+        results, changes = self.run(True, execute)
+        self.notify(any(request.get('method') in RELOAD_METHODS for request in requests), changes, client)
+        return results
+
+    def run(self, write, execute):
+        # Выполняет вызов под блокировкой и ждёт commit открытой группы: и правка, и чтение
+        # отвечают клиенту только сохранёнными данными
+        if write:
+            self.arrive(1)
+        with self.lock:
+            if write:
+                self.arrive(-1)
+            try:
+                outcome = execute()
+            except Exception:
+                self.repo.rollback()
+                raise
+            finally:
+                group = self.repo.group
+                self.commit_if_idle()
+        if group is not None:
+            group.done.wait()
+            if group.error is not None:
+                raise group.error
+        return outcome
+
+    def arrive(self, delta):
+        with self.waiting_lock:
+            self.waiting += delta
+
+    def commit_if_idle(self):
+        # Под self.lock. Правок за блокировкой нет или группа ждёт дольше окна - сохраняем.
+        # Иначе commit сделает следующая правка: она уже учтена в waiting
+        with self.waiting_lock:
+            idle = self.waiting == 0
+        if self.repo.group is not None and (idle or self.repo.group_due()):
+            try:
+                self.repo.commit_group()
+            except Exception:
+                logger.exception("Ошибка при сохранении группы правок")
+
+    def notify(self, reload, changes, client):
+        if reload:
+            self.changes.reset()
+        else:
+            self.changes.publish(changes, client)
+
+    def checkpoint(self, mode='PASSIVE'):
+        with self.lock:
+            self.repo.prune_changelog()
+            self.repo.checkpoint(mode)
+
+    def archive(self):
+        # Перенос устаревшего в архив пачками; между пачками блокировка отпускается,
+        # и вызовы клиентов не ждут окончания всего переноса
+        while True:
+            with self.lock:
+                try:
+                    appointment_ids, guest_ids = self.repo.archive_step()
+                    self.repo.commit_group()
+                except Exception:
+                    self.repo.rollback()
+                    raise
+            self.changes.publish(archived_changes(appointment_ids, guest_ids), '')
+            if len(appointment_ids) < CHUNK_SIZE and len(guest_ids) < CHUNK_SIZE:
+                return
+
+
+def argument(function, args, kwargs, index):
+    # Аргумент function с номером index, переданный по позиции или по имени
+    if index < len(args):
+        return args[index]
+    return kwargs[list(inspect.signature(function).parameters)[index]]
+
+
+def archived_changes(appointment_ids, guest_ids):
+    # Для клиентов перенесённые в архив строки удалены из рабочих списков
+    return ([('appointments', DELETE, row_id) for row_id in appointment_ids]
+            + [('guests', DELETE, row_id) for row_id in guest_ids])
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    # POST /call  {"method", "args", "kwargs"}  -> {"result"}
+    # POST /batch {"calls": [...]}              -> {"results": [...]}
+    # GET  /changes?epoch=&since=&timeout=      -> {"epoch", "seq", "changes", "reset"}
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        service = self.server.service
+        client = self.headers.get(CLIENT_HEADER, '')
+        try:
+            body = decode(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if self.path == '/call':
+                self.reply(200, {'result': service.call(body, client)})
+            elif self.path == '/batch':
+                self.reply(200, {'results': service.batch(body.get('calls', []), client)})
+            else:
+                self.reply(404, error_payload(ValueError(f"Неизвестный адрес: {self.path}")))
+        except Exception as e:
+            if type(e).__name__ not in ERRORS:
+                logger.exception("Ошибка при обработке %s", self.path)
+            self.reply(400 if type(e).__name__ in ERRORS else 500, error_payload(e))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/changes':
+            self.reply(404, error_payload(ValueError(f"Неизвестный адрес: {url.path}")))
+            return
+        query = parse_qs(url.query)
+        try:
+            epoch = int(query['epoch'][0]) if 'epoch' in query else None
+            seq = int(query['since'][0]) if 'since' in query else None
+            timeout = min(float(query.get('timeout', [LONG_POLL_TIMEOUT])[0]), LONG_POLL_TIMEOUT)
+        except ValueError as e:
+            self.reply(400, error_payload(e))
+            return
+        self.reply(200, self.server.service.changes.since(epoch, seq, timeout))
+
+    def reply(self, status, payload):
+        body = encode(payload)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def serve(path=DB_PATH, host=DEFAULT_HOST, port=DEFAULT_PORT, files_dir=None):
+    # Соединение открывается здесь, а используется потоками обработчиков - по одному
+    # под блокировкой SanatoriumService, поэтому check_same_thread отключён
+    repo = open_repository(path, factory=InstrumentedConnection, check_same_thread=False)
+    files_dir = files_dir or os.path.join(os.path.dirname(os.path.abspath(path)), FILES_DIR)
+    service = SanatoriumService(repo, files_dir)
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.service = service
+    stopped = threading.Event()
+
+    def checkpoints():
+        while not stopped.wait(CHECKPOINT_INTERVAL / 1000):
+            # Одна неудача (база занята) не должна останавливать checkpoint до конца работы
+            try:
+                service.checkpoint()
+            except Exception:
+                logger.exception("Ошибка при checkpoint")
+
+    def archives():
+        while not stopped.wait(ARCHIVE_INTERVAL / 1000):
+            try:
+                service.archive()
+            except Exception:
+                logger.exception("Ошибка при переносе в архив")
+
+    threading.Thread(target=checkpoints, daemon=True).start()
+    threading.Thread(target=archives, daemon=True).start()
+    # Копия читает базу своим соединением и не берёт блокировку SanatoriumService
+    backups = BackupScheduler(path).start()
+    logger.info("Сервер %s слушает http://%s:%s", path, host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        backups.stop()
+        server.server_close()
+        with service.lock:
+            repo.checkpoint('TRUNCATE')
+            repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервер базы санатория для нескольких рабочих мест")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--files', help="каталог обмена для импорта и выгрузок; по умолчанию exchange рядом с базой")
+    parser.add_argument('--verbose', action='store_true', help="писать в журнал каждый запрос")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(name)s %(message)s')
+    serve(args.db, args.host, args.port, args.files)
+
+
+if __name__ == '__main__':
+    main()
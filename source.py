@@ -1,79 +1,495 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
-import sqlite3
+from tkinter import ttk, messagebox, filedialog
+import argparse
+import os
+import re
 from datetime import datetime
 
+from events import ChangeBus, INSERT, UPDATE, DELETE
+from executor import DbExecutor
+from database import CHECKPOINT_INTERVAL, DB_PATH
+from schema import to_iso_datetime, from_iso_datetime
+from records import GUEST_FIELDS, SERVICE_FIELDS
+from importer import format_result
+from export import date_bounds
+from calendar_view import CalendarView
+from search import fts_query
+from reports import REPORTS
+from repository import open_repository, PAGE_SIZE, GUEST_SORTS, SERVICE_SORTS, APPOINTMENT_SORTS
+from diagnostics import InstrumentedConnection, dump, format_histogram
+from remote import RemoteRepository, ChangeListener, new_client_id
+from archive import APPOINTMENTS_AFTER_DAYS, GUESTS_AFTER_DAYS, CHUNK_SIZE, ARCHIVE_INTERVAL
+from backup import BackupScheduler
+
+# Сколько страниц по PAGE_SIZE строк держим в дереве
+MAX_PAGES = 5
+
+# Задержка поиска после последнего нажатия клавиши, мс
+SEARCH_DELAY = 250
+
+# Как часто проверять изменения, сделанные другими процессами с той же базой, мс
+CHANGE_POLL_INTERVAL = 1000
+
+# Первый перенос в архив - через минуту после запуска, чтобы не мешать первой загрузке вкладок, мс
+ARCHIVE_START_DELAY = 60 * 1000
+
+# Сводные отчёты, доступные из интерфейса
+SUMMARY_REPORTS = {
+    'Выручка по дням': 'revenue_by_day',
+    'Выручка по услугам': 'revenue_by_service',
+    'Выручка по гостям (за всё время)': 'revenue_by_guest',
+    'Заполняемость номеров': 'occupancy',
+}
+
+# Выгрузки, доступные из интерфейса
+EXPORT_REPORTS = {
+    'Записи с ценами услуг': 'appointments',
+    'Лицевые счета гостей': 'ledger',
+}
+
+# Какие номера показывать в окне «Номера»: строки room_availability -> отобранные
+ROOM_VIEWS = {
+    'Все номера': lambda rows: rows,
+    'Свободные': lambda rows: [row for row in rows if row[0] is not None and row[4] < row[2]],
+    'С накладками': lambda rows: [row for row in rows if row[4] > row[2]],
+}
+
+# guest_id и service_id хранятся в строке дерева записей, но не показываются
+APPOINTMENT_COLUMNS = ('id', 'guest_name', 'service_name', 'date', 'time', 'status', 'guest_id', 'service_id')
+
+
+class PagedTree:
+    # Виртуализированный список: в Treeview лежит только окно из нескольких страниц,
+    # остальное догружается по мере движения скроллбара.
+    # fetch(callback, errback, after, before, limit) и fetch_row(row_id, callback, errback)
+    # асинхронны: строки приходят в callback уже в главном потоке
+    def __init__(self, tree, scrollbar, fetch, fetch_row, page_size=PAGE_SIZE, max_pages=MAX_PAGES):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.fetch = fetch
+        self.fetch_row = fetch_row
+        self.page_size = page_size
+        self.max_rows = page_size * max_pages
+        self.at_start = True
+        self.at_end = True
+        self.loading = False
+        self.pending = False
+        # Показан фиксированный набор строк (результат поиска), подгрузка отключена
+        self.fixed = False
+        # Ответы на запросы, отправленные до reload/show, отбрасываются
+        self.generation = 0
+        # Сортировка и фильтры: передаются в fetch как есть и применяются в SQL
+        self.query = {}
+        self.titles = {}
+        # Надпись поверх пустого списка, пока идёт первая загрузка
+        self.placeholder = ttk.Label(tree, text="Загрузка...")
+        self.tree.configure(yscrollcommand=self.on_scroll)
+
+    def reset(self, fixed):
+        self.generation += 1
+        self.tree.delete(*self.tree.get_children())
+        self.loading = False
+        self.at_start = True
+        self.at_end = fixed
+        self.fixed = fixed
+
+    def reload(self):
+        self.reset(fixed=False)
+        self.placeholder.place(relx=0.5, rely=0.3, anchor='center')
+        # Первая страница плюс запас для плавной прокрутки
+        self.load_next(self.page_size * 2)
+
+    def show(self, rows):
+        self.reset(fixed=True)
+        self.placeholder.place_forget()
+        for row in rows:
+            self.tree.insert('', 'end', iid=str(row[0]), values=row)
+
+    def first_id(self):
+        children = self.tree.get_children()
+        return int(children[0]) if children else None
+
+    def last_id(self):
+        children = self.tree.get_children()
+        return int(children[-1]) if children else None
+
+    def request(self, on_rows, **page):
+        self.loading = True
+        generation = self.generation
+
+        def callback(rows):
+            if generation == self.generation:
+                self.loading = False
+                self.placeholder.place_forget()
+                on_rows(rows)
+
+        def errback(error):
+            if generation == self.generation:
+                self.loading = False
+                self.placeholder.place_forget()
+            messagebox.showerror("Ошибка", f"Ошибка при загрузке данных: {str(error)}")
+
+        self.fetch(callback, errback, **page, **self.query)
+
+    def sortable(self, columns):
+        # Щелчок по заголовку сортирует по столбцу, повторный - в обратном порядке
+        for column in columns:
+            self.titles[column] = self.tree.heading(column, 'text')
+            self.tree.heading(column, command=lambda c=column: self.sort_by(c))
+
+    def sort_by(self, column):
+        descending = self.query.get('order') == column and not self.query.get('descending')
+        for c, title in self.titles.items():
+            mark = (' ▼' if descending else ' ▲') if c == column else ''
+            self.tree.heading(c, text=f"{title}{mark}")
+        self.query.update(order=column, descending=descending)
+        self.reload()
+
+    def set_filters(self, filters):
+        self.query['filters'] = filters
+        self.reload()
+
+    def include_archive(self, archive):
+        self.query['archive'] = archive
+        self.reload()
+
+    def ordered_by_id(self):
+        # Порядок по умолчанию: по возрастанию id и без фильтров
+        return (self.query.get('order', 'id') == 'id' and not self.query.get('descending')
+                and not any(self.query.get('filters', {}).values()))
+
+    def load_next(self, limit=None):
+        self.pending = False
+        if self.at_end or self.loading:
+            return
+        limit = limit or self.page_size
+        self.request(lambda rows: self.append_rows(rows, limit), after=self.last_id(), limit=limit)
+
+    def append_rows(self, rows, limit):
+        if len(rows) < limit:
+            self.at_end = True
+        anchor = self.top_item()
+        for row in rows:
+            self.tree.insert('', 'end', iid=str(row[0]), values=row)
+        self.trim_top()
+        self.restore_anchor(anchor)
+
+    def load_prev(self):
+        self.pending = False
+        if self.at_start or self.loading:
+            return
+        self.request(self.prepend_rows, before=self.first_id(), limit=self.page_size)
+
+    def prepend_rows(self, rows):
+        if len(rows) < self.page_size:
+            self.at_start = True
+        anchor = self.top_item()
+        for row in reversed(rows):
+            self.tree.insert('', 0, iid=str(row[0]), values=row)
+        excess = len(self.tree.get_children()) - self.max_rows
+        if excess > 0:
+            self.tree.delete(*self.tree.get_children()[-excess:])
+            self.at_end = False
+        self.restore_anchor(anchor)
+
+    def trim_top(self):
+        # Отбрасываем строки сверху, чтобы окно не росло
+        excess = len(self.tree.get_children()) - self.max_rows
+        if excess > 0:
+            self.tree.delete(*self.tree.get_children()[:excess])
+            self.at_start = False
+
+    def patch(self, kind, row_id):
+        # Точечное обновление одной строки по событию изменения
+        iid = str(row_id)
+        if kind == DELETE:
+            if self.tree.exists(iid):
+                self.tree.delete(iid)
+            return
+        generation = self.generation
+
+        def apply(row):
+            if generation != self.generation:
+                return
+            if row is None:
+                if self.tree.exists(iid):
+                    self.tree.delete(iid)
+            elif self.tree.exists(iid):
+                self.tree.item(iid, values=row)
+            elif kind == INSERT and self.at_end and not self.fixed and not self.loading and self.ordered_by_id():
+                # Новые id всегда больше загруженных, поэтому строка попадает в конец окна
+                self.tree.insert('', 'end', iid=iid, values=row)
+                self.trim_top()
+
+        self.fetch_row(row_id, apply,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при загрузке данных: {str(e)}"))
+
+    def refresh(self, rows):
+        # Обновление уже загруженных строк без перечитывания всего окна
+        for row in rows:
+            iid = str(row[0])
+            if self.tree.exists(iid):
+                self.tree.item(iid, values=row)
+
+    def top_item(self):
+        return self.tree.identify_row(1) or None
+
+    def restore_anchor(self, anchor):
+        # После вставки/удаления строк возвращаем в начало видимой области ту же строку
+        if anchor and self.tree.exists(anchor):
+            children = self.tree.get_children()
+            self.tree.yview_moveto(self.tree.index(anchor) / len(children))
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self.loading or self.pending:
+            return
+        # Догружаем, когда до края окна осталось меньше ~страницы
+        margin = min(self.page_size / max(len(self.tree.get_children()), 1), 0.25)
+        if float(last) >= 1.0 - margin and not self.at_end:
+            self.pending = True
+            self.tree.after_idle(self.load_next)
+        elif float(first) <= margin and not self.at_start:
+            self.pending = True
+            self.tree.after_idle(self.load_prev)
+
+
+class Debouncer:
+    # Откладывает вызов, пока пользователь продолжает печатать
+    def __init__(self, widget, callback, delay=SEARCH_DELAY):
+        self.widget = widget
+        self.callback = callback
+        self.delay = delay
+        self.after_id = None
+
+    def __call__(self, event=None):
+        if self.after_id:
+            self.widget.after_cancel(self.after_id)
+        self.after_id = self.widget.after(self.delay, self.fire)
+
+    def fire(self):
+        self.after_id = None
+        self.callback()
+
+
 class SanatoriumApp:
-    def __init__(self, root):
+    def __init__(self, root, server=None, maintenance=False):
         self.root = root
-        self.root.title("Санаторий: система учета")
+        self.root.title("Санаторий: система учета" + (f" ({server})" if server else ""))
+        # Адрес server.py для работы с общей базой с нескольких рабочих мест
+        self.server = server
+        self.client_id = new_client_id()
         self.root.geometry("1000x600")
         
-        # Подключение к БД
-        self.conn = sqlite3.connect('sanatorium.db')
-        self.create_tables()
+        # Индикатор фоновой работы с БД и статистика запросов
+        status_frame = ttk.Frame(root)
+        status_frame.pack(side='bottom', fill='x', padx=10)
+        self.status_var = tk.StringVar()
+        ttk.Label(status_frame, textvariable=self.status_var).pack(side='left')
+        ttk.Button(status_frame, text="Диагностика", command=self.show_diagnostics).pack(side='right')
+        self.root.bind('<F12>', lambda event: self.show_diagnostics())
+        
+        # Подключение к БД: все запросы выполняются в отдельном потоке
+        self.db = DbExecutor(root, self.open_database, self.close_database,
+                             on_busy=self.show_busy, on_error=self.show_db_error)
+        self.root.after(CHECKPOINT_INTERVAL, self.checkpoint)
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
         
         # Создание вкладок
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(pady=10, expand=True, fill='both')
         
-        # Вкладка отдыхающих
-        self.guests_frame = ttk.Frame(self.notebook)
-        self.create_guests_tab()
-        self.notebook.add(self.guests_frame, text="Отдыхающие")
-        
-        # Вкладка услуг
-        self.services_frame = ttk.Frame(self.notebook)
-        self.create_services_tab()
-        self.notebook.add(self.services_frame, text="Платные услуги")
-        
-        # Вкладка записи на прием
-        self.appointments_frame = ttk.Frame(self.notebook)
-        self.create_appointments_tab()
-        self.notebook.add(self.appointments_frame, text="Запись на прием")
-        
-        # Заполняем данные
-        self.update_guests_tree()
-        self.update_services_tree()
-        self.update_appointments_tree()
+        # Изменения строк; вкладки подписываются на них при построении
+        self.changes = ChangeBus()
+        
+        # Вкладки строятся и загружают данные при первом показе, поэтому окно
+        # появляется сразу, сколько бы данных ни было в базе
+        self.tabs = {}
+        self.built = set()
+        self.guests_frame = self.add_tab('guests', "Отдыхающие", self.create_guests_tab, self.update_guests_tree)
+        self.services_frame = self.add_tab('services', "Платные услуги", self.create_services_tab,
+                                           self.update_services_tree)
+        self.appointments_frame = self.add_tab('appointments', "Запись на прием", self.create_appointments_tab,
+                                               self.update_appointments_tree)
+        self.reports_frame = self.add_tab('reports', "Отчёты", self.create_reports_tab)
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+        self.on_tab_changed()
+        
+        # Изменения, сделанные на других рабочих местах, приходят с сервера,
+        # а при общей базе без сервера - из журнала изменений в самой базе
+        self.listener = None
+        self.change_seq = None
+        self.backups = None
+        if server:
+            self.listener = ChangeListener(root, server, self.client_id,
+                                           self.on_remote_change, self.reload_all)
+        else:
+            self.poll_changes()
+        # Перенос в архив и резервные копии включает запуск приложения (maintenance), а не
+        # замеры и проверки; с сервером ими занимается server.py
+        if maintenance and not server:
+            self.root.after(ARCHIVE_START_DELAY, self.archive_old)
+            # Копии делает свой поток со своим соединением, рабочий поток его не ждёт
+            self.backups = BackupScheduler(DB_PATH).start()
+    
+    def add_tab(self, name, text, create, load=None):
+        frame = ttk.Frame(self.notebook)
+        placeholder = ttk.Label(frame, text="Загрузка...")
+        placeholder.pack(expand=True)
+        self.notebook.add(frame, text=text)
+        self.tabs[str(frame)] = (name, create, load, placeholder)
+        return frame
     
-    def create_tables(self):
-        cursor = self.conn.cursor()
+    def on_tab_changed(self, event=None):
+        tab = self.tabs.get(str(self.notebook.select()))
+        if tab is None or tab[0] in self.built:
+            return
+        name, create, load, placeholder = tab
+        self.built.add(name)
+        placeholder.destroy()
+        create()
+        # Данные приходят из рабочего потока, пока вкладка уже показана
+        if load:
+            load()
+    
+    def open_database(self):
+        # Выполняется в рабочем потоке: все задания получают этот репозиторий,
+        # интерфейс сам к базе не обращается. Каждый запрос замеряется для окна диагностики
+        if self.server:
+            return RemoteRepository(self.server, self.client_id)
+        repo = open_repository(factory=InstrumentedConnection)
+        # Правки, вставшие в очередь подряд, DbExecutor сохраняет одним commit
+        repo.group_commit = True
+        return repo
+    
+    def close_database(self, repo):
+        # При штатном выходе переносим WAL в основной файл и обнуляем его
+        repo.checkpoint('TRUNCATE')
+    
+    def checkpoint(self):
+        def job(repo):
+            repo.prune_changelog()
+            repo.checkpoint()
         
-        # Таблица отдыхающих
-        cursor.execute('''CREATE TABLE IF NOT EXISTS guests (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            last_name TEXT NOT NULL,
-                            first_name TEXT NOT NULL,
-                            middle_name TEXT,
-                            birth_date TEXT,
-                            passport TEXT,
-                            phone TEXT,
-                            check_in_date TEXT,
-                            check_out_date TEXT,
-                            room TEXT,
-                            notes TEXT)''')
+        self.db.submit(job)
+        self.root.after(CHECKPOINT_INTERVAL, self.checkpoint)
+    
+    def poll_changes(self):
+        # Изменения из других процессов, открывших ту же базу. Пока их нет, опрос
+        # стоит одного PRAGMA data_version в рабочем потоке
+        seq = self.change_seq
+        
+        def done(result):
+            self.change_seq, changes, reload = result
+            if reload:
+                self.reload_all()
+            for change in changes:
+                self.changes.emit(change.table, change.kind, change.row_id)
+            self.root.after(CHANGE_POLL_INTERVAL, self.poll_changes)
+        
+        self.db.submit(lambda repo: repo.poll_changes(seq), done,
+                       lambda e: self.root.after(CHANGE_POLL_INTERVAL, self.poll_changes), background=True)
+    
+    def archive_old(self):
+        # Фоновый перенос устаревшего в архив: по одной пачке на задание, так что запросы
+        # интерфейса встают в очередь между пачками, а не ждут весь перенос
+        def done(result):
+            appointment_ids, guest_ids = result
+            self.emit_archived(appointment_ids, guest_ids)
+            more = len(appointment_ids) == CHUNK_SIZE or len(guest_ids) == CHUNK_SIZE
+            self.root.after(0 if more else ARCHIVE_INTERVAL, self.archive_old)
+        
+        self.db.submit(lambda repo: repo.archive_step(), done,
+                       lambda e: self.root.after(ARCHIVE_INTERVAL, self.archive_old), background=True)
+    
+    def emit_archived(self, appointment_ids, guest_ids):
+        # Для рабочих списков и календаря перенесённые строки удалены
+        for appointment_id in appointment_ids:
+            self.changes.emit('appointments', DELETE, appointment_id)
+        for guest_id in guest_ids:
+            self.changes.emit('guests', DELETE, guest_id)
+    
+    def on_close(self):
+        if self.listener:
+            self.listener.close()
+        if self.backups:
+            self.backups.stop()
+        self.db.close()
+        self.root.destroy()
+    
+    def show_busy(self, busy):
+        self.status_var.set("Загрузка..." if busy else "")
+        self.root.configure(cursor='watch' if busy else '')
+    
+    def show_db_error(self, error):
+        messagebox.showerror("Ошибка", f"Ошибка базы данных: {str(error)}")
+    
+    def show_diagnostics(self):
+        # Статистика запросов этого сеанса: самые дорогие по суммарному времени сверху
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Диагностика запросов")
+        dialog.geometry("900x500")
         
-        # Таблица услуг
-        cursor.execute('''CREATE TABLE IF NOT EXISTS services (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            name TEXT NOT NULL,
-                            description TEXT,
-                            price REAL NOT NULL,
-                            duration INTEGER)''')
-        
-        # Таблица записей
-        cursor.execute('''CREATE TABLE IF NOT EXISTS appointments (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            guest_id INTEGER NOT NULL,
-                            service_id INTEGER NOT NULL,
-                            date TEXT NOT NULL,
-                            time TEXT NOT NULL,
-                            status TEXT DEFAULT 'Запланирован',
-                            FOREIGN KEY (guest_id) REFERENCES guests (id),
-                            FOREIGN KEY (service_id) REFERENCES services (id))''')
-        
-        self.conn.commit()
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(btn_frame, text="Порог медленных, мс:").pack(side='left', padx=5)
+        threshold_entry = ttk.Entry(btn_frame, width=8)
+        threshold_entry.pack(side='left', padx=5)
+        
+        columns = ('sql', 'calls', 'rows', 'total_ms', 'avg_ms', 'max_ms', 'histogram')
+        titles = ('Запрос', 'Вызовов', 'Строк', 'Всего, мс', 'Среднее, мс', 'Макс, мс', 'Распределение, мс')
+        tree = ttk.Treeview(dialog, columns=columns, show='headings', height=12)
+        for col, title in zip(columns, titles):
+            tree.heading(col, text=title)
+            tree.column(col, width=380 if col == 'sql' else 80, anchor='w')
+        tree.column('histogram', width=220)
+        tree.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        ttk.Label(dialog, text="Медленные запросы:").pack(anchor='w', padx=10)
+        slow_text = tk.Text(dialog, height=8, wrap='word')
+        slow_text.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        def show(snapshot):
+            if snapshot is None or not dialog.winfo_exists():
+                return
+            threshold_entry.delete(0, tk.END)
+            threshold_entry.insert(0, str(snapshot['threshold_ms']))
+            tree.delete(*tree.get_children())
+            for s in snapshot['statements']:
+                tree.insert('', 'end', values=(s['sql'], s['calls'], s['rows'], s['total_ms'], s['avg_ms'],
+                                               s['max_ms'], format_histogram(s['histogram'])))
+            slow_text.delete('1.0', tk.END)
+            for entry in reversed(snapshot['slow']):
+                slow_text.insert(tk.END, f"{entry['time']}  {entry['ms']} мс  {entry['sql']}\n"
+                                         f"    параметры: {entry['parameters']}\n"
+                                         f"    план: {'; '.join(entry['plan']) or '-'}\n")
+        
+        def refresh():
+            self.db.submit(lambda repo: repo.diagnostics(), show)
+        
+        def reset():
+            self.db.submit(lambda repo: repo.reset_diagnostics(), lambda result: refresh())
+        
+        def apply_threshold():
+            try:
+                threshold = float(threshold_entry.get().replace(',', '.'))
+            except ValueError:
+                messagebox.showerror("Ошибка", "Порог должен быть числом", parent=dialog)
+                return
+            self.db.submit(lambda repo: repo.set_slow_query_threshold(threshold), lambda result: refresh())
+        
+        def save():
+            path = filedialog.asksaveasfilename(parent=dialog, defaultextension='.json',
+                                                filetypes=[("JSON", "*.json")])
+            if path:
+                self.db.submit(lambda repo: dump(repo.diagnostics(), path), None,
+                               lambda e: messagebox.showerror("Ошибка", f"Ошибка при сохранении: {str(e)}"))
+        
+        ttk.Button(btn_frame, text="Применить", command=apply_threshold).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="Обновить", command=refresh).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="Сбросить", command=reset).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="Сохранить...", command=save).pack(side='left', padx=5)
+        refresh()
     
     def create_guests_tab(self):
         # Форма добавления отдыхающего
@@ -88,7 +504,12 @@ class SanatoriumApp:
             lbl = ttk.Label(input_frame, text=label)
             lbl.grid(row=i//2, column=(i%2)*2, padx=5, pady=5, sticky='e')
             
-            entry = ttk.Entry(input_frame)
+            if label == 'Номер комнаты:':
+                # Список - свободные на даты заезда и выезда номера, обновляется при открытии
+                entry = ttk.Combobox(input_frame, postcommand=self.suggest_rooms)
+                entry.bind('<FocusIn>', lambda event: self.suggest_rooms())
+            else:
+                entry = ttk.Entry(input_frame)
             entry.grid(row=i//2, column=(i%2)*2+1, padx=5, pady=5, sticky='we')
             self.guest_entries[label[:-1].lower()] = entry
         
@@ -100,6 +521,35 @@ class SanatoriumApp:
         ttk.Button(btn_frame, text="Обновить", command=self.update_guest).pack(side='left', padx=5)
         ttk.Button(btn_frame, text="Удалить", command=self.delete_guest).pack(side='left', padx=5)
         ttk.Button(btn_frame, text="Очистить", command=self.clear_guest_form).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="Импорт...", command=self.import_guests).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="Номера...", command=self.show_rooms).pack(side='left', padx=5)
+        
+        # Поиск по мере ввода
+        search_frame = ttk.Frame(self.guests_frame)
+        search_frame.pack(fill='x', padx=10, pady=5)
+        
+        ttk.Label(search_frame, text="Поиск:").pack(side='left', padx=5)
+        self.guest_search_entry = ttk.Entry(search_frame)
+        self.guest_search_entry.pack(side='left', fill='x', expand=True, padx=5)
+        self.guest_search_entry.bind('<KeyRelease>', Debouncer(self.guest_search_entry, self.filter_guests))
+        
+        # Фильтры списка, выполняются в базе
+        filter_frame = ttk.Frame(self.guests_frame)
+        filter_frame.pack(fill='x', padx=10, pady=5)
+        self.guest_filter_entries = {}
+        for key, label in (('room', "Комната:"), ('date_from', "Заезд с:"), ('date_to', "по:")):
+            ttk.Label(filter_frame, text=label).pack(side='left', padx=5)
+            entry = ttk.Entry(filter_frame, width=12)
+            entry.pack(side='left', padx=5)
+            entry.bind('<Return>', lambda event: self.apply_guest_filters())
+            self.guest_filter_entries[key] = entry
+        ttk.Button(filter_frame, text="Применить", command=self.apply_guest_filters).pack(side='left', padx=5)
+        ttk.Button(filter_frame, text="Сбросить", command=self.reset_guest_filters).pack(side='left', padx=5)
+        # История: выехавшие гости, перенесённые в архив
+        self.guests_archive_var = tk.BooleanVar()
+        ttk.Checkbutton(filter_frame, text="С архивом", variable=self.guests_archive_var,
+                        command=lambda: self.guests_pager.include_archive(self.guests_archive_var.get())
+                        ).pack(side='left', padx=5)
         
         # Таблица отдыхающих
         tree_frame = ttk.Frame(self.guests_frame)
@@ -130,10 +580,13 @@ class SanatoriumApp:
         # Скроллбар
         scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=self.guests_tree.yview)
         scrollbar.pack(side='right', fill='y')
-        self.guests_tree.configure(yscrollcommand=scrollbar.set)
+        self.guests_pager = PagedTree(self.guests_tree, scrollbar, self.fetch_guests_page,
+                                      self.fetch_guest_row)
+        self.guests_pager.sortable(GUEST_SORTS)
         
         # Привязка события выбора
         self.guests_tree.bind('<<TreeviewSelect>>', self.on_guest_select)
+        self.changes.subscribe('guests', self.on_guest_change)
     
     def create_services_tab(self):
         # Форма добавления услуги
@@ -160,6 +613,7 @@ class SanatoriumApp:
         ttk.Button(btn_frame, text="Обновить", command=self.update_service).pack(side='left', padx=5)
         ttk.Button(btn_frame, text="Удалить", command=self.delete_service).pack(side='left', padx=5)
         ttk.Button(btn_frame, text="Очистить", command=self.clear_service_form).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="Импорт...", command=self.import_services).pack(side='left', padx=5)
         
         # Таблица услуг
         tree_frame = ttk.Frame(self.services_frame)
@@ -184,20 +638,26 @@ class SanatoriumApp:
         # Скроллбар
         scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=self.services_tree.yview)
         scrollbar.pack(side='right', fill='y')
-        self.services_tree.configure(yscrollcommand=scrollbar.set)
+        self.services_pager = PagedTree(self.services_tree, scrollbar, self.fetch_services_page,
+                                        self.fetch_service_row)
+        self.services_pager.sortable(SERVICE_SORTS)
         
         # Привязка события выбора
         self.services_tree.bind('<<TreeviewSelect>>', self.on_service_select)
+        self.changes.subscribe('services', self.on_service_change)
     
     def create_appointments_tab(self):
         # Форма добавления записи
         input_frame = ttk.LabelFrame(self.appointments_frame, text="Добавить/Изменить запись")
         input_frame.pack(fill='x', padx=10, pady=5)
         
-        # Выбор отдыхающего
+        # Выбор отдыхающего: список наполняется результатами поиска по введённому тексту
         ttk.Label(input_frame, text="Отдыхающий:").grid(row=0, column=0, padx=5, pady=5, sticky='e')
-        self.guest_combobox = ttk.Combobox(input_frame, state='readonly')
+        self.guest_combobox = ttk.Combobox(input_frame)
         self.guest_combobox.grid(row=0, column=1, padx=5, pady=5, sticky='we')
+        self.guest_combobox.bind('<KeyRelease>', Debouncer(self.guest_combobox, self.filter_guest_combobox))
+        self.guest_filter_text = None
+        self.appointment_id = None
         
         # Выбор услуги
         ttk.Label(input_frame, text="Услуга:").grid(row=1, column=0, padx=5, pady=5, sticky='e')
@@ -226,14 +686,71 @@ class SanatoriumApp:
         ttk.Button(btn_frame, text="Обновить", command=self.update_appointment).pack(side='left', padx=5)
         ttk.Button(btn_frame, text="Удалить", command=self.delete_appointment).pack(side='left', padx=5)
         ttk.Button(btn_frame, text="Очистить", command=self.clear_appointment_form).pack(side='left', padx=5)
-        
-        # Таблица записей
-        tree_frame = ttk.Frame(self.appointments_frame)
-        tree_frame.pack(fill='both', expand=True, padx=10, pady=5)
-        
-        columns = ('id', 'guest_name', 'service_name', 'date', 'time', 'status')
-        
-        self.appointments_tree = ttk.Treeview(tree_frame, columns=columns, show='headings')
+        ttk.Button(btn_frame, text="Найти время", command=self.find_free_slot).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="Экспорт...", command=self.export_appointments).pack(side='left', padx=5)
+        
+        # Календарь и список записей
+        views = ttk.Notebook(self.appointments_frame)
+        views.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        calendar_frame = ttk.Frame(views)
+        views.add(calendar_frame, text="Календарь")
+        self.calendar = CalendarView(calendar_frame, self.fetch_calendar_window, self.fetch_calendar_row,
+                                     self.on_calendar_select)
+        
+        list_frame = ttk.Frame(views)
+        views.add(list_frame, text="Список")
+        
+        # Фильтры списка, выполняются в базе
+        filter_frame = ttk.Frame(list_frame)
+        filter_frame.pack(fill='x', pady=5)
+        ttk.Label(filter_frame, text="Статус:").pack(side='left', padx=5)
+        self.status_filter = ttk.Combobox(filter_frame, state='readonly', width=14,
+                                          values=['', 'Запланирован', 'Выполнен', 'Отменен'])
+        self.status_filter.pack(side='left', padx=5)
+        ttk.Label(filter_frame, text="Услуга:").pack(side='left', padx=5)
+        self.service_filter = ttk.Combobox(filter_frame, state='readonly', width=20)
+        self.service_filter.pack(side='left', padx=5)
+        self.appointment_filter_entries = {}
+        for key, label in (('date_from', "С:"), ('date_to', "По:")):
+            ttk.Label(filter_frame, text=label).pack(side='left', padx=5)
+            entry = ttk.Entry(filter_frame, width=12)
+            entry.pack(side='left', padx=5)
+            entry.bind('<Return>', lambda event: self.apply_appointment_filters())
+            self.appointment_filter_entries[key] = entry
+        for combobox in (self.status_filter, self.service_filter):
+            combobox.bind('<<ComboboxSelected>>', lambda event: self.apply_appointment_filters())
+        ttk.Button(filter_frame, text="Сегодня", command=self.filter_today).pack(side='left', padx=5)
+        ttk.Button(filter_frame, text="Сбросить", command=self.reset_appointment_filters).pack(side='left', padx=5)
+        self.appointments_archive_var = tk.BooleanVar()
+        ttk.Checkbutton(filter_frame, text="С архивом", variable=self.appointments_archive_var,
+                        command=lambda: self.appointments_pager.include_archive(self.appointments_archive_var.get())
+                        ).pack(side='left', padx=5)
+        
+        # Действия над всеми выделенными записями (Ctrl/Shift+щелчок)
+        bulk_frame = ttk.Frame(list_frame)
+        bulk_frame.pack(fill='x', pady=5)
+        ttk.Label(bulk_frame, text="Выделенные:").pack(side='left', padx=5)
+        self.bulk_status_combobox = ttk.Combobox(bulk_frame, state='readonly', width=14,
+                                                 values=['Запланирован', 'Выполнен', 'Отменен'])
+        self.bulk_status_combobox.set('Выполнен')
+        self.bulk_status_combobox.pack(side='left', padx=5)
+        ttk.Button(bulk_frame, text="Установить статус", command=self.bulk_set_status).pack(side='left', padx=5)
+        ttk.Label(bulk_frame, text="Сдвиг, мин:").pack(side='left', padx=5)
+        self.bulk_offset_entry = ttk.Entry(bulk_frame, width=6)
+        self.bulk_offset_entry.pack(side='left', padx=5)
+        ttk.Button(bulk_frame, text="Перенести", command=self.bulk_reschedule).pack(side='left', padx=5)
+        ttk.Button(bulk_frame, text="Удалить", command=self.bulk_delete).pack(side='left', padx=5)
+        ttk.Button(bulk_frame, text="Отменить будущие записи гостя",
+                   command=self.cancel_guest_appointments).pack(side='left', padx=5)
+        
+        tree_frame = ttk.Frame(list_frame)
+        tree_frame.pack(fill='both', expand=True)
+        
+        columns = APPOINTMENT_COLUMNS
+        
+        self.appointments_tree = ttk.Treeview(tree_frame, columns=columns, show='headings',
+                                              displaycolumns=columns[:6], selectmode='extended')
         
         # Настройка колонок
         self.appointments_tree.heading('id', text='ID')
@@ -251,51 +768,228 @@ class SanatoriumApp:
         # Скроллбар
         scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=self.appointments_tree.yview)
         scrollbar.pack(side='right', fill='y')
-        self.appointments_tree.configure(yscrollcommand=scrollbar.set)
+        self.appointments_pager = PagedTree(self.appointments_tree, scrollbar, self.fetch_appointments_page,
+                                            self.fetch_appointment_row)
+        self.appointments_pager.sortable(APPOINTMENT_SORTS)
         
         # Привязка события выбора
         self.appointments_tree.bind('<<TreeviewSelect>>', self.on_appointment_select)
+        self.changes.subscribe('guests', self.on_appointments_guest_change)
+        self.changes.subscribe('services', self.on_appointments_service_change)
+        self.changes.subscribe('appointments', self.on_appointment_change)
         
         # Обновляем комбобоксы
         self.update_comboboxes()
     
+    def create_reports_tab(self):
+        # Параметры отчёта
+        input_frame = ttk.LabelFrame(self.reports_frame, text="Отчёт")
+        input_frame.pack(fill='x', padx=10, pady=5)
+        
+        ttk.Label(input_frame, text="Отчёт:").grid(row=0, column=0, padx=5, pady=5, sticky='e')
+        self.report_combobox = ttk.Combobox(input_frame, state='readonly', values=list(SUMMARY_REPORTS), width=35)
+        self.report_combobox.current(0)
+        self.report_combobox.grid(row=0, column=1, padx=5, pady=5, sticky='we')
+        
+        # По умолчанию - текущий месяц
+        today = datetime.now()
+        ttk.Label(input_frame, text="С (дата):").grid(row=1, column=0, padx=5, pady=5, sticky='e')
+        self.report_from_entry = ttk.Entry(input_frame)
+        self.report_from_entry.insert(0, today.replace(day=1).strftime('%d.%m.%Y'))
+        self.report_from_entry.grid(row=1, column=1, padx=5, pady=5, sticky='we')
+        
+        ttk.Label(input_frame, text="По (дата):").grid(row=2, column=0, padx=5, pady=5, sticky='e')
+        self.report_to_entry = ttk.Entry(input_frame)
+        self.report_to_entry.insert(0, today.strftime('%d.%m.%Y'))
+        self.report_to_entry.grid(row=2, column=1, padx=5, pady=5, sticky='we')
+        
+        # Кнопки
+        btn_frame = ttk.Frame(self.reports_frame)
+        btn_frame.pack(fill='x', padx=10, pady=5)
+        
+        ttk.Button(btn_frame, text="Показать", command=self.show_report).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="Пересчитать", command=self.rebuild_reports).pack(side='left', padx=5)
+        
+        # Архив: завершённые и отменённые записи и давно выехавшие гости в отдельном файле.
+        # Переносится и автоматически; здесь - со своими сроками и сразу
+        archive_frame = ttk.LabelFrame(self.reports_frame, text="Архив")
+        archive_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(archive_frame, text="Записи старше, дней:").pack(side='left', padx=5)
+        self.archive_days_entry = ttk.Entry(archive_frame, width=6)
+        self.archive_days_entry.insert(0, str(APPOINTMENTS_AFTER_DAYS))
+        self.archive_days_entry.pack(side='left', padx=5)
+        ttk.Label(archive_frame, text="Гости после выезда, дней:").pack(side='left', padx=5)
+        self.archive_guest_days_entry = ttk.Entry(archive_frame, width=6)
+        self.archive_guest_days_entry.insert(0, str(GUESTS_AFTER_DAYS))
+        self.archive_guest_days_entry.pack(side='left', padx=5)
+        ttk.Button(archive_frame, text="Перенести в архив", command=self.archive_now).pack(side='left', padx=5)
+        self.archive_status_var = tk.StringVar()
+        ttk.Label(archive_frame, textvariable=self.archive_status_var).pack(side='left', padx=5)
+        self.show_archive_counts()
+        
+        # Таблица отчёта; столбцы задаются при показе
+        tree_frame = ttk.Frame(self.reports_frame)
+        tree_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        self.reports_tree = ttk.Treeview(tree_frame, show='headings')
+        self.reports_tree.pack(side='left', fill='both', expand=True)
+        
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=self.reports_tree.yview)
+        scrollbar.pack(side='right', fill='y')
+        self.reports_tree.configure(yscrollcommand=scrollbar.set)
+    
+    def show_report(self):
+        report = SUMMARY_REPORTS[self.report_combobox.get()]
+        date_from = self.report_from_entry.get().strip() or None
+        date_to = self.report_to_entry.get().strip() or None
+        
+        def done(rows):
+            columns = REPORTS[report][0]
+            self.reports_tree.delete(*self.reports_tree.get_children())
+            self.reports_tree.configure(columns=columns)
+            for col in columns:
+                self.reports_tree.heading(col, text=col)
+                self.reports_tree.column(col, width=150, anchor='w')
+            for row in rows:
+                self.reports_tree.insert('', 'end', values=row)
+        
+        # Отчёт читает только сводные таблицы, поэтому запрос быстрый при любом объёме истории
+        self.db.submit(lambda repo: repo.report(report, date_from, date_to), done,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при построении отчёта: {str(e)}"))
+    
+    def rebuild_reports(self):
+        # Сводные таблицы ведутся триггерами; полный пересчёт нужен только после правки базы в обход них
+        def done(result):
+            self.show_report()
+            messagebox.showinfo("Отчёты", "Сводные таблицы пересчитаны")
+        
+        self.db.submit(lambda repo: repo.rebuild_summaries(), done, lambda e: messagebox.showerror("Ошибка", f"Ошибка при пересчёте: {str(e)}"))
+    
+    def show_archive_counts(self):
+        def done(counts):
+            (guests, archived_guests), (appointments, archived_appointments) = counts['guests'], counts['appointments']
+            self.archive_status_var.set(f"В работе: гостей {guests}, записей {appointments}; "
+                                        f"в архиве: гостей {archived_guests}, записей {archived_appointments}")
+        
+        self.db.submit(lambda repo: repo.archive_counts(), done, background=True)
+    
+    def archive_now(self):
+        try:
+            days = int(self.archive_days_entry.get())
+            guest_days = int(self.archive_guest_days_entry.get())
+        except ValueError:
+            messagebox.showerror("Ошибка", "Сроки - целое число дней")
+            return
+        total = [0, 0]
+        
+        def done(result):
+            appointment_ids, guest_ids = result
+            self.emit_archived(appointment_ids, guest_ids)
+            total[0] += len(appointment_ids)
+            total[1] += len(guest_ids)
+            if len(appointment_ids) == CHUNK_SIZE or len(guest_ids) == CHUNK_SIZE:
+                step()
+                return
+            self.show_archive_counts()
+            messagebox.showinfo("Архив", f"Перенесено записей: {total[0]}, гостей: {total[1]}")
+        
+        def step():
+            self.db.submit(lambda repo: repo.archive_step(days, guest_days), done,
+                           lambda e: messagebox.showerror("Ошибка", f"Ошибка при переносе в архив: {str(e)}"))
+        
+        step()
+    
     def update_comboboxes(self):
-        # Обновление комбобоксов отдыхающих
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT id, last_name || ' ' || first_name || ' ' || COALESCE(middle_name, '') FROM guests")
-        guests = cursor.fetchall()
-        self.guest_combobox['values'] = [f"{g[0]}: {g[1]}" for g in guests]
+        self.filter_guest_combobox(force=True)
+        # Список услуг строится из кэша, без обращения к базе
+        self.db.submit(lambda repo: repo.service_labels(), self.set_service_values)
+    
+    def set_service_values(self, labels):
+        self.service_combobox['values'] = labels
+        self.service_filter['values'] = [''] + list(labels)
+        self.calendar.set_services(labels)
+    
+    def filter_guest_combobox(self, force=False):
+        text = self.guest_combobox.get()
+        # Уже выбранный пункт «id: имя» и повторный ввод того же текста не ищем
+        if not force and (text == self.guest_filter_text or re.match(r'\d+:', text)):
+            return
+        self.guest_filter_text = text
         
-        # Обновление комбобоксов услуг
-        cursor.execute("SELECT id, name FROM services")
-        services = cursor.fetchall()
-        self.service_combobox['values'] = [f"{s[0]}: {s[1]}" for s in services]
+        def done(guests):
+            # Пока шёл запрос, текст могли изменить
+            if text == self.guest_filter_text:
+                self.guest_combobox['values'] = [f"{g[0]}: {g[1]}" for g in guests]
+        
+        self.db.submit(lambda repo: repo.guest_choices(text), done)
+    
+    def filter_guests(self):
+        text = self.guest_search_entry.get()
+        if not fts_query(text):
+            self.guests_pager.reload()
+            return
+        
+        def done(rows):
+            if text == self.guest_search_entry.get():
+                self.guests_pager.show(rows)
+        
+        self.db.submit(lambda repo: repo.search_guests(text), done)
+    
+    def on_remote_change(self, change):
+        self.changes.emit(change.table, change.kind, change.row_id)
+    
+    def reload_all(self):
+        # Изменения нельзя применить по строкам (импорт, перезапуск сервера, отставание
+        # от журнала) - перечитываем показанное
+        for name, create, load, placeholder in self.tabs.values():
+            if name in self.built and load and name != 'appointments':
+                load()
+        if 'appointments' in self.built:
+            self.appointments_pager.reload()
+            self.calendar.reload()
+            self.update_comboboxes()
+    
+    # Распространение изменений по представлениям.
+    # Кэш имён к этому моменту уже обновлён в рабочем потоке тем же заданием, что меняло строку
+    def on_guest_change(self, change):
+        self.guests_pager.patch(change.kind, change.row_id)
+    
+    def on_service_change(self, change):
+        self.services_pager.patch(change.kind, change.row_id)
+    
+    def on_appointments_guest_change(self, change):
+        self.filter_guest_combobox(force=True)
+        if change.kind == UPDATE:
+            self.refresh_appointments_of('guest_id', change.row_id)
+            self.refresh_calendar_of('guest_id', change.row_id)
+    
+    def on_appointments_service_change(self, change):
+        self.db.submit(lambda repo: repo.service_labels(), self.set_service_values)
+        if change.kind == UPDATE:
+            # Могли измениться и название, и длительность услуги
+            self.refresh_appointments_of('service_id', change.row_id)
+            self.refresh_calendar_of('service_id', change.row_id)
+    
+    def on_appointment_change(self, change):
+        self.appointments_pager.patch(change.kind, change.row_id)
+        self.calendar.patch(change.kind, change.row_id)
     
     # Методы для работы с отдыхающими
+    def guest_form_record(self):
+        # Проверяет репозиторий - по тем же правилам, что и при импорте из файла
+        return {column: self.guest_entries[label].get() for label, column in GUEST_FIELDS.items()}
+    
     def add_guest(self):
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute('''INSERT INTO guests 
-                            (last_name, first_name, middle_name, birth_date, passport, phone, 
-                             check_in_date, check_out_date, room, notes) 
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                            (self.guest_entries['фамилия'].get(),
-                             self.guest_entries['имя'].get(),
-                             self.guest_entries['отчество'].get(),
-                             self.guest_entries['дата рождения'].get(),
-                             self.guest_entries['паспорт'].get(),
-                             self.guest_entries['телефон'].get(),
-                             self.guest_entries['дата заезда'].get(),
-                             self.guest_entries['дата выезда'].get(),
-                             self.guest_entries['номер комнаты'].get(),
-                             self.guest_entries['примечания'].get()))
-            self.conn.commit()
-            self.update_guests_tree()
-            self.update_comboboxes()
+        record = self.guest_form_record()
+        
+        def done(guest_id):
+            self.changes.emit('guests', INSERT, guest_id)
             self.clear_guest_form()
             messagebox.showinfo("Успех", "Отдыхающий успешно добавлен")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при добавлении отдыхающего: {str(e)}")
+        
+        self.db.submit(lambda repo: repo.create_guest(record), done,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при добавлении отдыхающего: {str(e)}"),
+                       edit=True)
     
     def update_guest(self):
         selected = self.guests_tree.selection()
@@ -304,30 +998,15 @@ class SanatoriumApp:
             return
         
         guest_id = self.guests_tree.item(selected[0])['values'][0]
+        record = self.guest_form_record()
         
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute('''UPDATE guests SET 
-                            last_name = ?, first_name = ?, middle_name = ?, birth_date = ?, 
-                            passport = ?, phone = ?, check_in_date = ?, check_out_date = ?, 
-                            room = ?, notes = ? WHERE id = ?''',
-                            (self.guest_entries['фамилия'].get(),
-                             self.guest_entries['имя'].get(),
-                             self.guest_entries['отчество'].get(),
-                             self.guest_entries['дата рождения'].get(),
-                             self.guest_entries['паспорт'].get(),
-                             self.guest_entries['телефон'].get(),
-                             self.guest_entries['дата заезда'].get(),
-                             self.guest_entries['дата выезда'].get(),
-                             self.guest_entries['номер комнаты'].get(),
-                             self.guest_entries['примечания'].get(),
-                             guest_id))
-            self.conn.commit()
-            self.update_guests_tree()
-            self.update_comboboxes()
+        def done(result):
+            self.changes.emit('guests', UPDATE, guest_id)
             messagebox.showinfo("Успех", "Данные отдыхающего успешно обновлены")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при обновлении данных: {str(e)}")
+        
+        self.db.submit(lambda repo: repo.update_guest(guest_id, record), done,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при обновлении данных: {str(e)}"),
+                       edit=True)
     
     def delete_guest(self):
         selected = self.guests_tree.selection()
@@ -336,44 +1015,175 @@ class SanatoriumApp:
             return
         
         guest_id = self.guests_tree.item(selected[0])['values'][0]
+        on_error = lambda e: messagebox.showerror("Ошибка", f"Ошибка при удалении отдыхающего: {str(e)}")
         
-        try:
-            # Проверка на наличие записей
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM appointments WHERE guest_id = ?", (guest_id,))
-            count = cursor.fetchone()[0]
-            
+        def deleted(result):
+            self.changes.emit('guests', DELETE, guest_id)
+            self.clear_guest_form()
+            messagebox.showinfo("Успех", "Отдыхающий успешно удален")
+        
+        def checked(count):
             if count > 0:
                 messagebox.showwarning("Предупреждение", 
-                                     "Нельзя удалить отдыхающего с активными записями. Сначала удалите все записи.")
+                                     "Нельзя удалить отдыхающего с записями, в том числе архивными.")
                 return
             
             if messagebox.askyesno("Подтверждение", "Вы уверены, что хотите удалить этого отдыхающего?"):
-                cursor.execute("DELETE FROM guests WHERE id = ?", (guest_id,))
-                self.conn.commit()
-                self.update_guests_tree()
-                self.update_comboboxes()
-                self.clear_guest_form()
-                messagebox.showinfo("Успех", "Отдыхающий успешно удален")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при удалении отдыхающего: {str(e)}")
+                self.db.submit(lambda repo: repo.delete_guest(guest_id), deleted, on_error, edit=True)
+        
+        # Проверка на наличие записей
+        self.db.submit(lambda repo: repo.count_guest_appointments(guest_id), checked, on_error)
     
     def clear_guest_form(self):
         for entry in self.guest_entries.values():
             entry.delete(0, tk.END)
     
-    def update_guests_tree(self):
-        # Очистка дерева
-        for item in self.guests_tree.get_children():
-            self.guests_tree.delete(item)
+    def selected_guest_id(self):
+        selected = self.guests_tree.selection()
+        return int(self.guests_tree.item(selected[0])['values'][0]) if selected else None
+    
+    def suggest_rooms(self):
+        # Подбор номера: свободные на даты из формы, без учёта самого выбранного гостя
+        date_from = self.guest_entries['дата заезда'].get().strip()
+        date_to = self.guest_entries['дата выезда'].get().strip()
+        if not date_from or not date_to:
+            return
+        guest_id = self.selected_guest_id()
         
-        # Заполнение данными
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM guests")
-        guests = cursor.fetchall()
+        def done(rooms):
+            self.guest_entries['номер комнаты']['values'] = [room[1] for room in rooms]
         
-        for guest in guests:
-            self.guests_tree.insert('', 'end', values=guest)
+        # Неверные даты здесь не сообщаются: их проверит сохранение
+        self.db.submit(lambda repo: repo.free_rooms(date_from, date_to, guest_id), done,
+                       lambda e: None, background=True)
+    
+    def show_rooms(self):
+        # Номерной фонд и занятость номеров на период: свободные места, накладки.
+        # Двойной щелчок по номеру подставляет его в форму отдыхающего
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Номера")
+        dialog.transient(self.root)
+        guest_id = self.selected_guest_id()
+        
+        period_frame = ttk.Frame(dialog)
+        period_frame.pack(fill='x', padx=10, pady=5)
+        entries = {}
+        for key, label in (('дата заезда', "Заезд:"), ('дата выезда', "Выезд:")):
+            ttk.Label(period_frame, text=label).pack(side='left', padx=5)
+            entry = ttk.Entry(period_frame, width=12)
+            entry.insert(0, self.guest_entries[key].get().strip())
+            entry.pack(side='left', padx=5)
+            entries[key] = entry
+        shown = ttk.Combobox(period_frame, state='readonly', width=14,
+                             values=list(ROOM_VIEWS))
+        shown.current(0)
+        shown.pack(side='left', padx=5)
+        
+        tree_frame = ttk.Frame(dialog)
+        tree_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        columns = ('number', 'capacity', 'occupied', 'notes')
+        tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=12)
+        for col, text in zip(columns, ('Номер', 'Мест', 'Занято', 'Примечание')):
+            tree.heading(col, text=text)
+            tree.column(col, width=100, anchor='w')
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+        scrollbar.pack(side='right', fill='y')
+        tree.configure(yscrollcommand=scrollbar.set)
+        
+        form_frame = ttk.Frame(dialog)
+        form_frame.pack(fill='x', padx=10, pady=5)
+        form = {}
+        for key, label, width in (('number', "Номер:", 8), ('capacity', "Мест:", 4), ('notes', "Примечание:", 24)):
+            ttk.Label(form_frame, text=label).pack(side='left', padx=5)
+            form[key] = ttk.Entry(form_frame, width=width)
+            form[key].pack(side='left', padx=5)
+        on_error = lambda e: messagebox.showerror("Ошибка", str(e), parent=dialog)
+        
+        def show(rows):
+            tree.delete(*tree.get_children())
+            for room_id, number, capacity, notes, occupied in ROOM_VIEWS[shown.get()](rows):
+                # Номер без учёта в фонде (есть только у гостей) помечен звёздочкой
+                tree.insert('', 'end', iid=str(room_id) if room_id else f"new-{number}",
+                            values=(number if room_id else f"{number} *", capacity, occupied, notes or ''))
+        
+        def refresh():
+            date_from, date_to = entries['дата заезда'].get().strip(), entries['дата выезда'].get().strip()
+            if date_from or date_to:
+                self.db.submit(lambda repo: repo.room_availability(date_from, date_to, guest_id), show, on_error)
+            else:
+                # Без периода - только номерной фонд
+                self.db.submit(lambda repo: [row + (0,) for row in repo.list_rooms()], show, on_error)
+        
+        def selected():
+            item = tree.selection()
+            return item[0] if item and not item[0].startswith('new-') else None
+        
+        def on_select(event):
+            item = tree.selection()
+            if not item:
+                return
+            number, capacity, _, notes = tree.item(item[0])['values']
+            for key, value in (('number', str(number).rstrip(' *')), ('capacity', capacity), ('notes', notes)):
+                form[key].delete(0, tk.END)
+                form[key].insert(0, value)
+        
+        def choose(event):
+            item = tree.selection()
+            if item:
+                room = self.guest_entries['номер комнаты']
+                room.delete(0, tk.END)
+                room.insert(0, str(tree.item(item[0])['values'][0]).rstrip(' *'))
+                dialog.destroy()
+        
+        def values():
+            return form['number'].get(), form['capacity'].get() or 1, form['notes'].get()
+        
+        def add():
+            number, capacity, notes = values()
+            self.db.submit(lambda repo: repo.create_room(number, capacity, notes), lambda result: refresh(), on_error,
+                           edit=True)
+        
+        def update():
+            room_id = selected()
+            if room_id is None:
+                messagebox.showwarning("Предупреждение", "Выберите номер из фонда", parent=dialog)
+                return
+            number, capacity, notes = values()
+            self.db.submit(lambda repo: repo.update_room(int(room_id), number, capacity, notes),
+                           lambda result: refresh(), on_error, edit=True)
+        
+        def delete():
+            room_id = selected()
+            if room_id is not None and messagebox.askyesno("Подтверждение", "Удалить номер из фонда?", parent=dialog):
+                self.db.submit(lambda repo: repo.delete_room(int(room_id)), lambda result: refresh(), on_error,
+                               edit=True)
+        
+        ttk.Button(period_frame, text="Показать", command=refresh).pack(side='left', padx=5)
+        shown.bind('<<ComboboxSelected>>', lambda event: refresh())
+        for text, command in (("Добавить", add), ("Обновить", update), ("Удалить", delete)):
+            ttk.Button(form_frame, text=text, command=command).pack(side='left', padx=5)
+        tree.bind('<<TreeviewSelect>>', on_select)
+        tree.bind('<Double-1>', choose)
+        refresh()
+    
+    def update_guests_tree(self):
+        self.guests_pager.reload()
+    
+    def fetch_guests_page(self, callback, errback, after=None, before=None, limit=PAGE_SIZE, **query):
+        self.db.submit(lambda repo: repo.list_guests(after, before, limit, **query), callback, errback)
+    
+    def apply_guest_filters(self):
+        self.guests_pager.set_filters({key: entry.get().strip()
+                                       for key, entry in self.guest_filter_entries.items()})
+    
+    def reset_guest_filters(self):
+        for entry in self.guest_filter_entries.values():
+            entry.delete(0, tk.END)
+        self.guests_pager.set_filters({})
+    
+    def fetch_guest_row(self, guest_id, callback, errback):
+        self.db.submit(lambda repo: repo.get_guest(guest_id), callback, errback)
     
     def on_guest_select(self, event):
         selected = self.guests_tree.selection()
@@ -397,28 +1207,20 @@ class SanatoriumApp:
         self.guest_entries['примечания'].insert(0, guest[10] if guest[10] else '')
     
     # Методы для работы с услугами
+    def service_form_record(self):
+        return {column: self.service_entries[label].get() for label, column in SERVICE_FIELDS.items()}
+    
     def add_service(self):
-        try:
-            price = float(self.service_entries['цена'].get())
-            duration = int(self.service_entries['длительность (мин)'].get())
-            
-            cursor = self.conn.cursor()
-            cursor.execute('''INSERT INTO services 
-                            (name, description, price, duration) 
-                            VALUES (?, ?, ?, ?)''',
-                            (self.service_entries['название'].get(),
-                             self.service_entries['описание'].get(),
-                             price,
-                             duration))
-            self.conn.commit()
-            self.update_services_tree()
-            self.update_comboboxes()
+        record = self.service_form_record()
+        
+        def done(service_id):
+            self.changes.emit('services', INSERT, service_id)
             self.clear_service_form()
             messagebox.showinfo("Успех", "Услуга успешно добавлена")
-        except ValueError:
-            messagebox.showerror("Ошибка", "Цена и длительность должны быть числами")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при добавлении услуги: {str(e)}")
+        
+        self.db.submit(lambda repo: repo.create_service(record), done,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при добавлении услуги: {str(e)}"),
+                       edit=True)
     
     def update_service(self):
         selected = self.services_tree.selection()
@@ -427,28 +1229,15 @@ class SanatoriumApp:
             return
         
         service_id = self.services_tree.item(selected[0])['values'][0]
+        record = self.service_form_record()
         
-        try:
-            price = float(self.service_entries['цена'].get())
-            duration = int(self.service_entries['длительность (мин)'].get())
-            
-            cursor = self.conn.cursor()
-            cursor.execute('''UPDATE services SET 
-                            name = ?, description = ?, price = ?, duration = ? 
-                            WHERE id = ?''',
-                            (self.service_entries['название'].get(),
-                             self.service_entries['описание'].get(),
-                             price,
-                             duration,
-                             service_id))
-            self.conn.commit()
-            self.update_services_tree()
-            self.update_comboboxes()
+        def done(result):
+            self.changes.emit('services', UPDATE, service_id)
             messagebox.showinfo("Успех", "Данные услуги успешно обновлены")
-        except ValueError:
-            messagebox.showerror("Ошибка", "Цена и длительность должны быть числами")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при обновлении данных: {str(e)}")
+        
+        self.db.submit(lambda repo: repo.update_service(service_id, record), done,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при обновлении данных: {str(e)}"),
+                       edit=True)
     
     def delete_service(self):
         selected = self.services_tree.selection()
@@ -457,44 +1246,71 @@ class SanatoriumApp:
             return
         
         service_id = self.services_tree.item(selected[0])['values'][0]
+        on_error = lambda e: messagebox.showerror("Ошибка", f"Ошибка при удалении услуги: {str(e)}")
         
-        try:
-            # Проверка на наличие записей
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM appointments WHERE service_id = ?", (service_id,))
-            count = cursor.fetchone()[0]
-            
+        def deleted(result):
+            self.changes.emit('services', DELETE, service_id)
+            self.clear_service_form()
+            messagebox.showinfo("Успех", "Услуга успешно удалена")
+        
+        def checked(count):
             if count > 0:
                 messagebox.showwarning("Предупреждение", 
                                      "Нельзя удалить услугу с активными записями. Сначала удалите все записи.")
                 return
             
             if messagebox.askyesno("Подтверждение", "Вы уверены, что хотите удалить эту услугу?"):
-                cursor.execute("DELETE FROM services WHERE id = ?", (service_id,))
-                self.conn.commit()
+                self.db.submit(lambda repo: repo.delete_service(service_id), deleted, on_error, edit=True)
+        
+        # Проверка на наличие записей
+        self.db.submit(lambda repo: repo.count_service_appointments(service_id), checked, on_error)
+    
+    def import_guests(self):
+        self.import_from_file('guests')
+    
+    def import_services(self):
+        self.import_from_file('services')
+    
+    def import_from_file(self, target):
+        path = filedialog.askopenfilename(title="Импорт из файла",
+                                          filetypes=[("Таблицы", "*.csv *.xlsx"), ("Все файлы", "*.*")])
+        if not path:
+            return
+        path = self.server_file(path)
+        
+        def done(result):
+            # Одно обновление представлений на весь импорт
+            if target == 'guests':
+                self.update_guests_tree()
+            else:
                 self.update_services_tree()
+            if 'appointments' in self.built:
+                self.calendar.reload()
                 self.update_comboboxes()
-                self.clear_service_form()
-                messagebox.showinfo("Успех", "Услуга успешно удалена")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при удалении услуги: {str(e)}")
+            messagebox.showinfo("Импорт", format_result(result))
+        
+        self.db.submit(lambda repo: repo.import_file(target, path), done,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при импорте: {str(e)}"))
+    
+    def server_file(self, path):
+        # С сервером файл читает и пишет server.py, и только в своём каталоге обмена:
+        # передаём имя файла, а файл лежит там
+        if self.server:
+            return os.path.basename(path)
+        return path
     
     def clear_service_form(self):
         for entry in self.service_entries.values():
             entry.delete(0, tk.END)
     
     def update_services_tree(self):
-        # Очистка дерева
-        for item in self.services_tree.get_children():
-            self.services_tree.delete(item)
-        
-        # Заполнение данными
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM services")
-        services = cursor.fetchall()
-        
-        for service in services:
-            self.services_tree.insert('', 'end', values=service)
+        self.services_pager.reload()
+    
+    def fetch_services_page(self, callback, errback, after=None, before=None, limit=PAGE_SIZE, **query):
+        self.db.submit(lambda repo: repo.list_services(after, before, limit, **query), callback, errback)
+    
+    def fetch_service_row(self, service_id, callback, errback):
+        self.db.submit(lambda repo: repo.get_service(service_id), callback, errback)
     
     def on_service_select(self, event):
         selected = self.services_tree.selection()
@@ -514,7 +1330,7 @@ class SanatoriumApp:
     # Методы для работы с записями
     def add_appointment(self):
         try:
-            if not self.guest_combobox.get() or not self.service_combobox.get():
+            if not re.match(r'\d+:', self.guest_combobox.get()) or not self.service_combobox.get():
                 messagebox.showerror("Ошибка", "Выберите отдыхающего и услугу")
                 return
 
@@ -530,31 +1346,28 @@ class SanatoriumApp:
             # Проверка даты и времени
             datetime.strptime(date, '%d.%m.%Y')
             datetime.strptime(time, '%H:%M')
-
-            cursor = self.conn.cursor()
-            cursor.execute('''INSERT INTO appointments 
-                              (guest_id, service_id, date, time, status) 
-                              VALUES (?, ?, ?, ?, ?)''',
-                           (guest_id, service_id, date, time, status))
-            self.conn.commit()
-            self.update_appointments_tree()
-            self.clear_appointment_form()
-            messagebox.showinfo("Успех", "Запись успешно добавлена")
         except ValueError as ve:
             messagebox.showerror("Ошибка", f"Некорректный формат данных: {str(ve)}")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при добавлении записи: {str(e)}")
+            return
+
+        starts_at = to_iso_datetime(date, time)
 
+        def done(appointment_id):
+            self.changes.emit('appointments', INSERT, appointment_id)
+            self.clear_appointment_form()
+            messagebox.showinfo("Успех", "Запись успешно добавлена")
 
+        # Пересечения с другими записями проверяет репозиторий
+        self.db.submit(lambda repo: repo.book(guest_id, service_id, starts_at, status), done,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при добавлении записи: {str(e)}"),
+                       edit=True)
     
     def update_appointment(self):
-        selected = self.appointments_tree.selection()
-        if not selected:
+        appointment_id = self.appointment_id
+        if appointment_id is None:
             messagebox.showwarning("Предупреждение", "Выберите запись для изменения")
             return
         
-        appointment_id = self.appointments_tree.item(selected[0])['values'][0]
-        
         try:
             guest_id = int(self.guest_combobox.get().partition(':')[0])
             service_id = int(self.service_combobox.get().partition(':')[0])
@@ -565,84 +1378,258 @@ class SanatoriumApp:
             # Проверка даты и времени
             datetime.strptime(date, '%d.%m.%Y')
             datetime.strptime(time, '%H:%M')
-           
-            cursor = self.conn.cursor()
-            cursor.execute('''UPDATE appointments SET 
-                            guest_id = ?, service_id = ?, date = ?, time = ?, status = ? 
-                            WHERE id = ?''',
-                            (guest_id, service_id, date, time, status, appointment_id))
-            self.conn.commit()
-            self.update_appointments_tree()
-            messagebox.showinfo("Успех", "Запись успешно обновлена")
         except ValueError as ve:
             messagebox.showerror("Ошибка", f"Некорректный формат данных: {str(ve)}")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при обновлении записи: {str(e)}")
+            return
+        
+        starts_at = to_iso_datetime(date, time)
+        
+        def done(result):
+            self.changes.emit('appointments', UPDATE, appointment_id)
+            messagebox.showinfo("Успех", "Запись успешно обновлена")
+        
+        self.db.submit(lambda repo: repo.update_appointment(appointment_id, guest_id, service_id, starts_at, status),
+                       done,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при обновлении записи: {str(e)}"),
+                       edit=True)
     
     def delete_appointment(self):
-        selected = self.appointments_tree.selection()
-        if not selected:
+        appointment_id = self.appointment_id
+        if appointment_id is None:
             messagebox.showwarning("Предупреждение", "Выберите запись для удаления")
             return
         
-        appointment_id = self.appointments_tree.item(selected[0])['values'][0]
+        if not messagebox.askyesno("Подтверждение", "Вы уверены, что хотите удалить эту запись?"):
+            return
+        
+        def done(result):
+            self.changes.emit('appointments', DELETE, appointment_id)
+            self.clear_appointment_form()
+            messagebox.showinfo("Успех", "Запись успешно удалена")
         
+        self.db.submit(lambda repo: repo.delete_appointment(appointment_id), done,
+                       lambda e: messagebox.showerror("Ошибка", f"Ошибка при удалении записи: {str(e)}"),
+                       edit=True)
+    
+    # Массовые операции: одно задание и одна транзакция на всю пачку, затем одно
+    # точечное обновление списка и календаря
+    def selected_appointments(self):
+        ids = [int(iid) for iid in self.appointments_tree.selection()]
+        if not ids:
+            messagebox.showwarning("Предупреждение", "Выделите записи в списке")
+        return ids
+    
+    def run_bulk(self, action, message):
+        def job(repo):
+            ids = action(repo)
+            return ids, repo.get_appointments(ids), repo.get_calendar_entries(ids)
+        
+        def done(result):
+            ids, rows, entries = result
+            self.patch_appointments(ids, rows, entries)
+            messagebox.showinfo("Успех", message.format(count=len(ids)))
+        
+        self.db.submit(job, done, lambda e: messagebox.showerror("Ошибка", f"Ошибка массовой операции: {str(e)}"),
+                       edit=True)
+    
+    def patch_appointments(self, ids, rows, entries):
+        present = {row[0] for row in rows}
+        self.appointments_pager.refresh(rows)
+        for appointment_id in ids:
+            if appointment_id not in present and self.appointments_tree.exists(str(appointment_id)):
+                self.appointments_tree.delete(str(appointment_id))
+        by_id = {entry[0]: entry for entry in entries}
+        self.calendar.place_rows({appointment_id: by_id.get(appointment_id) for appointment_id in ids})
+        if self.appointment_id in ids:
+            self.clear_appointment_form()
+    
+    def bulk_set_status(self):
+        ids = self.selected_appointments()
+        status = self.bulk_status_combobox.get()
+        if ids:
+            self.run_bulk(lambda repo: repo.set_appointments_status(ids, status),
+                          f"Статус «{status}» установлен у записей: {{count}}")
+    
+    def bulk_reschedule(self):
+        ids = self.selected_appointments()
+        if not ids:
+            return
         try:
-            if messagebox.askyesno("Подтверждение", "Вы уверены, что хотите удалить эту запись?"):
-                cursor = self.conn.cursor()
-                cursor.execute("DELETE FROM appointments WHERE id = ?", (appointment_id,))
-                self.conn.commit()
-                self.update_appointments_tree()
-                self.clear_appointment_form()
-                messagebox.showinfo("Успех", "Запись успешно удалена")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при удалении записи: {str(e)}")
+            minutes = int(self.bulk_offset_entry.get())
+        except ValueError:
+            messagebox.showerror("Ошибка", "Сдвиг - целое число минут, например 30 или -60")
+            return
+        self.run_bulk(lambda repo: repo.reschedule_appointments(ids, minutes), "Перенесено записей: {count}")
+    
+    def bulk_delete(self):
+        ids = self.selected_appointments()
+        if ids and messagebox.askyesno("Подтверждение", f"Удалить выделенные записи ({len(ids)})?"):
+            self.run_bulk(lambda repo: repo.delete_appointments(ids), "Удалено записей: {count}")
+    
+    def cancel_guest_appointments(self):
+        # Гость - из выделенных записей, если он у них один, иначе из формы
+        guests = {self.appointments_tree.item(iid)['values'][6] for iid in self.appointments_tree.selection()}
+        if len(guests) == 1:
+            guest_id = int(guests.pop())
+        elif re.match(r'\d+:', self.guest_combobox.get()):
+            guest_id = int(self.guest_combobox.get().partition(':')[0])
+        else:
+            messagebox.showwarning("Предупреждение", "Выберите отдыхающего в форме или его записи в списке")
+            return
+        if messagebox.askyesno("Подтверждение", "Отменить все будущие записи этого отдыхающего?"):
+            self.run_bulk(lambda repo: repo.cancel_guest_appointments(guest_id), "Отменено записей: {count}")
+    
+    def find_free_slot(self):
+        # Ближайшее время, когда свободны и отдыхающий, и услуга, начиная с указанных даты и времени
+        if not re.match(r'\d+:', self.guest_combobox.get()) or not self.service_combobox.get():
+            messagebox.showerror("Ошибка", "Выберите отдыхающего и услугу")
+            return
+        guest_id = int(self.guest_combobox.get().partition(':')[0])
+        service_id = int(self.service_combobox.get().partition(':')[0])
+        date = self.appointment_date_entry.get() or datetime.now().strftime('%d.%m.%Y')
+        starts_at = to_iso_datetime(date, self.appointment_time_entry.get() or '00:00')
+        if starts_at is None:
+            messagebox.showerror("Ошибка", "Некорректный формат данных: дата ДД.ММ.ГГГГ, время ЧЧ:ММ")
+            return
+        ignore = self.appointment_id
+        
+        def done(start):
+            if start is None:
+                messagebox.showinfo("Свободное время", "Свободного времени для этой услуги не найдено")
+                return
+            date, time = from_iso_datetime(start)
+            self.appointment_date_entry.delete(0, tk.END)
+            self.appointment_date_entry.insert(0, date)
+            self.appointment_time_entry.delete(0, tk.END)
+            self.appointment_time_entry.insert(0, time)
+        
+        self.db.submit(lambda repo: repo.next_free_slot(guest_id, service_id, starts_at, ignore), done)
+    
+    def export_appointments(self):
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Выгрузка")
+        dialog.transient(self.root)
+        
+        ttk.Label(dialog, text="Отчёт:").grid(row=0, column=0, padx=5, pady=5, sticky='e')
+        report_combobox = ttk.Combobox(dialog, state='readonly', values=list(EXPORT_REPORTS), width=30)
+        report_combobox.current(0)
+        report_combobox.grid(row=0, column=1, padx=5, pady=5, sticky='we')
+        
+        ttk.Label(dialog, text="С (дата):").grid(row=1, column=0, padx=5, pady=5, sticky='e')
+        date_from_entry = ttk.Entry(dialog)
+        date_from_entry.grid(row=1, column=1, padx=5, pady=5, sticky='we')
+        
+        ttk.Label(dialog, text="По (дата):").grid(row=2, column=0, padx=5, pady=5, sticky='e')
+        date_to_entry = ttk.Entry(dialog)
+        date_to_entry.grid(row=2, column=1, padx=5, pady=5, sticky='we')
+        
+        def save():
+            report = EXPORT_REPORTS[report_combobox.get()]
+            date_from = date_from_entry.get().strip() or None
+            date_to = date_to_entry.get().strip() or None
+            try:
+                date_bounds(date_from, date_to)
+            except ValueError as e:
+                messagebox.showerror("Ошибка", str(e), parent=dialog)
+                return
+            path = filedialog.asksaveasfilename(parent=dialog, defaultextension='.csv',
+                                                filetypes=[("CSV", "*.csv"), ("JSON", "*.json"),
+                                                           ("Parquet", "*.parquet")])
+            if not path:
+                return
+            dialog.destroy()
+            path = self.server_file(path)
+            # Строки пишутся в файл порциями прямо в рабочем потоке
+            self.db.submit(lambda repo: repo.export(report, path, date_from=date_from, date_to=date_to),
+                           lambda count: messagebox.showinfo("Выгрузка", f"Выгружено строк: {count}"),
+                           lambda e: messagebox.showerror("Ошибка", f"Ошибка при выгрузке: {str(e)}"))
+        
+        ttk.Button(dialog, text="Сохранить...", command=save).grid(row=3, column=1, padx=5, pady=5, sticky='e')
     
     def clear_appointment_form(self):
+        # Запись, выбранная в списке или календаре, к которой относятся «Обновить» и «Удалить»
+        self.appointment_id = None
         self.guest_combobox.set('')
         self.service_combobox.set('')
         self.appointment_date_entry.delete(0, tk.END)
         self.appointment_time_entry.delete(0, tk.END)
     
     def update_appointments_tree(self):
-        # Очистка дерева
+        self.appointments_pager.reload()
+        self.calendar.show()
+    
+    def fetch_appointments_page(self, callback, errback, after=None, before=None, limit=PAGE_SIZE, **query):
+        self.db.submit(lambda repo: repo.list_appointments(after, before, limit, **query), callback, errback)
+    
+    def apply_appointment_filters(self):
+        service = self.service_filter.get()
+        filters = {key: entry.get().strip() for key, entry in self.appointment_filter_entries.items()}
+        filters.update(status=self.status_filter.get(),
+                       service_id=int(service.partition(':')[0]) if service else None)
+        self.appointments_pager.set_filters(filters)
+    
+    def filter_today(self):
+        today = datetime.now().strftime('%d.%m.%Y')
+        for entry in self.appointment_filter_entries.values():
+            entry.delete(0, tk.END)
+            entry.insert(0, today)
+        self.apply_appointment_filters()
+    
+    def reset_appointment_filters(self):
+        self.status_filter.set('')
+        self.service_filter.set('')
+        for entry in self.appointment_filter_entries.values():
+            entry.delete(0, tk.END)
+        self.appointments_pager.set_filters({})
+    
+    def fetch_appointment_row(self, appointment_id, callback, errback):
+        self.db.submit(lambda repo: repo.get_appointment(appointment_id), callback, errback)
+    
+    def fetch_calendar_window(self, start, end, callback, errback):
+        self.db.submit(lambda repo: repo.appointments_between(start, end), callback, errback)
+    
+    def fetch_calendar_row(self, appointment_id, callback, errback):
+        self.db.submit(lambda repo: repo.calendar_entry(appointment_id), callback, errback)
+    
+    def refresh_appointments_of(self, column, row_id):
+        # Переименование гостя или услуги: правим имена в загруженных строках по кэшу, без SQL
+        index = APPOINTMENT_COLUMNS.index(column)
+        rows = []
         for item in self.appointments_tree.get_children():
-            self.appointments_tree.delete(item)
-        
-        # Заполнение данными с объединением таблиц
-        cursor = self.conn.cursor()
-        cursor.execute('''SELECT a.id, 
-                         g.last_name || ' ' || g.first_name || ' ' || COALESCE(g.middle_name, ''), 
-                         s.name, a.date, a.time, a.status 
-                         FROM appointments a
-                         JOIN guests g ON a.guest_id = g.id
-                         JOIN services s ON a.service_id = s.id''')
-        appointments = cursor.fetchall()
-        
-        for app in appointments:
-            self.appointments_tree.insert('', 'end', values=app)
+            values = self.appointments_tree.item(item)['values']
+            if values[index] == row_id:
+                appointment_id, _, _, date, time, status, guest_id, service_id = values
+                rows.append((appointment_id, guest_id, service_id, date, time, status))
+        if rows:
+            self.db.submit(lambda repo: repo.describe_appointments(rows), self.appointments_pager.refresh)
+    
+    def refresh_calendar_of(self, column, row_id):
+        # То же для календаря: перечитываются только показанные записи гостя или услуги
+        # (у услуги могла измениться длительность), окна без них не трогаются
+        ids = self.calendar.entries_of(column, row_id)
+        if ids:
+            self.db.submit(lambda repo: repo.get_calendar_entries(ids),
+                           lambda entries: self.calendar.place_rows({entry[0]: entry for entry in entries}))
     
     def on_appointment_select(self, event):
         selected = self.appointments_tree.selection()
         if not selected:
             return
         
-        appointment = self.appointments_tree.item(selected[0])['values']
-        
+        self.fill_appointment_form(self.appointments_tree.item(selected[0])['values'])
+    
+    def on_calendar_select(self, appointment_id):
+        self.fetch_appointment_row(appointment_id, lambda row: row and self.fill_appointment_form(row),
+                                   lambda e: messagebox.showerror("Ошибка", f"Ошибка при загрузке записи: {str(e)}"))
+    
+    def fill_appointment_form(self, appointment):
         # Заполнение формы
         self.clear_appointment_form()
+        self.appointment_id = appointment[0]
         
-        # Находим ID гостя и услуги по имени
-        cursor = self.conn.cursor()
-        
-        # Гость
-        cursor.execute("SELECT id FROM guests WHERE last_name || ' ' || first_name || ' ' || COALESCE(middle_name, '') = ?", 
-                      (appointment[1],))
-        guest_id = cursor.fetchone()[0]
-        
-        # Услуга
-        cursor.execute("SELECT id FROM services WHERE name = ?", (appointment[2],))
-        service_id = cursor.fetchone()[0]
+        # ID гостя и услуги берём из скрытых колонок строки
+        guest_id = appointment[6]
+        service_id = appointment[7]
         
         # Устанавливаем значения в комбобоксы
         self.guest_combobox.set(f"{guest_id}: {appointment[1]}")
@@ -654,9 +1641,12 @@ class SanatoriumApp:
         self.appointment_status_combobox.set(appointment[5])
     
     def __del__(self):
-        self.conn.close()
+        self.db.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Санаторий: система учета")
+    parser.add_argument('--server', help="адрес server.py, например http://127.0.0.1:8765")
+    args = parser.parse_args()
     root = tk.Tk()
-    app = SanatoriumApp(root)
+    app = SanatoriumApp(root, args.server, maintenance=True)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from archive import ALL_GUESTS
+import backup
+from backup import backup_all, restore
+from repository import open_repository
+
+
+def add_departed_guest(repo, last_name):
+    return repo.create_guest({'last_name': last_name, 'first_name': 'Пётр',
+                              'check_in_date': '01.01.2020', 'check_out_date': '10.01.2020'})
+
+
+def test_restore_brings_back_main_and_archive_together(tmp_path):
+    path = str(tmp_path / 'sanatorium.db')
+    repo = open_repository(path)
+    add_departed_guest(repo, 'Иванов')
+    repo.archive_step()
+    add_departed_guest(repo, 'Петров')
+    repo.close()
+    backup = backup_all(path)[0]
+
+    # После копии Петров тоже ушёл в архив
+    repo = open_repository(path)
+    repo.archive_step()
+    repo.close()
+
+    saved = restore(backup, path)
+    assert len(saved) == 2
+    repo = open_repository(path)
+    repo.attach_archive(create=False)
+    names = sorted(row[0] for row in repo.conn.execute(f"SELECT last_name FROM {ALL_GUESTS}"))
+    assert names == ['Иванов', 'Петров']
+    assert repo.conn.execute("SELECT last_name FROM main.guests").fetchall() == [('Петров',)]
+    assert repo.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    repo.close()
+
+
+def test_restore_refuses_open_database(tmp_path):
+    path = str(tmp_path / 'sanatorium.db')
+    repo = open_repository(path)
+    backup = backup_all(path)[0]
+    repo.create_guest({'last_name': 'Иванов', 'first_name': 'Пётр'})
+    with pytest.raises(sqlite3.OperationalError, match="открыта другой программой"):
+        restore(backup, path)
+    assert repo.conn.execute("SELECT COUNT(*) FROM guests").fetchone()[0] == 1
+    repo.close()
+
+
+def test_restore_keeps_the_backup_it_restores(tmp_path):
+    path = str(tmp_path / 'sanatorium.db')
+    open_repository(path).close()
+    backup = backup_all(path)[0]
+    saved = restore(backup, path)
+    assert backup not in saved
+    restore(backup, path)
+
+
+def test_backup_takes_main_and_archive_from_one_snapshot(tmp_path, monkeypatch):
+    path = str(tmp_path / 'sanatorium.db')
+    repo = open_repository(path)
+    add_departed_guest(repo, 'Иванов')
+    repo.archive_step()
+    add_departed_guest(repo, 'Петров')
+
+    # Между копией рабочей базы и копией архива Петров уходит в архив
+    compress = backup.compress
+    def compress_then_archive(source, target):
+        compress(source, target)
+        repo.archive_step()
+    monkeypatch.setattr(backup, 'compress', compress_then_archive)
+    created = backup_all(path)
+    monkeypatch.undo()
+    assert repo.conn.execute("SELECT COUNT(*) FROM main.guests").fetchone()[0] == 0
+    repo.close()
+    assert len(created) == 2
+
+    restore(created[0], path)
+    repo = open_repository(path)
+    repo.attach_archive(create=False)
+    names = sorted(row[0] for row in repo.conn.execute(f"SELECT last_name FROM {ALL_GUESTS}"))
+    assert names == ['Иванов', 'Петров']
+    repo.close()
@@ -0,0 +1,16 @@
+import sqlite3
+
+from database import connect, READONLY_PROFILE
+
+
+def test_readonly_profile_does_not_write(tmp_path):
+    path = tmp_path / 'sanatorium.db'
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE guests (id INTEGER PRIMARY KEY)")
+    conn.close()
+    conn = connect(f"file:{path}?mode=ro", READONLY_PROFILE, uri=True)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM guests").fetchone()[0] == 0
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+    finally:
+        conn.close()
@@ -0,0 +1,46 @@
+import sqlite3
+import time
+
+from executor import DbExecutor
+from repository import open_repository
+
+
+class FakeRoot:
+    # Главный поток не нужен: результаты забираются из очереди напрямую
+    def after(self, ms, callback):
+        pass
+
+
+def wait_result(executor, timeout=5):
+    deadline = time.monotonic() + timeout
+    while executor.results.empty():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    return executor.results.get()
+
+
+def test_read_after_edit_does_not_hold_group_open(tmp_path):
+    path = str(tmp_path / 'test.db')
+
+    def connect():
+        repo = open_repository(path)
+        repo.group_commit = True
+        return repo
+
+    executor = DbExecutor(FakeRoot(), connect)
+    try:
+        started = time.monotonic()
+        executor.submit(lambda repo: repo.create_service({'name': 'Массаж', 'price': '100', 'duration': '30'}),
+                        edit=True)
+        executor.submit(lambda repo: time.sleep(0.5))
+        handler, result, error, background = wait_result(executor)
+        assert error is None
+        assert time.monotonic() - started < 0.4
+        # Пока идёт чтение, запись из другого соединения не ждёт блокировку
+        other = sqlite3.connect(path, timeout=0.05)
+        other.execute("BEGIN IMMEDIATE")
+        assert other.execute("SELECT COUNT(*) FROM services").fetchone()[0] == 1
+        other.rollback()
+        other.close()
+    finally:
+        executor.close()
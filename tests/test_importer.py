@@ -0,0 +1,64 @@
+from database import connect
+from schema import migrate
+from importer import import_file
+from records import guest_values, service_values
+from repository import open_repository
+
+
+HEADER = 'Фамилия,Имя,Номер комнаты,Дата заезда,Дата выезда\n'
+
+
+def test_import_checks_room_places(tmp_path):
+    path = tmp_path / 'guests.csv'
+    path.write_text(HEADER + 'Иванов,Пётр,12,01.01.2020,10.01.2020\n'
+                             'Петров,Иван,12,05.01.2020,15.01.2020\n'
+                             'Сидоров,Олег,12,10.01.2020,20.01.2020\n', encoding='utf-8')
+    repo = open_repository(str(tmp_path / 'sanatorium.db'))
+    try:
+        result = repo.import_file('guests', str(path))
+        assert (result.imported, result.failed) == (2, 1)
+        assert result.errors[0][0] == 3 and 'нет мест' in result.errors[0][1]
+        # Занятость перечитана из БД: номер занят только импортированными гостями
+        assert [row[4] for row in repo.room_index().availability(0, 10 ** 6) if row[1] == '12'] == [1]
+    finally:
+        repo.close()
+
+
+def test_cli_import_registers_rooms(tmp_path):
+    path = tmp_path / 'guests.csv'
+    path.write_text(HEADER + 'Иванов,Пётр,7,01.01.2020,10.01.2020\n', encoding='utf-8')
+    conn = connect(str(tmp_path / 'sanatorium.db'))
+    try:
+        migrate(conn)
+        # Номер прежнего гостя не в фонде: импорт его не касается и таблицу гостей не просматривает
+        with conn:
+            conn.execute("INSERT INTO guests (last_name, first_name, room) VALUES ('Петров', 'Иван', '99')")
+        assert import_file(conn, 'guests', str(path)).imported == 1
+        assert conn.execute("SELECT number FROM rooms").fetchall() == [('7',)]
+    finally:
+        conn.close()
+
+
+def test_import_rejects_bad_rows(tmp_path):
+    guests = tmp_path / 'guests.csv'
+    guests.write_text(HEADER + 'Иванов,Пётр,7,31.02.2020,10.03.2020\n'
+                               'Петров,Иван,7,01.03.2020,10.03.2020\n', encoding='utf-8')
+    services = tmp_path / 'services.csv'
+    services.write_text('Название,Цена,Длительность (мин)\n'
+                        'Массаж,0,30\nВанна,100,0\nДуш,100,20\n', encoding='utf-8')
+    conn = connect(str(tmp_path / 'sanatorium.db'))
+    try:
+        migrate(conn)
+        result = import_file(conn, 'guests', str(guests))
+        assert (result.imported, result.failed) == (1, 1)
+        assert 'Дата заезда' in result.errors[0][1]
+        result = import_file(conn, 'services', str(services))
+        assert (result.imported, [line for line, _ in result.errors]) == (1, [2, 3])
+    finally:
+        conn.close()
+
+
+def test_values_accept_non_text_cells():
+    values = guest_values({'last_name': 'Иванов', 'first_name': 'Пётр', 'room': 12})
+    assert values[8] == '12'
+    assert service_values({'name': 'Массаж', 'price': 150.5, 'duration': 30})[2:] == (150.5, 30)
@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from protocol import RemoteError
+from remote import HttpSession
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    # Отвечает {"result": номер вызова}. delay - пауза перед ответом; при drop
+    # соединение после ответа закрывается без заголовка Connection: close
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.calls += 1
+        time.sleep(self.server.delay)
+        body = json.dumps({'result': self.server.calls}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = self.server.drop
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    httpd.daemon_threads = True
+    httpd.calls = 0
+    httpd.delay = 0
+    httpd.drop = False
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(httpd):
+    return f"http://127.0.0.1:{httpd.server_address[1]}"
+
+
+def test_stale_connection_is_retried(server):
+    server.drop = True
+    session = HttpSession(url(server), 'test', timeout=5)
+    assert session.request('POST', '/call', {})['result'] == 1
+    # Сервер закрыл соединение после ответа: повтор по новому, вызов выполнен один раз
+    assert session.request('POST', '/call', {})['result'] == 2
+    assert server.calls == 2
+
+
+def test_timeout_is_not_retried(server):
+    session = HttpSession(url(server), 'test', timeout=0.2)
+    assert session.request('POST', '/call', {})['result'] == 1
+    # Тайм-аут на переиспользованном соединении: сервер мог выполнить вызов, повторять нельзя
+    server.delay = 0.5
+    with pytest.raises(RemoteError):
+        session.request('POST', '/call', {})
+    time.sleep(0.6)
+    assert server.calls == 2
@@ -0,0 +1,85 @@
+import pytest
+
+from repository import open_repository, CHANGELOG_BATCH
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = open_repository(str(tmp_path / 'sanatorium.db'))
+    yield repo
+    repo.close()
+
+
+def test_archived_rows_cannot_be_changed(repo):
+    guest_id = repo.create_guest({'last_name': 'Иванов', 'first_name': 'Пётр',
+                                  'check_in_date': '01.01.2020', 'check_out_date': '10.01.2020'})
+    service_id = repo.create_service({'name': 'Массаж', 'price': '100', 'duration': '30'})
+    appointment_id = repo.book(guest_id, service_id, '2020-01-05 10:00', 'Выполнен')
+    repo.archive_step(appointment_days=0, guest_days=0)
+    repo.archive_step(appointment_days=0, guest_days=0)
+    assert [row[0] for row in repo.list_guests(archive=True)] == [guest_id]
+
+    with pytest.raises(ValueError, match="в архиве"):
+        repo.update_guest(guest_id, {'last_name': 'Петров', 'first_name': 'Пётр'})
+    with pytest.raises(ValueError, match="в архиве"):
+        repo.delete_guest(guest_id)
+    with pytest.raises(ValueError, match="в архиве"):
+        repo.update_appointment(appointment_id, guest_id, service_id, '2020-01-05 11:00', 'Выполнен')
+    with pytest.raises(ValueError, match="в архиве"):
+        repo.delete_appointment(appointment_id)
+    assert repo.delete_appointments([appointment_id]) == []
+    assert repo.list_guests(archive=True)[0][1] == 'Иванов'
+
+
+def test_missing_row_is_reported(repo):
+    with pytest.raises(ValueError, match="не найден"):
+        repo.update_guest(999, {'last_name': 'Петров', 'first_name': 'Пётр'})
+
+
+def test_poll_skips_own_changes(repo, tmp_path):
+    seq, changes, reload = repo.poll_changes(None)
+    for i in range(CHANGELOG_BATCH + 10):
+        repo.create_guest({'last_name': f'Иванов{i}', 'first_name': 'Пётр'})
+    seq, changes, reload = repo.poll_changes(seq)
+    assert (changes, reload) == ([], False)
+
+    other = open_repository(str(tmp_path / 'sanatorium.db'))
+    try:
+        guest_id = other.create_guest({'last_name': 'Петров', 'first_name': 'Иван'})
+    finally:
+        other.close()
+    seq, changes, reload = repo.poll_changes(seq)
+    assert not reload
+    assert [(change.table, change.row_id) for change in changes] == [('guests', guest_id)]
+
+
+def test_unknown_status_is_rejected(repo):
+    guest_id = repo.create_guest({'last_name': 'Иванов', 'first_name': 'Пётр'})
+    service_id = repo.create_service({'name': 'Массаж', 'price': '100', 'duration': '30'})
+    appointment_id = repo.book(guest_id, service_id, '2030-01-05 10:00')
+    with pytest.raises(ValueError, match="статус"):
+        repo.set_appointments_status([appointment_id], 'Перенесён')
+    with pytest.raises(ValueError, match="статус"):
+        repo.book(guest_id, service_id, '2030-01-05 12:00', 'Перенесён')
+    assert repo.set_appointments_status([appointment_id], 'Выполнен') == [appointment_id]
+
+
+def test_guest_with_archived_appointments_is_kept(repo):
+    guest_id = repo.create_guest({'last_name': 'Иванов', 'first_name': 'Пётр',
+                                  'check_in_date': '01.01.2020', 'check_out_date': '10.01.2030'})
+    service_id = repo.create_service({'name': 'Массаж', 'price': '100', 'duration': '30'})
+    repo.book(guest_id, service_id, '2020-01-05 10:00', 'Выполнен')
+    repo.archive_step(appointment_days=0, guest_days=0)
+    assert repo.list_guests()[0][0] == guest_id
+    assert repo.count_guest_appointments(guest_id) == 1
+    with pytest.raises(ValueError, match="в архиве"):
+        repo.delete_guest(guest_id)
+    assert [row[0] for row in repo.list_guests()] == [guest_id]
+
+
+def test_guest_without_stay_leaves_room_index_unloaded(repo):
+    guest_id = repo.create_guest({'last_name': 'Иванов', 'first_name': 'Пётр', 'room': '12'})
+    assert not repo.rooms.loaded
+    repo.update_guest(guest_id, {'last_name': 'Иванов', 'first_name': 'Пётр', 'room': '12',
+                                 'check_in_date': '01.01.2030', 'check_out_date': '10.01.2030'})
+    assert [row[4] for row in repo.room_availability('01.01.2030', '05.01.2030') if row[1] == '12'] == [1]
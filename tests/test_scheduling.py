@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+from scheduling import IntervalIndex, Scheduler, ScheduleConflict, SEARCH_DAYS, WORKDAY_START, to_minutes
+
+
+def make_scheduler(durations):
+    scheduler = Scheduler()
+    scheduler.durations = dict(durations)
+    scheduler.loaded = True
+    return scheduler
+
+
+def test_next_free_slot_skips_conflicts():
+    scheduler = make_scheduler({1: 30})
+    scheduler.place(1, 10, 1, '2026-12-01 10:00', None)
+    start = to_minutes('2026-12-01 10:00')
+    assert scheduler.next_free_slot(11, 1, start) == start + 30
+
+
+def test_service_longer_than_workday_does_not_hang():
+    scheduler = make_scheduler({1: 24 * 60})
+    scheduler.place(1, 10, 1, '2026-12-01 10:00', None)
+    assert scheduler.next_free_slot(10, 1, to_minutes('2026-12-01 09:00')) is None
+    with pytest.raises(ScheduleConflict, match="Свободного времени"):
+        scheduler.check(10, 1, '2026-12-01 09:00', None)
+
+
+def test_search_is_limited_to_search_days():
+    # Гость занят весь рабочий день каждый день дольше, чем длится поиск
+    scheduler = make_scheduler({1: 30, 2: 12 * 60})
+    first = to_minutes('2026-12-01 00:00') + WORKDAY_START
+    for day in range(SEARCH_DAYS + 1):
+        scheduler.add(day, 10, 2, first + day * 24 * 60)
+    assert scheduler.next_free_slot(10, 1, first) is None
+
+
+def test_lookup_after_long_interval_removed():
+    index = IntervalIndex()
+    index.add(0, 10000, 'long')
+    for start in range(0, 10000, 100):
+        index.add(start, start + 30, start)
+    index.remove(0, 10000, 'long')
+    assert index.overlapping(5000, 5001) == [(5000, 5030, 5000)]
+    assert index.overlapping(5030, 5100) == []
+    # Корзины длинного интервала больше нет: поиск идёт только среди коротких
+    assert list(index.buckets) == [30]
+
+
+def test_overlapping_matches_brute_force():
+    rnd = random.Random(0)
+    index = IntervalIndex()
+    items = set()
+    for i in range(2000):
+        if items and rnd.random() < 0.3:
+            item = rnd.choice(sorted(items))
+            items.remove(item)
+            index.remove(*item)
+        else:
+            start = rnd.randrange(10000)
+            item = (start, start + rnd.choice([0, 15, 30, 60, 600, 5000]), i)
+            items.add(item)
+            index.add(*item)
+        start = rnd.randrange(10000)
+        end = start + rnd.randrange(1, 200)
+        assert index.overlapping(start, end) == sorted(item for item in items if item[0] < end and item[1] > start)
+    assert sorted(index) == sorted(items)
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from repository import open_repository
+from server import SanatoriumService
+
+
+@pytest.fixture
+def service(tmp_path):
+    repo = open_repository(str(tmp_path / 'test.db'), check_same_thread=False)
+    yield SanatoriumService(repo, str(tmp_path / 'exchange'))
+    repo.close()
+
+
+@pytest.mark.parametrize('path', ['../outside.csv', '/tmp/outside.csv', '.', ''])
+def test_file_methods_stay_in_exchange_dir(service, path):
+    with pytest.raises(ValueError):
+        service.call({'method': 'export', 'args': ['appointments', path]}, 'test')
+    with pytest.raises(ValueError):
+        service.call({'method': 'import_file', 'kwargs': {'target': 'guests', 'path': path}}, 'test')
+
+
+def test_export_writes_into_exchange_dir(service, tmp_path):
+    service.call({'method': 'export', 'args': ['appointments', 'july.csv']}, 'test')
+    assert os.path.exists(tmp_path / 'exchange' / 'july.csv')
+
+
+def test_write_id_may_be_keyword(service):
+    guest_id = service.call({'method': 'create_guest', 'args': [{'last_name': 'Иванов', 'first_name': 'Пётр'}]},
+                            'test')
+    service.call({'method': 'update_guest', 'kwargs': {'guest_id': guest_id,
+                                                        'record': {'last_name': 'Петров', 'first_name': 'Пётр'}}},
+                 'test')
+    assert service.changes.entries[-1][1:4] == ('guests', 'update', guest_id)
+
+
+@pytest.mark.parametrize('method', ['import_file', 'archive_step'])
+def test_batch_rejects_methods_with_own_transactions(service, method):
+    with pytest.raises(ValueError):
+        service.batch([{'method': 'create_service', 'args': [{'name': 'Массаж', 'price': '100', 'duration': '30'}]},
+                       {'method': method, 'args': []}], 'test')
+    assert service.call({'method': 'list_services', 'args': []}, 'test') == []